@@ -1,3 +1,4 @@
+import json
 import streamlit as st
 import requests
 import os
@@ -6,6 +7,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_URL = os.getenv("MODAL_API_URL", "") 
+STREAM_API_URL = os.getenv("MODAL_STREAM_API_URL", "")
 
 st.set_page_config(
     page_title="HukumOnline RAG Assistant",
@@ -52,10 +54,74 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def iter_sse(response):
+    """Parses a Server-Sent Events response into (event, data) pairs."""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+def render_references(refs):
+    if refs:
+        st.markdown("### 📚 Referensi")
+        for ref in refs:
+            title = ref.get('title', 'No Title')
+            url = ref.get('url', '#')
+            date = ref.get('publish_date', '')[:10]
+            st.markdown(f"- **[{title}]({url})** \n  *{date}* | `{ref.get('theme', 'General')}`")
+
+def stream_answer(prompt):
+    """Renders the answer token by token from the SSE endpoint."""
+    response = requests.post(STREAM_API_URL, json={"query": prompt}, stream=True, timeout=(10, 120))
+    if response.status_code != 200:
+        st.error(f"Error API: {response.status_code} - {response.text}")
+        return
+
+    status = st.empty()
+    status.caption("Sedang menghubungi ahli hukum digital...")
+    answer_box = st.empty()
+    answer_text, refs, exec_time = "", [], 0
+
+    for event, data in iter_sse(response):
+        if event == "reformulated_query":
+            status.empty()
+            with st.expander("🔍 Analisis Query (Reformulasi)"):
+                st.markdown(f"**Query Asli:** {data.get('original_query', prompt)}")
+                st.markdown(f"**Query Hukum:** {data.get('reformulated_query', 'N/A')}")
+        elif event == "references":
+            refs = data
+        elif event == "token":
+            answer_text += data
+            answer_box.markdown(answer_text + "▌")
+        elif event == "done":
+            exec_time = data.get("execution_time", 0)
+        elif event == "error":
+            st.error(f"Error API: {data.get('detail')}")
+            return
+
+    answer_text = answer_text or "Maaf, tidak dapat menghasilkan jawaban."
+    answer_box.markdown(answer_text)
+    st.caption(f"⏱️ Waktu pemrosesan: {exec_time} detik")
+    render_references(refs)
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": answer_text,
+        "references": refs,
+        "execution_time": exec_time
+    })
+
 st.title("⚖️ Asisten Hukum Online")
 st.caption("Powered by Query Reformulation & RAG")
 
-if not API_URL:
+if not API_URL and not STREAM_API_URL:
     st.warning("⚠️ MODAL_API_URL is not set. Please deploy the backend and set the URL in .env")
 
 if "messages" not in st.session_state:
@@ -80,46 +146,49 @@ if prompt := st.chat_input("Apa pertanyaan hukum Anda?"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        if not API_URL:
+        if not API_URL and not STREAM_API_URL:
             st.error("Cannot process query: API URL missing.")
             st.stop()
             
         try:
-            with st.spinner("Sedang menghubungi ahli hukum digital..."):
-                response = requests.post(f"{API_URL}", json={"query": prompt}, timeout=120)
+            if STREAM_API_URL:
+                stream_answer(prompt)
+            else:
+                with st.spinner("Sedang menghubungi ahli hukum digital..."):
+                    response = requests.post(f"{API_URL}", json={"query": prompt}, timeout=120)
             
-            if response.status_code == 200:
-                data = response.json()
+                if response.status_code == 200:
+                    data = response.json()
                 
-                with st.expander("🔍 Analisis Query (Reformulasi)"):
-                    st.markdown(f"**Query Asli:** {data.get('original_query', prompt)}")
-                    st.markdown(f"**Query Hukum:** {data.get('reformulated_query', 'N/A')}")
+                    with st.expander("🔍 Analisis Query (Reformulasi)"):
+                        st.markdown(f"**Query Asli:** {data.get('original_query', prompt)}")
+                        st.markdown(f"**Query Hukum:** {data.get('reformulated_query', 'N/A')}")
                 
-                answer_text = data.get("answer", "Maaf, tidak dapat menghasilkan jawaban.")
-                exec_time = data.get("execution_time", 0)
+                    answer_text = data.get("answer", "Maaf, tidak dapat menghasilkan jawaban.")
+                    exec_time = data.get("execution_time", 0)
                 
-                st.markdown(answer_text)
-                st.caption(f"⏱️ Waktu pemrosesan: {exec_time} detik")
+                    st.markdown(answer_text)
+                    st.caption(f"⏱️ Waktu pemrosesan: {exec_time} detik")
                 
-                refs = data.get("references", [])
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": answer_text,
-                    "references": refs,
-                    "execution_time": exec_time
-                })
-
-                refs = data.get("references", [])
-                if refs:
-                    st.markdown("### 📚 Referensi")
-                    for ref in refs:
-                        title = ref.get('title', 'No Title')
-                        url = ref.get('url', '#')
-                        date = ref.get('publish_date', '')[:10]
-                        st.markdown(f"- **[{title}]({url})** \n  *{date}* | `{ref.get('theme', 'General')}`")
+                    refs = data.get("references", [])
+                    st.session_state.messages.append({
+                        "role": "assistant", 
+                        "content": answer_text,
+                        "references": refs,
+                        "execution_time": exec_time
+                    })
+
+                    refs = data.get("references", [])
+                    if refs:
+                        st.markdown("### 📚 Referensi")
+                        for ref in refs:
+                            title = ref.get('title', 'No Title')
+                            url = ref.get('url', '#')
+                            date = ref.get('publish_date', '')[:10]
+                            st.markdown(f"- **[{title}]({url})** \n  *{date}* | `{ref.get('theme', 'General')}`")
                     
-            else:
-                st.error(f"Error API: {response.status_code} - {response.text}")
+                else:
+                    st.error(f"Error API: {response.status_code} - {response.text}")
 
         except requests.exceptions.ConnectionError:
             st.error("Gagal terhubung ke Server API. Pastikan API backend berjalan.")
@@ -2,6 +2,25 @@ import modal
 from pydantic import BaseModel
 from typing import List, Optional
 import os
+import threading
+
+# Keep in sync with config.RERANKER_MODEL / EMBEDDING_BACKEND / LOCAL_EMBEDDING_MODEL.
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google").lower()
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "intfloat/multilingual-e5-small")
+# Requests one container serves at once, on threads sharing its engine; their query
+# embeddings and reranker pairs are micro-batched together (config.MICRO_BATCHING).
+CONCURRENT_INPUTS = int(os.getenv("MODAL_CONCURRENT_INPUTS", "16"))
+
+def bake_models():
+    """
+    Image build step: puts the cross-encoder weights (and the local embedding model,
+    if that backend is used) in the image's Hugging Face cache.
+    """
+    from huggingface_hub import snapshot_download
+    snapshot_download(RERANKER_MODEL)
+    if EMBEDDING_BACKEND == "local":
+        snapshot_download(LOCAL_EMBEDDING_MODEL)
 
 rag_image = (
     modal.Image.debian_slim(python_version="3.10")
@@ -12,10 +31,24 @@ rag_image = (
         "langchain-google-genai",
         "faiss-cpu",
         "sentence-transformers",
+        "onnx",
+        "onnxruntime",
         "fastapi",
         "pydantic",
         "python-dotenv"
     )
+    .run_function(bake_models)
+    # Containers load the baked weights instead of contacting the hub; an ONNX export
+    # of them is written once to the volume and reused by later containers.
+    .env({
+        "HF_HUB_OFFLINE": "1",
+        "RERANKER_MODEL": RERANKER_MODEL,
+        "EMBEDDING_BACKEND": EMBEDDING_BACKEND,
+        "LOCAL_EMBEDDING_MODEL": LOCAL_EMBEDDING_MODEL,
+        "RERANKER_ONNX_DIR": "/data/reranker_onnx",
+        "STARTUP_WARMUP": "true",
+        "MICRO_BATCHING": "true"
+    })
     .add_local_dir("src", remote_path="/root/src")
     .add_local_file(".env", remote_path="/root/.env")
 )
@@ -25,6 +58,14 @@ app = modal.App("hukumonline-rag")
 
 class QueryRequest(BaseModel):
     query: str
+    # Optional metadata filters, applied inside the vector search (see src/metadata_index.py)
+    theme: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    date_from: Optional[str] = None  # YYYY-MM-DD, inclusive
+    date_to: Optional[str] = None
+
+    def filters(self):
+        return {"theme": self.theme, "tags": self.tags, "date_from": self.date_from, "date_to": self.date_to}
 
 class Reference(BaseModel):
     title: str
@@ -37,6 +78,11 @@ class QueryResponse(BaseModel):
     reformulated_query: str
     answer: str
     references: List[Reference]
+    execution_time: Optional[float] = None
+    cache: Optional[dict] = None
+    rerank: Optional[dict] = None
+    filters: Optional[dict] = None
+    metrics: Optional[dict] = None
 
 @app.cls(
     image=rag_image, 
@@ -45,52 +91,164 @@ class QueryResponse(BaseModel):
         modal.Secret.from_name("my-groq-secret")
     ], 
     volumes={"/data": vol},
-    keep_warm=1
+    keep_warm=1,
+    allow_concurrent_inputs=CONCURRENT_INPUTS
 )
 class Model:
     def __init__(self):
         self.engine = None
+        self._engine_lock = threading.Lock()
+
+    @modal.enter()
+    def load(self):
+        # Load at container start rather than inside the first request.
+        self.get_engine()
 
     def get_engine(self):
-        if self.engine is None:
-            from src import rag_engine, ingestion, config
-            import os
+        # Concurrent inputs share one engine; only the first of them builds it.
+        with self._engine_lock:
+            if self.engine is None:
+                import logging
+                import time
+                start = time.perf_counter()
+                from src import rag_engine, config, metrics
 
-            possible_paths = ["/data/faiss_index", "/data/data/faiss_index"]
-            final_path = "/data/faiss_index" 
+                possible_paths = ["/data/faiss_index", "/data/data/faiss_index"]
+                final_path = "/data/faiss_index" 
             
-            for p in possible_paths:
-                if os.path.exists(p) and "index.faiss" in os.listdir(p):
-                    final_path = p
-                    print(f"DEBUG: Found valid index at {p}")
-                    break
+                for p in possible_paths:
+                    if os.path.exists(p) and {"index.faiss", "shards.json"} & set(os.listdir(p)):
+                        final_path = p
+                        metrics.log("index_located", path=p)
+                        break
             
-            config.INDEX_PATH = final_path
+                config.INDEX_PATH = final_path
             
-            if os.path.exists(config.INDEX_PATH):
-                print(f"DEBUG: Index found at {config.INDEX_PATH}. Files: {os.listdir(config.INDEX_PATH)}")
-            else:
-                print(f"DEBUG: Index NOT FOUND at {config.INDEX_PATH}. Walking /data to debug:")
-                for root, dirs, files in os.walk("/data"):
-                    print(f"{root} -> {files}")
-
-            print("Initializing RAG Engine (Lazy Load)...")
-            self.engine = rag_engine.RAGEngine()
+                if os.path.exists(config.INDEX_PATH):
+                    metrics.log("index_files", path=config.INDEX_PATH, files=os.listdir(config.INDEX_PATH))
+                else:
+                    # Top level only: walking a large volume would stall the cold start.
+                    metrics.log("index_missing", logging.WARNING, path=config.INDEX_PATH, volume=os.listdir('/data'))
+                locate_s = time.perf_counter() - start
+
+                print("Initializing RAG Engine...")
+                onnx_exported = os.path.exists(config.RERANKER_ONNX_DIR)
+                self.engine = rag_engine.RAGEngine()
+                if config.RERANKER_BACKEND == "onnx" and not onnx_exported:
+                    vol.commit()
+                timings = {"imports_and_locate": round(locate_s, 3), **self.engine.startup_timings}
+                timings["total"] = round(time.perf_counter() - start, 3)
+                metrics.log("cold_start", logging.INFO, timings=timings)
         return self.engine
 
     @modal.method()
-    def process_query(self, query: str):
-        return self.get_engine().process_query(query)
+    def process_query(self, query: str, filters: Optional[dict] = None):
+        return self.get_engine().process_query(query, filters=filters)
 
     @modal.web_endpoint(method="POST", label="query")
     def web_query(self, request: QueryRequest):
+        from fastapi import HTTPException
+        from src.metadata_index import parse_filters
+
         try:
-            result = self.process_query.local(request.query)
+            filters = parse_filters(request.filters())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            result = self.process_query.local(request.query, filters)
             return result
         except Exception as e:
-            from fastapi import HTTPException
             raise HTTPException(status_code=500, detail=str(e))
 
+    @modal.web_endpoint(method="POST", label="query-stream")
+    def web_query_stream(self, request: QueryRequest):
+        """Server-Sent Events: reformulated_query, references, token..., done (or error)."""
+        from fastapi import HTTPException
+        from fastapi.responses import StreamingResponse
+        from src import utils
+        from src.metadata_index import parse_filters
+
+        # Validated before the response starts: once streaming, the status is already 200.
+        try:
+            filters = parse_filters(request.filters())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        engine = self.get_engine()
+
+        def events():
+            try:
+                for event in engine.stream_query(request.query, filters=filters):
+                    yield utils.format_sse(event["event"], event["data"])
+            except Exception as e:
+                yield utils.format_sse("error", {"detail": str(e)})
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    @modal.web_endpoint(method="GET", label="metrics")
+    def web_metrics(self):
+        """
+        Prometheus text exposition of stage latency histograms, token and cost counters.
+        Metrics live in memory, so each container reports only the requests it served.
+        """
+        from fastapi.responses import PlainTextResponse
+        from src import metrics
+
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
     @modal.web_endpoint(method="POST", label="reindex")
     def admin_reindex(self, item: dict):
-        return {"message": "Re-indexing logic needs data source connection"}
+        """
+        Incrementally updates the live index. Payload:
+        {"upsert": [<article>, ...], "delete": [<link>, ...], "compact": false}
+        Articles use the same schema as data/*_sample.json and are keyed by "link".
+        Queries keep being served; their searches only pause while chunks are written.
+        If an embedding or I/O error stops the update partway, whatever was applied is
+        still saved and the error (503 for provider outages, else 500) reports it.
+        """
+        from fastapi import HTTPException
+        from src.incremental import IndexUpdateError
+        from src.rate_limit import is_provider_failure
+
+        engine = self.get_engine()
+        if engine.shards is not None:
+            raise HTTPException(status_code=409, detail="Sharded indexes are rebuilt per theme: python -m src.shards --theme <theme>")
+        if engine.index_manager is None:
+            raise HTTPException(status_code=409, detail="No index loaded. Build the index first.")
+
+        result, error = {}, None
+        try:
+            if item.get("upsert"):
+                result["upsert"] = engine.index_manager.upsert(item["upsert"])
+            if item.get("delete"):
+                result["delete"] = engine.index_manager.delete(item["delete"])
+            if item.get("compact"):
+                result["compacted"] = engine.index_manager.compact()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except IndexUpdateError as e:
+            result[e.operation] = e.stats
+            error = e.__cause__
+        except Exception as e:
+            error = e
+
+        # Save whatever was applied so the volume matches what the container now serves.
+        saved = False
+        try:
+            engine.index_manager.save()
+            vol.commit()
+            saved = True
+        except Exception as e:
+            error = error or e
+
+        result["version"] = engine.index_manager.version
+        if error is not None:
+            result["saved"] = saved
+            raise HTTPException(
+                status_code=503 if is_provider_failure(error) else 500,
+                detail={"error": f"{type(error).__name__}: {error}", "applied": result}
+            )
+        return result
@@ -0,0 +1,207 @@
+"""
+FAISS index types for the vectorstore.
+
+"flat" is the exact IndexFlatL2 LangChain creates by default. "hnsw" is a graph index
+(no training, fast, memory grows with M). "ivf_flat", "ivf_pq" and "ivf_sq" partition
+vectors into `nlist` clusters and search `nprobe` of them; the PQ/SQ variants also
+compress the stored vectors. IVF indexes must be trained on a sample before vectors
+are added. Every type uses L2 distance, so relevance scores and filters behave as with
+the flat index.
+
+"flat", "hnsw" and "ivf_flat" can store their vectors as float16 or int8 scalar
+quantizer codes instead (`storage`; int8 needs training too). With `rescore` > 0 the
+index is wrapped in an IndexRefineFlat that also keeps the float32 vectors: the
+quantized index finds k * rescore candidates and the exact vectors reorder them. That
+copy is a flat index, so a memory-mapped load leaves it on disk except for the rows a
+search touches.
+"""
+import faiss
+import numpy as np
+from . import config
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "ivf_sq")
+STORAGE_TYPES = ("float32", "float16", "int8")
+_QUANTIZER_TYPES = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+def ann_params(index_type=None, **overrides):
+    """Build parameters for `index_type`, taken from config unless overridden."""
+    index_type = (index_type or config.ANN_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown ANN_INDEX_TYPE '{index_type}'. Options: {', '.join(INDEX_TYPES)}.")
+    params = {"type": index_type, "storage": config.EMBEDDING_STORAGE, "rescore": config.EMBEDDING_RESCORE_FACTOR}
+    if index_type == "hnsw":
+        params.update(m=config.ANN_HNSW_M, ef_construction=config.ANN_HNSW_EF_CONSTRUCTION)
+    elif index_type.startswith("ivf"):
+        params.update(nlist=config.ANN_NLIST)
+        if index_type == "ivf_pq":
+            params.update(pq_m=config.ANN_PQ_M, pq_nbits=config.ANN_PQ_NBITS)
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    if params["storage"] not in STORAGE_TYPES:
+        raise ValueError(f"Unknown EMBEDDING_STORAGE '{params['storage']}'. Options: {', '.join(STORAGE_TYPES)}.")
+    return params
+
+def _quantizer_type(params):
+    """Scalar quantizer of the stored vectors, None for float32 or self-compressing types."""
+    if params["type"] in ("ivf_pq", "ivf_sq"):
+        return None
+    return _QUANTIZER_TYPES.get(params.get("storage", "float32"))
+
+def needs_training(params):
+    return params["type"].startswith("ivf") or _quantizer_type(params) == faiss.ScalarQuantizer.QT_8bit
+
+def _largest_divisor(dim, limit):
+    return max(d for d in range(1, min(dim, limit) + 1) if dim % d == 0)
+
+def make_index(dim, params, train_vectors=None):
+    """
+    Creates an empty index of `params["type"]` and `params["storage"]`. IVF and int8
+    types are trained on `train_vectors`; nlist (0 = auto, ~4*sqrt(n)) and PQ bits are
+    clamped to what the sample supports.
+    """
+    index_type = params["type"]
+    qtype = _quantizer_type(params)
+    if needs_training(params) and (train_vectors is None or len(train_vectors) == 0):
+        raise ValueError(f"'{index_type}' index with {params.get('storage')} storage needs training vectors.")
+    if train_vectors is not None:
+        train_vectors = np.ascontiguousarray(train_vectors, dtype=np.float32)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim) if qtype is None else faiss.IndexScalarQuantizer(dim, qtype)
+    elif index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, params["m"])
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, params["m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    else:
+        index = _make_ivf(dim, params, qtype, len(train_vectors))
+
+    if params.get("rescore") and qtype is not None:
+        index = faiss.IndexRefineFlat(index)
+        index.k_factor = params["rescore"]
+    if needs_training(params):
+        index.train(train_vectors)
+    return index
+
+def _make_ivf(dim, params, qtype, n):
+    index_type = params["type"]
+    nlist = params["nlist"] or int(4 * np.sqrt(n))
+    # k-means wants ~39 points per centroid; fewer only yields empty or noisy lists.
+    nlist = max(1, min(nlist, n // 39 or 1))
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat" and qtype is not None:
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype)
+    elif index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    elif index_type == "ivf_sq":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+    else:
+        pq_m = _largest_divisor(dim, params["pq_m"])
+        pq_nbits = params["pq_nbits"]
+        while pq_nbits > 1 and 2 ** pq_nbits > n:
+            pq_nbits -= 1
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+    return index
+
+def _base(index):
+    """The searching index: the quantized one inside an IndexRefineFlat, else `index` itself."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        return faiss.downcast_index(index.base_index)
+    return index
+
+def set_search_params(index, ef_search=None, nprobe=None):
+    """Applies search-time knobs that fit the index type; others are ignored."""
+    index = _base(index)
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+
+def describe(index):
+    """Type and current search parameters of a (possibly loaded) index."""
+    outer = faiss.downcast_index(index)
+    index = _base(outer)
+    info = {"class": type(index).__name__, "ntotal": index.ntotal, "bytes": memory_bytes(index)}
+    if isinstance(outer, faiss.IndexRefine):
+        info.update(rescore=outer.k_factor, rescore_bytes=memory_bytes(outer) - info["bytes"])
+    if isinstance(index, faiss.IndexHNSW):
+        info.update(ef_search=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        info.update(nlist=index.nlist, nprobe=index.nprobe)
+    return info
+
+def memory_bytes(index):
+    """Serialized size, a close proxy for the index's resident memory."""
+    return int(faiss.serialize_index(index).size)
+
+def supports_remove(index):
+    """
+    Only flat indexes (float or scalar-quantized) renumber the remaining vectors on
+    remove_ids, which is what the LangChain docstore mapping assumes. HNSW cannot
+    remove at all, IVF keeps the old labels and IndexRefineFlat does not implement it,
+    so those are rebuilt instead.
+    """
+    return isinstance(faiss.downcast_index(index), faiss.IndexFlatCodes)
+
+def stored_vectors(index):
+    """Every vector in `index`, in position order (decoded for PQ/SQ types, exact if rescored)."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def rebuild_without(index, positions):
+    """
+    Returns (copy of `index` without the vectors at `positions`, kept positions). The
+    copy keeps the trained IVF centroids / PQ codebooks; PQ vectors are re-added from
+    their decoded form, which encodes back to the same codes. A rescored index is
+    re-added from its float32 copy.
+    """
+    index = faiss.downcast_index(index)
+    drop = set(positions)
+    keep = [i for i in range(index.ntotal) if i not in drop]
+    vectors = stored_vectors(index)[keep]
+    # Not clone_index: a copy of a memory-mapped index would still view the mapping.
+    rebuilt = faiss.deserialize_index(faiss.serialize_index(index))
+    rebuilt.reset()
+    if isinstance(rebuilt, faiss.IndexIVF):
+        rebuilt.set_direct_map_type(faiss.DirectMap.NoMap)
+    if keep:
+        rebuilt.add(vectors)
+    return rebuilt, keep
+
+def filtered_search(index, queries, k, mask):
+    """
+    index.search restricted to the positions where `mask` is True, applied inside FAISS
+    through an IDSelectorBitmap. HNSW graph search only returns allowed nodes it
+    happens to visit, so small selections (config.FILTER_EXACT_MAX) are instead
+    searched exactly over their reconstructed vectors. Returns (distances, positions).
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    allowed = np.flatnonzero(mask)
+    index = faiss.downcast_index(index)
+    base = _base(index)
+    if not len(allowed):
+        return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                np.full((len(queries), k), -1, dtype=np.int64))
+    if isinstance(base, faiss.IndexHNSW) and len(allowed) <= config.FILTER_EXACT_MAX:
+        # Reconstructed from the float32 copy when the index has one.
+        distances, picks = faiss.knn(queries, index.reconstruct_batch(allowed), min(k, len(allowed)))
+        positions = np.where(picks >= 0, allowed[np.maximum(picks, 0)], -1)
+        return distances, positions
+
+    # The selector reads `bitmap` through a raw pointer, so it must outlive the search.
+    bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    if isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    elif isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=base.nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    if isinstance(index, faiss.IndexRefine):
+        # Likewise for the base parameters, which the refine parameters only point to.
+        base_params = params
+        params = faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=base_params)
+    return index.search(queries, k, params=params)
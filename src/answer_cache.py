@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+class SemanticAnswerCache:
+    """
+    Serves a stored pipeline result when a new query's embedding is within
+    `threshold` cosine similarity of a cached query.
+
+    Entries are evicted LRU beyond `max_size` and expire after `ttl` seconds. Every
+    entry belongs to one index version; seeing a different version clears the cache,
+    so answers never outlive a reindex or incremental update.
+    """
+
+    def __init__(self, threshold=0.95, max_size=512, ttl=3600, clock=time.time):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, index_version):
+        if index_version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = index_version
+
+    def _expire(self):
+        now = self._clock()
+        expired = [key for key, (_, _, created) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, vector, index_version):
+        """Returns (result, similarity) on a hit and (None, best_similarity) on a miss."""
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version(index_version)
+            self._expire()
+            best_key, best_sim = None, 0.0
+            if self._entries:
+                keys = list(self._entries.keys())
+                matrix = np.stack([self._entries[k][0] for k in keys])
+                sims = matrix @ query
+                idx = int(np.argmax(sims))
+                best_key, best_sim = keys[idx], float(sims[idx])
+
+            if best_key is not None and best_sim >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key][1], best_sim
+            self.misses += 1
+            return None, best_sim
+
+    def store(self, vector, result, index_version):
+        with self._lock:
+            self._check_version(index_version)
+            self._entries[self._next_id] = (self._normalize(vector), result, self._clock())
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._entries),
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,155 @@
+"""
+Dynamic micro-batching of the engine's local model calls across concurrent requests.
+
+A MicroBatcher queues the items of every caller (query texts, cross-encoder pairs) and
+hands them to one `batch_fn` call per batch. A batch is sent as soon as it holds
+`max_batch` items or its oldest request has waited `max_wait` seconds; while the
+workers are busy, requests keep queueing, so batches grow with the load and a lone
+request waits at most `max_wait`. Callers block on (or await) only their own results.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from . import config, metrics
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into shared `batch_fn` calls. `batch_fn` takes a list of
+    items and returns one result per item, in order. Requests are never split: one
+    larger than `max_batch` goes out as a batch of its own.
+    """
+
+    def __init__(self, name, batch_fn, max_batch, max_wait=None, workers=1):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = config.MICRO_BATCH_MAX_WAIT_MS / 1000 if max_wait is None else max_wait
+        self._queue = deque()  # (items, future, enqueued at)
+        self._pending = 0
+        self._batches = 0
+        self._requests = 0
+        self._items = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-batcher-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, items):
+        """Queues `items`; returns a Future of their results."""
+        items = list(items)
+        future = Future()
+        if not items:
+            future.set_result([])
+            return future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"The {self.name} batcher is closed.")
+            self._queue.append((items, future, time.perf_counter()))
+            self._pending += len(items)
+            metrics.BATCH_QUEUE_DEPTH.set(self._pending, batcher=self.name)
+            self._cond.notify()
+        return future
+
+    def __call__(self, items):
+        return self.submit(items).result()
+
+    async def acall(self, items):
+        return await asyncio.wrap_future(self.submit(items))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "items": self._items,
+                "queued": self._pending
+            }
+
+    def close(self):
+        """Sends what is still queued, then stops the workers."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+
+    def _take(self):
+        """Waits for the next due batch; None once closed and drained."""
+        with self._cond:
+            while True:
+                if self._queue:
+                    waited = time.perf_counter() - self._queue[0][2]
+                    if self._pending >= self.max_batch or waited >= self.max_wait or self._closed:
+                        break
+                    self._cond.wait(self.max_wait - waited)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            batch, size = [], 0
+            while self._queue and (not batch or size + len(self._queue[0][0]) <= self.max_batch):
+                items, future, enqueued = self._queue.popleft()
+                self._pending -= len(items)
+                # Skips requests whose caller gave up (e.g. a cancelled asyncio task).
+                if future.set_running_or_notify_cancel():
+                    batch.append((items, future, enqueued))
+                    size += len(items)
+            metrics.BATCH_QUEUE_DEPTH.set(self._pending, batcher=self.name)
+            if batch:
+                self._batches += 1
+                self._requests += len(batch)
+                self._items += size
+            if self._queue:
+                self._cond.notify()
+            return batch
+
+    def _work(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        items = [item for request_items, _, _ in batch for item in request_items]
+        now = time.perf_counter()
+        for _, _, enqueued in batch:
+            metrics.BATCH_WAIT_SECONDS.observe(now - enqueued, batcher=self.name)
+        metrics.BATCH_SIZE.observe(len(items), batcher=self.name)
+        metrics.BATCH_REQUESTS.observe(len(batch), batcher=self.name)
+        try:
+            results = list(self.batch_fn(items))
+            if len(results) != len(items):
+                raise ValueError(f"{self.name} batch returned {len(results)} results for {len(items)} items.")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for request_items, future, _ in batch:
+            future.set_result(results[start:start + len(request_items)])
+            start += len(request_items)
+
+class BatchedReranker:
+    """
+    Wraps a reranker so that predict() calls of concurrent requests share
+    cross-encoder batches of up to `max_batch` pairs.
+    """
+
+    def __init__(self, reranker, max_batch=None, max_wait=None):
+        self.reranker = reranker
+        self.batcher = MicroBatcher("rerank", reranker.predict, max_batch or config.RERANK_MICRO_BATCH_SIZE, max_wait)
+
+    def predict(self, pairs, batch_size=None):
+        # The wrapped reranker's own batch size applies to the shared batch.
+        return np.asarray(self.batcher([list(pair) for pair in pairs]), dtype=np.float32)
@@ -0,0 +1,221 @@
+"""
+Persistent BM25 inverted index over chunk text.
+
+Postings are stored CSR-style as .npy files next to the FAISS index and opened
+memory-mapped: term i's postings are docs[offsets[i]:offsets[i + 1]] with their term
+frequencies in tfs. Documents are addressed by docstore id, so results resolve through
+the same docstore as dense hits. Chunks added or removed after load live in an
+in-memory overlay until the next save(), which merges everything back into the files.
+"""
+import json
+import math
+import os
+import re
+from array import array
+from collections import Counter
+import numpy as np
+from . import config
+
+VOCAB_FILE = "bm25_vocab.json"
+OFFSETS_FILE = "bm25_offsets.npy"
+DOCS_FILE = "bm25_docs.npy"
+TFS_FILE = "bm25_tfs.npy"
+LENGTHS_FILE = "bm25_lengths.npy"
+IDS_FILE = "bm25_ids.npy"
+
+# Frequent Indonesian function words. Legal vocabulary ("pasal", "ayat", "uu", "tahun",
+# "nomor") is deliberately absent: it is what citations are matched on.
+STOPWORDS = frozenset("""
+ada adalah agar akan aku anda apa apakah atas atau bagaimana bagi bahwa baik bisa
+boleh bukan dalam dan dapat dari demikian dengan di dia harus hal hanya ia ini itu
+jadi jika juga kalau kami kamu karena ke kepada ketika kita lagi lain maka masih
+mana mereka namun oleh pada para per perlu saat saja sama sampai sangat saya
+sebagai sebelum sedang sehingga sejak selain seperti serta setelah sudah tanpa
+telah tentang tersebut tetapi untuk yaitu yakni yang
+""".split())
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+# Enclitics that glue onto content words ("perusahaannya", "meskipun"). Other
+# suffixes (-lah, -kah) also end plain words ("masalah", "langkah") and are kept.
+_SUFFIX_RE = re.compile(r"(nya|pun)$")
+
+def tokenize(text):
+    """Lowercased alphanumeric tokens without stopwords; numbers kept ("pasal 1320")."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        stripped = _SUFFIX_RE.sub("", token)
+        tokens.append(stripped if len(stripped) >= 4 and not stripped.isdigit() else token)
+    return tokens
+
+def _replace_npy(path, array_):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array_)
+    os.replace(path + ".tmp", path)
+
+class BM25Index:
+    def __init__(self, k1=None, b=None):
+        self.k1 = config.BM25_K1 if k1 is None else k1
+        self.b = config.BM25_B if b is None else b
+        self._vocab = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.uint16)
+        self._lengths = np.zeros(0, dtype=np.uint32)
+        self._ids = np.zeros(0, dtype="S1")
+        # Overlay: documents added since load, numbered after the base documents.
+        self._new_postings = {}
+        self._new_lengths = array("I")
+        self._new_ids = []
+        self._deleted = set()
+
+    @property
+    def base_size(self):
+        return len(self._lengths)
+
+    def __len__(self):
+        return self.base_size + len(self._new_ids) - len(self._deleted)
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, VOCAB_FILE))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, VOCAB_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(k1=meta["k1"], b=meta["b"])
+        index._vocab = {term: i for i, term in enumerate(meta["terms"])}
+        index._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        index._docs = np.load(os.path.join(path, DOCS_FILE), mmap_mode="r")
+        index._tfs = np.load(os.path.join(path, TFS_FILE), mmap_mode="r")
+        index._lengths = np.load(os.path.join(path, LENGTHS_FILE), mmap_mode="r")
+        index._ids = np.load(os.path.join(path, IDS_FILE), mmap_mode="r")
+        return index
+
+    def add(self, ids, texts):
+        for doc_id, text in zip(ids, texts):
+            number = self.base_size + len(self._new_ids)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                docs, tfs = self._new_postings.setdefault(term, (array("I"), array("H")))
+                docs.append(number)
+                tfs.append(min(tf, 65535))
+            self._new_ids.append(doc_id)
+            self._new_lengths.append(sum(counts.values()))
+
+    def delete(self, ids):
+        """Hides chunks from results now; they are dropped from the files on save()."""
+        self._deleted.update(ids)
+
+    def _postings(self, term):
+        docs, tfs = [], []
+        i = self._vocab.get(term)
+        if i is not None:
+            start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+            docs.append(np.asarray(self._docs[start:end], dtype=np.int64))
+            tfs.append(np.asarray(self._tfs[start:end], dtype=np.float32))
+        if term in self._new_postings:
+            new_docs, new_tfs = self._new_postings[term]
+            docs.append(np.frombuffer(new_docs, dtype=np.uint32).astype(np.int64))
+            tfs.append(np.frombuffer(new_tfs, dtype=np.uint16).astype(np.float32))
+        if not docs:
+            return None, None
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def _doc_id(self, number):
+        if number < self.base_size:
+            return self._ids[number].decode("utf-8")
+        return self._new_ids[number - self.base_size]
+
+    def search(self, query, k, accept=None):
+        """
+        Top-k (docstore id, score) pairs for `query`, best first. With `accept`, a
+        predicate on docstore ids, hits it rejects are skipped and ranking continues.
+        """
+        terms = set(tokenize(query))
+        size = self.base_size + len(self._new_ids)
+        if not terms or not size:
+            return []
+        lengths = np.concatenate([
+            np.asarray(self._lengths, dtype=np.float32),
+            np.frombuffer(self._new_lengths, dtype=np.uint32).astype(np.float32)
+        ])
+        avgdl = max(float(lengths.sum()) / size, 1.0)
+        scores = np.zeros(size, dtype=np.float32)
+        for term in terms:
+            docs, tfs = self._postings(term)
+            if docs is None:
+                continue
+            idf = math.log(1 + (size - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avgdl)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        hits = np.flatnonzero(scores)
+        fetch = len(hits) if accept else min(len(hits), k + len(self._deleted))
+        top = hits[np.argpartition(-scores[hits], fetch - 1)[:fetch]] if fetch else hits[:0]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        results = []
+        for number in top:
+            doc_id = self._doc_id(int(number))
+            if doc_id in self._deleted or (accept and not accept(doc_id)):
+                continue
+            results.append((doc_id, float(scores[number])))
+            if len(results) == k:
+                break
+        return results
+
+    def save(self, path):
+        """Merges the overlay into the base postings and rewrites the files."""
+        ids = [self._doc_id(n) for n in range(self.base_size + len(self._new_ids))]
+        keep = np.array([doc_id not in self._deleted for doc_id in ids], dtype=bool)
+        renumber = np.cumsum(keep) - 1
+        lengths = np.concatenate([
+            np.asarray(self._lengths, dtype=np.uint32),
+            np.frombuffer(self._new_lengths, dtype=np.uint32)
+        ])[keep]
+        kept_ids = [doc_id for doc_id, kept in zip(ids, keep) if kept]
+        width = max((len(doc_id.encode("utf-8")) for doc_id in kept_ids), default=1)
+
+        terms = list(self._vocab) + [t for t in self._new_postings if t not in self._vocab]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        all_docs, all_tfs, vocab = [], [], []
+        for term in terms:
+            docs, tfs = self._postings(term)
+            mask = keep[docs]
+            if not mask.any():
+                continue
+            all_docs.append(renumber[docs[mask]].astype(np.int32))
+            all_tfs.append(tfs[mask].astype(np.uint16))
+            vocab.append(term)
+            offsets[len(vocab)] = offsets[len(vocab) - 1] + int(mask.sum())
+        offsets = offsets[:len(vocab) + 1]
+
+        os.makedirs(path, exist_ok=True)
+        _replace_npy(os.path.join(path, OFFSETS_FILE), offsets)
+        _replace_npy(os.path.join(path, DOCS_FILE), np.concatenate(all_docs) if all_docs else np.zeros(0, np.int32))
+        _replace_npy(os.path.join(path, TFS_FILE), np.concatenate(all_tfs) if all_tfs else np.zeros(0, np.uint16))
+        _replace_npy(os.path.join(path, LENGTHS_FILE), lengths)
+        _replace_npy(os.path.join(path, IDS_FILE), np.array([i.encode("utf-8") for i in kept_ids], dtype=f"S{width}"))
+        vocab_path = os.path.join(path, VOCAB_FILE)
+        with open(vocab_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": vocab}, f, ensure_ascii=False)
+        os.replace(vocab_path + ".tmp", vocab_path)
+        return {"documents": len(kept_ids), "terms": len(vocab), "postings": int(offsets[-1])}
+
+def reciprocal_rank_fusion(rankings, k=None, key=None):
+    """
+    Fuses ranked lists of items with score sum(1 / (k + rank)). `key` identifies the
+    same item across lists. Returns (item, fused score) pairs, best first.
+    """
+    k = config.RRF_K if k is None else k
+    key = key or (lambda item: item)
+    scores = {}
+    items = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            items.setdefault(item_key, item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+    return sorted(((items[key_], score) for key_, score in scores.items()), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,343 @@
+"""
+Pickle-free persistence for the FAISS vectorstore.
+
+An index directory holds:
+  index.faiss        FAISS index, opened memory-mapped and read-only
+  chunks.txt         every chunk's UTF-8 text, back to back
+  chunks.npy         one row per FAISS position: text offset/length, article number,
+                     flags (tombstoned) and docstore id
+  chunk_ids.npy      docstore ids sorted, with their row, for binary-search lookups
+  chunk_articles.json  metadata shared by an article's chunks, stored once
+
+Nothing is unpickled and no Document exists until a search hits it, so loading is
+O(articles) instead of O(chunks). Updates after load are kept in memory and written
+out by the next save_local(). A build streams its chunks into these files as it goes
+(ChunkStoreWriter), so only the FAISS index and the id map grow in memory.
+"""
+import json
+import mmap
+import os
+import sys
+from collections.abc import MutableMapping
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from . import config
+
+CHUNKS_TEXT_FILE = "chunks.txt"
+CHUNKS_TABLE_FILE = "chunks.npy"
+CHUNK_IDS_FILE = "chunk_ids.npy"
+ARTICLES_FILE = "chunk_articles.json"
+
+TOMBSTONED = 1
+# Metadata that belongs to a chunk rather than its article; kept in the row flags.
+CHUNK_KEYS = ("tombstoned",)
+
+def _replace_npy(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+class ChunkStore(Docstore, AddableMixin):
+    """Read-only memory-mapped chunks plus an in-memory overlay of changes since load."""
+
+    def __init__(self, path):
+        self.path = path
+        self._rows = np.load(os.path.join(path, CHUNKS_TABLE_FILE), mmap_mode="r")
+        self._lookup = np.load(os.path.join(path, CHUNK_IDS_FILE), mmap_mode="r")
+        with open(os.path.join(path, ARTICLES_FILE), 'r', encoding='utf-8') as f:
+            self._articles = json.load(f)
+        self._text = b""
+        with open(os.path.join(path, CHUNKS_TEXT_FILE), "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._changed = {}
+        self._deleted = set()
+
+    @property
+    def base_size(self):
+        return len(self._rows)
+
+    def row_id(self, row):
+        return self._rows["id"][row].decode("utf-8")
+
+    @property
+    def articles(self):
+        """Shared article metadata, indexed by the table's article numbers."""
+        return self._articles
+
+    def base_columns(self):
+        """(article number, tombstoned) per base row, as written to disk."""
+        return self._rows["article"], (self._rows["flags"] & TOMBSTONED).astype(bool)
+
+    def changed_rows(self):
+        """(row, Document) for base rows updated since load, e.g. tombstoned ones."""
+        for doc_id, doc in self._changed.items():
+            row = self._row(doc_id)
+            if row is not None:
+                yield row, doc
+
+    def _row(self, doc_id):
+        key = doc_id.encode("utf-8")
+        ids = self._lookup["id"]
+        if len(key) > ids.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(ids, key))
+        if i < len(ids) and ids[i] == key:
+            return int(self._lookup["row"][i])
+        return None
+
+    def _materialize(self, doc_id, row):
+        offset, length, article, flags = (int(self._rows[f][row]) for f in ("offset", "length", "article", "flags"))
+        metadata = dict(self._articles[article])
+        if flags & TOMBSTONED:
+            metadata["tombstoned"] = True
+        text = self._text[offset:offset + length].decode("utf-8")
+        return Document(id=doc_id, page_content=text, metadata=metadata)
+
+    def _exists(self, doc_id):
+        return doc_id in self._changed or (doc_id not in self._deleted and self._row(doc_id) is not None)
+
+    def search(self, search):
+        if search in self._changed:
+            return self._changed[search]
+        row = None if search in self._deleted else self._row(search)
+        if row is None:
+            # Same contract as InMemoryDocstore: a message instead of a Document.
+            return f"ID {search} not found."
+        return self._materialize(search, row)
+
+    def add(self, texts):
+        overlapping = [doc_id for doc_id in texts if self._exists(doc_id)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._changed.update(texts)
+
+    def update(self, doc_id, doc):
+        """Stores a changed Document (e.g. a tombstone flag) for an existing id."""
+        if not self._exists(doc_id):
+            raise ValueError(f"Tried to update id that does not exist: {doc_id}")
+        self._changed[doc_id] = doc
+
+    def delete(self, ids):
+        missing = [doc_id for doc_id in ids if not self._exists(doc_id)]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for doc_id in ids:
+            self._changed.pop(doc_id, None)
+            if self._row(doc_id) is not None:
+                self._deleted.add(doc_id)
+
+class ChunkIdMap(MutableMapping):
+    """FAISS position -> docstore id, read from the chunk table instead of a dict."""
+
+    def __init__(self, store):
+        self._store = store
+        self._extra = {}
+
+    def __getitem__(self, position):
+        position = int(position)
+        if position in self._extra:
+            return self._extra[position]
+        if 0 <= position < self._store.base_size:
+            return self._store.row_id(position)
+        raise KeyError(position)
+
+    def __setitem__(self, position, doc_id):
+        self._extra[int(position)] = doc_id
+
+    def __delitem__(self, position):
+        raise TypeError("Positions are rewritten by FAISS.delete/compaction, not removed one by one.")
+
+    def __iter__(self):
+        yield from range(self._store.base_size)
+        yield from (p for p in self._extra if p >= self._store.base_size)
+
+    def __len__(self):
+        return self._store.base_size + sum(1 for p in self._extra if p >= self._store.base_size)
+
+# Row of the chunk table as streamed to disk, before docstore ids are attached.
+_ROW_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("article", "<u4"), ("flags", "u1")])
+ROWS_TMP_FILE = "chunks.rows.tmp"
+_WRITE_BATCH = 1024
+
+class ChunkStoreWriter(Docstore, AddableMixin):
+    """
+    Write-only docstore that streams added chunks straight into the chunk files of
+    `path`, so a build holds one window of text at a time instead of every Document.
+    Chunks must be added in FAISS position order (as FAISS.add_embeddings does);
+    finish() then attaches the docstore ids and publishes the files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._text_path = os.path.join(path, CHUNKS_TEXT_FILE)
+        self._rows_path = os.path.join(path, ROWS_TMP_FILE)
+        self._text = open(self._text_path + ".tmp", "wb")
+        self._rows = open(self._rows_path, "wb")
+        self._articles = []
+        self._article_numbers = {}
+        self._offset = 0
+        self.count = 0
+
+    def add(self, texts):
+        rows = np.zeros(len(texts), dtype=_ROW_DTYPE)
+        for i, doc in enumerate(texts.values()):
+            data = doc.page_content.encode("utf-8")
+            self._text.write(data)
+            shared = {k: v for k, v in doc.metadata.items() if k not in CHUNK_KEYS}
+            key = json.dumps(shared, sort_keys=True, ensure_ascii=False)
+            if key not in self._article_numbers:
+                self._article_numbers[key] = len(self._articles)
+                self._articles.append(shared)
+            flags = TOMBSTONED if doc.metadata.get("tombstoned") else 0
+            rows[i] = (self._offset, len(data), self._article_numbers[key], flags)
+            self._offset += len(data)
+        rows.tofile(self._rows)
+        self.count += len(texts)
+
+    def search(self, search):
+        raise NotImplementedError("ChunkStoreWriter is write-only; load the saved ChunkStore to read chunks.")
+
+    def delete(self, ids):
+        raise NotImplementedError("ChunkStoreWriter is write-only; chunks cannot be deleted while streaming.")
+
+    def finish(self, index_to_docstore_id):
+        """Writes the chunk table for the ids of every position and replaces the old chunk files."""
+        self._text.close()
+        self._rows.close()
+        count = len(index_to_docstore_id)
+        if count != self.count:
+            raise ValueError(f"{self.count} chunks were written for {count} FAISS positions.")
+        ids = np.array([index_to_docstore_id[pos].encode("utf-8") for pos in range(count)], dtype=bytes)
+        width = max(ids.dtype.itemsize, 1)
+        table_path = os.path.join(self.path, CHUNKS_TABLE_FILE)
+        dtype = np.dtype(_ROW_DTYPE.descr + [("id", f"S{width}")])
+        if count:
+            # Filled on disk: the table never has to fit in memory next to the index.
+            rows = np.memmap(self._rows_path, dtype=_ROW_DTYPE, mode="r")
+            table = np.lib.format.open_memmap(table_path + ".tmp", mode="w+", dtype=dtype, shape=(count,))
+            for name in _ROW_DTYPE.names:
+                table[name] = rows[name]
+            table["id"] = ids
+            table.flush()
+            del rows, table
+        else:
+            _replace_npy(table_path + ".tmp", np.zeros(0, dtype=dtype))
+        os.remove(self._rows_path)
+
+        order = np.argsort(ids, kind="stable")
+        lookup = np.zeros(count, dtype=[("id", f"S{width}"), ("row", "<u8")])
+        lookup["id"] = ids[order]
+        lookup["row"] = order
+        os.replace(self._text_path + ".tmp", self._text_path)
+        os.replace(table_path + ".tmp", table_path)
+        _replace_npy(os.path.join(self.path, CHUNK_IDS_FILE), lookup)
+
+        articles_path = os.path.join(self.path, ARTICLES_FILE)
+        with open(articles_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self._articles, f, ensure_ascii=False)
+        os.replace(articles_path + ".tmp", articles_path)
+        return {"chunks": count, "articles": len(self._articles), "text_bytes": self._offset}
+
+def write_chunk_store(path, index_to_docstore_id, docstore):
+    """Writes the chunk files for every FAISS position, in position order."""
+    writer = ChunkStoreWriter(path)
+    batch = {}
+    for pos in range(len(index_to_docstore_id)):
+        doc_id = index_to_docstore_id[pos]
+        batch[doc_id] = docstore.search(doc_id)
+        if len(batch) == _WRITE_BATCH:
+            writer.add(batch)
+            batch = {}
+    writer.add(batch)
+    return writer.finish(index_to_docstore_id)
+
+class ChunkStoreFAISS(FAISS):
+    """
+    LangChain FAISS vectorstore saved as a chunk store instead of a pickle.
+
+    The index is memory-mapped on load; the first add or delete swaps in an owned
+    in-memory copy, since FAISS cannot grow a mapped index.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._mmapped = False
+
+    def _make_writable(self):
+        if self._mmapped:
+            # clone_index would keep viewing the mapping; a serialized copy owns its data.
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self._mmapped = False
+
+    def add_texts(self, *args, **kwargs):
+        self._make_writable()
+        return super().add_texts(*args, **kwargs)
+
+    def add_embeddings(self, *args, **kwargs):
+        self._make_writable()
+        return super().add_embeddings(*args, **kwargs)
+
+    def delete(self, ids=None, **kwargs):
+        self._make_writable()
+        return super().delete(ids, **kwargs)
+
+    def save_local(self, folder_path, index_name="index"):
+        os.makedirs(folder_path, exist_ok=True)
+        index_path = os.path.join(folder_path, f"{index_name}.faiss")
+        # Write beside and rename: a mapped index must keep its old file until unmapped.
+        faiss.write_index(self.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        if isinstance(self.docstore, ChunkStoreWriter):
+            if os.path.abspath(self.docstore.path) != os.path.abspath(folder_path):
+                raise ValueError(f"This index streams its chunks to {self.docstore.path}, not {folder_path}.")
+            stats = self.docstore.finish(self.index_to_docstore_id)
+            # Reads go to the published files from now on; only their id map stays in memory.
+            self.docstore = ChunkStore(folder_path)
+            self.index_to_docstore_id = ChunkIdMap(self.docstore)
+        else:
+            stats = write_chunk_store(folder_path, self.index_to_docstore_id, self.docstore)
+
+        legacy = os.path.join(folder_path, f"{index_name}.pkl")
+        if os.path.exists(legacy):
+            os.remove(legacy)
+        return stats
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings, index_name="index", mmap=None,
+                   allow_dangerous_deserialization=False, **kwargs):
+        """
+        Loads a chunk store. A legacy pickled index is only read when
+        `allow_dangerous_deserialization` is set; otherwise migrate it first.
+        """
+        mmap = config.INDEX_MMAP if mmap is None else mmap
+        if not os.path.exists(os.path.join(folder_path, CHUNKS_TABLE_FILE)):
+            if not allow_dangerous_deserialization:
+                raise FileNotFoundError(
+                    f"No chunk store in {folder_path}. Convert a pickled index with: "
+                    f"python -m src.chunk_store {folder_path}"
+                )
+            legacy = FAISS.load_local(folder_path, embeddings, index_name,
+                                      allow_dangerous_deserialization=True, **kwargs)
+            return cls(embeddings, legacy.index, legacy.docstore, legacy.index_to_docstore_id, **kwargs)
+
+        # MMAP_IFC maps flat vector storage (flat, HNSW, IVF quantizers) in place.
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(os.path.join(folder_path, f"{index_name}.faiss"), flags)
+        store = ChunkStore(folder_path)
+        vectorstore = cls(embeddings, index, store, ChunkIdMap(store), **kwargs)
+        vectorstore._mmapped = mmap
+        return vectorstore
+
+if __name__ == "__main__":
+    # One-off migration of an index saved with FAISS.save_local (pickle) to a chunk store.
+    index_path = sys.argv[1] if len(sys.argv) > 1 else config.INDEX_PATH
+    print(f"Converting pickled index at {index_path}...")
+    legacy = FAISS.load_local(index_path, None, allow_dangerous_deserialization=True)
+    stats = ChunkStoreFAISS(None, legacy.index, legacy.docstore, legacy.index_to_docstore_id).save_local(index_path)
+    print(f"Wrote {stats['chunks']} chunks from {stats['articles']} articles "
+          f"({stats['text_bytes'] / 1e6:.1f} MB of text); removed index.pkl")
@@ -16,7 +16,209 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL = os.getenv("GROQ_MODEL")
 
 EMBEDDING_MODEL = "models/text-embedding-004"
-LLM_MODEL = "qwen/qwen3-32b"
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen/qwen3-32b")
+
+# LLM routing (llm_router.py). Calls go to LLM_PROVIDER first and, with LLM_FAILOVER,
+# fail over to the other provider (if its key is set) on an error. A call still
+# unanswered at the LLM_HEDGE_PERCENTILE of that provider's recent latencies for the
+# prompt gets a duplicate (hedge) on the next provider and the first reply wins.
+# LLM_DEADLINE bounds a whole call, hedges and failovers included. A provider failing
+# LLM_BREAKER_FAILURES times in a row (429, 5xx, timeouts) is skipped for
+# LLM_BREAKER_RESET seconds, or for the Retry-After of a 429. Routing is opt-in: with
+# LLM_ROUTER=false (default) LLM_PROVIDER's client is used alone, with the SDK's own retries.
+LLM_ROUTER = os.getenv("LLM_ROUTER", "false").lower() == "true"
+LLM_FAILOVER = os.getenv("LLM_FAILOVER", "true").lower() == "true"
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", LLM_MODEL) # LLM_MODEL is kept as its older alias
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") # e.g. a fakes.StubLLMServer
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "60")) # seconds
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95")) # 0 = no hedging
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")) # latencies needed before hedging
+LLM_MAX_HEDGES = int(os.getenv("LLM_MAX_HEDGES", "1"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200")) # recent latencies kept per provider and prompt
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30")) # seconds
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32")) # keep-alive HTTP connections per provider
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "32")) # threads running sync calls and their hedges
+
+# Embedding backend. "google" calls the Gemini embedding API (EMBEDDING_MODEL); "local"
+# runs a multilingual sentence-transformers model on CPU, so neither ingestion nor
+# queries go over the network. The two embed into different spaces: re-embed an
+# existing index after switching with `python -m src.migrate_embeddings`.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google").lower() # Options: "google", "local"
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "intfloat/multilingual-e5-small")
+# E5 models are trained with these prefixes; set both to "" for models that are not.
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv("LOCAL_EMBEDDING_QUERY_PREFIX", "query: ")
+LOCAL_EMBEDDING_DOCUMENT_PREFIX = os.getenv("LOCAL_EMBEDDING_DOCUMENT_PREFIX", "passage: ")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+LOCAL_EMBEDDING_MAX_LENGTH = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "512"))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0")) # 0 = runtime default
 
 DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "faiss_index")
+# FAISS index type, chosen at build time. Options: "flat" (exact), "hnsw", "ivf_flat",
+# "ivf_pq", "ivf_sq". ANN_EF_SEARCH and ANN_NPROBE are search-time and can be changed
+# per RAGEngine without rebuilding.
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "flat").lower()
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_HNSW_EF_CONSTRUCTION = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "200"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0")) # 0 = ~4*sqrt(training sample)
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+ANN_PQ_M = int(os.getenv("ANN_PQ_M", "64")) # Sub-quantizers (rounded down to a divisor of dim)
+ANN_PQ_NBITS = int(os.getenv("ANN_PQ_NBITS", "8"))
+ANN_TRAIN_SIZE = int(os.getenv("ANN_TRAIN_SIZE", "20000")) # Vectors buffered to train IVF / int8 indexes
+# Precision of the vectors stored in the index: "float32", "float16" or "int8" (scalar
+# quantized, 2x / 4x smaller; ignored by ivf_pq and ivf_sq). With
+# EMBEDDING_RESCORE_FACTOR > 0 a float32 copy is also kept, memory-mapped on disk, and
+# the k * factor best quantized matches are rescored with it (0 = no copy, no rescoring).
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32").lower()
+EMBEDDING_RESCORE_FACTOR = int(os.getenv("EMBEDDING_RESCORE_FACTOR", "4"))
+
+# Index persistence: vectors are memory-mapped on load (chunk_store.py). Legacy
+# pickled indexes are only read when explicitly allowed; convert them instead with
+# `python -m src.chunk_store`.
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"
+ALLOW_PICKLE_INDEX = os.getenv("ALLOW_PICKLE_INDEX", "false").lower() == "true"
+
+# Lexical retrieval: a BM25 index over chunk text is built next to the FAISS index.
+# HOP1_RETRIEVER "bm25" makes hop 1 local (no embedding call); HOP2_RETRIEVER "hybrid"
+# fuses dense and BM25 candidates with reciprocal rank fusion before reranking.
+BM25_ENABLED = os.getenv("BM25_ENABLED", "true").lower() == "true"
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+HOP1_RETRIEVER = os.getenv("HOP1_RETRIEVER", "dense").lower() # Options: "dense", "bm25"
+HOP2_RETRIEVER = os.getenv("HOP2_RETRIEVER", "dense").lower() # Options: "dense", "bm25", "hybrid"
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Metadata filters (theme, tags, publish date) are applied inside the FAISS search.
+# HNSW only returns allowed chunks it visits, so selections of at most this many
+# chunks are searched exactly instead.
+FILTER_EXACT_MAX = int(os.getenv("FILTER_EXACT_MAX", "4096"))
+
+# Theme sharding: ingestion builds one index per theme under INDEX_PATH/shards and the
+# engine fans searches out to them. With SHARD_ROUTER_TOP_N > 0 a query only goes to
+# the shards whose centroids are closest to it (0 = every shard).
+SHARD_BY_THEME = os.getenv("SHARD_BY_THEME", "false").lower() == "true"
+SHARD_ROUTER_TOP_N = int(os.getenv("SHARD_ROUTER_TOP_N", "0"))
+SHARD_ROUTER_CENTROIDS = int(os.getenv("SHARD_ROUTER_CENTROIDS", "4")) # k-means centroids per shard
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))
+
+# Observability: every request's stage timings, token counts and cost are returned
+# under "metrics", logged as one JSON line when METRICS_LOG is on, and exported
+# in Prometheus format (metrics endpoint in modal_app.py). Prices are USD per million
+# tokens of the configured LLM; 0 reports no cost. Diagnostics (retrievers, rerank and
+# context stats, LLM failovers, ...) are JSON lines of the "rag" logger at DEBUG level,
+# shown with LOG_LEVEL=DEBUG.
+METRICS_LOG = os.getenv("METRICS_LOG", "true").lower() == "true"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LLM_INPUT_COST_PER_MTOK = float(os.getenv("LLM_INPUT_COST_PER_MTOK", "0"))
+LLM_OUTPUT_COST_PER_MTOK = float(os.getenv("LLM_OUTPUT_COST_PER_MTOK", "0"))
+
+# Chunks per streaming ingestion window (bounds memory held between stages)
+INGEST_WINDOW_SIZE = int(os.getenv("INGEST_WINDOW_SIZE", "1000"))
+
+# Cleaning: boilerplate stripping and near-duplicate chunk removal
+CLEAN_BOILERPLATE = os.getenv("CLEAN_BOILERPLATE", "true").lower() == "true"
+BOILERPLATE_NGRAM_SIZE = 8
+BOILERPLATE_MIN_DF = 0.2 # Share of sampled articles an n-gram must appear in
+BOILERPLATE_SAMPLE_SIZE = 500
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "true").lower() == "true"
+DEDUP_THRESHOLD = 0.9 # Estimated Jaccard similarity at which a chunk is dropped
+DEDUP_NUM_PERM = 128
+DEDUP_BANDS = 16
+
+# Ingestion embedding scheduler (batching, concurrency and API pacing)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "1500"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", "1000000"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+# Query embedding cache shared by both retrieval hops
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "86400")) # seconds
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH") # Optional JSON file to persist the cache
+
+# Semantic answer cache for process_query. Opt-in: a question embedding within
+# ANSWER_CACHE_THRESHOLD of an earlier one gets that question's answer.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")) # Cosine similarity
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600")) # seconds
+
+# process_query_async: rerank hop-1 candidates while the reformulation LLM call is in
+# flight; the best ASYNC_OVERLAP_KEEP of them join hop 2's candidates for the final rerank
+# (0 = the final ranking is process_query's).
+ASYNC_OVERLAP = os.getenv("ASYNC_OVERLAP", "true").lower() == "true"
+ASYNC_OVERLAP_KEEP = int(os.getenv("ASYNC_OVERLAP_KEEP", "3"))
+
+# process_queries batch API
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+# Context assembly for the answer prompt: overlapping chunks of one article are merged
+# under a single metadata header, and if that is still over CONTEXT_TOKEN_BUDGET the
+# sentences least related to the question are left out. Opt-in: trimming changes the
+# prompt, and so the answers, of an existing deployment.
+CONTEXT_ASSEMBLY = os.getenv("CONTEXT_ASSEMBLY", "false").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000")) # 0 = no limit
+CONTEXT_MIN_OVERLAP = int(os.getenv("CONTEXT_MIN_OVERLAP", "20")) # characters shared by merged chunks
+
+# Engine startup: the LLM/embedding clients, index and reranker load on parallel
+# threads, and the warm-up runs one throwaway query through the local models (FAISS,
+# BM25, reranker) so the first request does not pay for it.
+STARTUP_PARALLEL = os.getenv("STARTUP_PARALLEL", "true").lower() == "true"
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "false").lower() == "true"
+
+# Micro-batching for concurrent serving: query embeddings and cross-encoder pairs of
+# the requests in flight are coalesced into shared batches. A batch goes out once it
+# is full or its oldest request has waited MICRO_BATCH_MAX_WAIT_MS.
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "false").lower() == "true"
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "5"))
+EMBED_MICRO_BATCH_SIZE = int(os.getenv("EMBED_MICRO_BATCH_SIZE", "32")) # queries
+EMBED_MICRO_BATCH_WORKERS = int(os.getenv("EMBED_MICRO_BATCH_WORKERS", "4")) # API batches in flight; local model: 1
+RERANK_MICRO_BATCH_SIZE = int(os.getenv("RERANK_MICRO_BATCH_SIZE", "128")) # (query, passage) pairs
+
+# Evaluation runner: questions run concurrently under an adaptive request limiter that
+# backs off on 429s, and each finished question is appended to a JSONL checkpoint, so an
+# interrupted run resumes where it stopped.
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))
+EVAL_REQUESTS_PER_MINUTE = int(os.getenv("EVAL_REQUESTS_PER_MINUTE", "30")) # LLM calls
+EVAL_MAX_RETRIES = int(os.getenv("EVAL_MAX_RETRIES", "6"))
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "8")) # questions per process_queries call (quality eval)
+EVAL_CHECKPOINT_DIR = os.getenv(
+    "EVAL_CHECKPOINT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "eval_checkpoints")
+)
+
+# Cross-encoder reranker
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch").lower() # Options: "torch", "onnx"
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", "512"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "64"))
+RERANKER_THREADS = int(os.getenv("RERANKER_THREADS", "0")) # 0 = runtime default
+RERANKER_QUANTIZE = os.getenv("RERANKER_QUANTIZE", "true").lower() == "true" # int8 weights for "onnx"
+RERANKER_ONNX_DIR = os.getenv(
+    "RERANKER_ONNX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "reranker_onnx")
+)
+
+# Cascade reranking: a cheap first stage (dense relevance + lexical overlap) orders and
+# prunes hop-2 candidates, the cross-encoder scores them in small batches and stops
+# once the top-k is stable. Depth only grows past CASCADE_MIN_DEPTH when the
+# first-stage scores are too flat to trust.
+RERANK_CASCADE = os.getenv("RERANK_CASCADE", "false").lower() == "true"
+CASCADE_MIN_DEPTH = int(os.getenv("CASCADE_MIN_DEPTH", "12"))
+CASCADE_MAX_DEPTH = int(os.getenv("CASCADE_MAX_DEPTH", "30"))
+CASCADE_BATCH_SIZE = int(os.getenv("CASCADE_BATCH_SIZE", "4"))
+CASCADE_PATIENCE = int(os.getenv("CASCADE_PATIENCE", "1")) # Unchanged batches before early exit
+CASCADE_PRUNE_MARGIN = float(os.getenv("CASCADE_PRUNE_MARGIN", "0.15"))
+CASCADE_FLAT_MARGIN = float(os.getenv("CASCADE_FLAT_MARGIN", "0.02"))
+CASCADE_LEXICAL_WEIGHT = float(os.getenv("CASCADE_LEXICAL_WEIGHT", "0.1"))
+
+# Tombstoned chunks are compacted out once they reach this share of the index.
+TOMBSTONE_COMPACT_RATIO = float(os.getenv("TOMBSTONE_COMPACT_RATIO", "0.2"))
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "embedding_cache", "embeddings.sqlite")
+)
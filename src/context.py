@@ -0,0 +1,176 @@
+"""
+Context assembly for the answer prompt.
+
+Reranked chunks of the same article overlap (CHUNK_OVERLAP) or are neighbours, and
+format_docs_with_metadata repeats the article header for each of them. Here the chunks
+of one link are merged back into spans, by the text they share, and each article gets
+one header. If the result is still over the token budget, an extractive filter keeps
+the sentences sharing the most (rarest) terms with the question, favouring the
+higher-ranked articles, and drops the rest; kept sentences stay in document order and
+a dropped run is marked with "[...]".
+"""
+import math
+import re
+from collections import Counter
+from . import config, utils
+from .rate_limit import estimate_tokens
+
+GAP = "[...]"
+
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=[A-Z"“(\[])|\n+')
+
+def _terms(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+def _overlap(a, b, min_overlap):
+    """Length of the longest suffix of `a` that is also a prefix of `b` (0 if under `min_overlap`)."""
+    if len(b) < min_overlap:
+        return 0
+    probe = b[:min_overlap]
+    start = a.find(probe, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return len(a) - start
+        start = a.find(probe, start + 1)
+    return 0
+
+def _join(a, b, min_overlap):
+    """`a` and `b` as one text if one contains the other or they overlap, else None."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    k = _overlap(a, b, min_overlap)
+    if k:
+        return a + b[k:]
+    k = _overlap(b, a, min_overlap)
+    if k:
+        return b + a[k:]
+    return None
+
+def merge_spans(texts, min_overlap=None):
+    """Chains overlapping texts (chunks of one article) into spans, kept in first-seen order."""
+    min_overlap = min_overlap or config.CONTEXT_MIN_OVERLAP
+    spans = []
+    for text in texts:
+        text = text.strip()
+        # A merge can bridge two spans, so keep folding until nothing joins.
+        while True:
+            for i, span in enumerate(spans):
+                joined = _join(span, text, min_overlap)
+                if joined is not None:
+                    text = joined
+                    del spans[i]
+                    break
+            else:
+                break
+        spans.append(text)
+    return spans
+
+def group_articles(docs, min_overlap=None):
+    """[(metadata of the best-ranked chunk, spans)] per link, in ranking order."""
+    by_link = {}
+    for d in docs:
+        link = d.metadata.get("link", "")
+        if link not in by_link:
+            by_link[link] = (d.metadata, [])
+        by_link[link][1].append(d.page_content)
+    return [(meta, merge_spans(texts, min_overlap)) for meta, texts in by_link.values()]
+
+def _sentences(text):
+    """`text` cut into sentences, each keeping its trailing whitespace, so they concatenate back to it."""
+    pieces = []
+    start = 0
+    for m in _SENTENCE_BREAK.finditer(text):
+        pieces.append(text[start:m.end()])
+        start = m.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+def _render(articles, keep=None):
+    """Formats the articles; with `keep` ({(article, span, sentence)}), only those sentences."""
+    blocks = []
+    for a, (meta, spans) in enumerate(articles):
+        parts = []
+        for s, sentences in enumerate(spans):
+            if keep is None:
+                parts.append("".join(sentences).strip())
+                continue
+            text, gap = "", False
+            for i, sentence in enumerate(sentences):
+                if (a, s, i) in keep:
+                    text += (f"{GAP} " if gap else "") + sentence
+                    gap = False
+                else:
+                    gap = True
+            if text:
+                parts.append(text.strip() + (f" {GAP}" if gap else ""))
+        if parts:
+            body = f"\n{GAP}\n".join(parts)
+            blocks.append(f"{utils.format_metadata_header(meta)}{body}\n{'-' * 50}")
+    return "\n\n".join(blocks)
+
+def _select(query, articles, budget):
+    """The sentences to keep so the rendered context fits `budget` tokens."""
+    units = [
+        (a, s, i, sentence)
+        for a, (_, spans) in enumerate(articles)
+        for s, sentences in enumerate(spans)
+        for i, sentence in enumerate(sentences)
+    ]
+    # Query terms weighted by how rare they are among the candidate sentences, so
+    # filler words that appear everywhere count for little.
+    sentence_terms = [_terms(u[3]) for u in units]
+    document_freq = Counter(t for terms in sentence_terms for t in terms)
+    weights = {t: math.log(1 + len(units) / (1 + document_freq[t])) for t in _terms(query)}
+    total_weight = sum(weights.values()) or 1.0
+
+    def score(k):
+        a = units[k][0]
+        relevance = sum(w for t, w in weights.items() if t in sentence_terms[k]) / total_weight
+        return relevance + 0.1 * (1 - a / len(articles))
+
+    # Headers are charged with their separator line, sentences with a possible "[...]".
+    header_tokens = [estimate_tokens(f"{utils.format_metadata_header(meta)}\n{'-' * 50}\n\n") for meta, _ in articles]
+    used, keep, opened = 0, set(), set()
+    for k in sorted(range(len(units)), key=lambda k: (-score(k), units[k][0], units[k][1], units[k][2])):
+        a, s, i, sentence = units[k]
+        cost = estimate_tokens(sentence) + 2 + (0 if a in opened else header_tokens[a])
+        if used + cost > budget:
+            continue
+        used += cost
+        opened.add(a)
+        keep.add((a, s, i))
+    return keep
+
+def assemble_context(query, docs, token_budget=None, min_overlap=None):
+    """
+    The answer prompt's context for the reranked `docs`: merged spans, one header per
+    article, trimmed to `token_budget` (config.CONTEXT_TOKEN_BUDGET; 0 = no limit).
+    Returns (text, stats) with the token counts before and after.
+    """
+    token_budget = config.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    tokens_before = estimate_tokens(utils.format_docs_with_metadata(docs))
+    articles = [(meta, [_sentences(span) for span in spans]) for meta, spans in group_articles(docs, min_overlap)]
+
+    text = _render(articles)
+    merged_tokens = estimate_tokens(text)
+    dropped = 0
+    if token_budget and merged_tokens > token_budget:
+        keep = _select(query, articles, token_budget)
+        dropped = sum(len(sentences) for _, spans in articles for sentences in spans) - len(keep)
+        text = _render(articles, keep)
+
+    tokens_after = estimate_tokens(text)
+    stats = {
+        "chunks": len(docs),
+        "articles": len(articles),
+        "spans": sum(len(spans) for _, spans in articles),
+        "sentences_dropped": dropped,
+        "tokens_before": tokens_before,
+        "tokens_merged": merged_tokens,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(0, tokens_before - tokens_after)
+    }
+    return text, stats
@@ -0,0 +1,118 @@
+"""
+Embedding backends (config.EMBEDDING_BACKEND).
+
+"google" is the Gemini embedding API. "local" runs a multilingual sentence-transformers
+model on CPU: no network round trip on either hop and no API quota during ingestion.
+Both return L2-normalised vectors, so the FAISS distances and relevance scores keep
+their meaning; they live in different spaces, though, so an index must be searched
+with the backend that built it (see migrate_embeddings.py).
+"""
+import sys
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from . import config
+from .embedding_cache import EmbeddingCache
+from .embedding_scheduler import ScheduledEmbeddings
+
+BACKENDS = ("google", "local")
+
+class LocalEmbeddings(Embeddings):
+    """
+    A sentence-transformers model on CPU. Texts are encoded `batch_size` at a time;
+    E5-style models get the query/passage prefixes they were trained with.
+    """
+
+    def __init__(self, model_name=None, batch_size=None, max_length=None, num_threads=None,
+                 query_prefix=None, document_prefix=None):
+        from sentence_transformers import SentenceTransformer
+
+        num_threads = config.LOCAL_EMBEDDING_THREADS if num_threads is None else num_threads
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name or config.LOCAL_EMBEDDING_MODEL
+        self.batch_size = batch_size or config.LOCAL_EMBEDDING_BATCH_SIZE
+        self.query_prefix = config.LOCAL_EMBEDDING_QUERY_PREFIX if query_prefix is None else query_prefix
+        self.document_prefix = config.LOCAL_EMBEDDING_DOCUMENT_PREFIX if document_prefix is None else document_prefix
+        self.model = SentenceTransformer(self.model_name, device="cpu")
+        self.model.max_seq_length = max_length or config.LOCAL_EMBEDDING_MAX_LENGTH
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts):
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return self._encode([self.document_prefix + t for t in texts])
+
+    def embed_query(self, text):
+        return self._encode([self.query_prefix + text])[0]
+
+    def embed_queries(self, texts):
+        """Several queries in one forward pass per batch."""
+        return self._encode([self.query_prefix + t for t in texts])
+
+def _backend(backend=None):
+    backend = (backend or config.EMBEDDING_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'. Options: {', '.join(BACKENDS)}.")
+    return backend
+
+def embedding_model_name(backend=None):
+    """Model identity of a backend; keys the embedding caches and is recorded in the index manifest."""
+    if _backend(backend) == "local":
+        return config.LOCAL_EMBEDDING_MODEL
+    return config.EMBEDDING_MODEL
+
+def needs_google(backend=None):
+    return _backend(backend) == "google"
+
+def query_embeddings(backend=None):
+    """The raw backend model, for queries (the engine caches query vectors itself)."""
+    if _backend(backend) == "local":
+        return LocalEmbeddings()
+    if not config.GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+    # Imported here so a local-only engine never loads the Google SDK.
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(
+        model=config.EMBEDDING_MODEL,
+        google_api_key=config.GOOGLE_API_KEY
+    )
+
+def _is_google(embeddings):
+    # Imported lazily by query_embeddings; if it never was, these are other embeddings.
+    google = sys.modules.get("langchain_google_genai")
+    return google is not None and isinstance(embeddings, google.GoogleGenerativeAIEmbeddings)
+
+def batches_queries(embeddings):
+    """Whether embed_query_batch embeds several queries in one call with these embeddings."""
+    return _is_google(embeddings) or hasattr(embeddings, "embed_queries")
+
+def embed_query_batch(embeddings, texts):
+    """Query vectors for several texts, in one request where the backend supports it."""
+    if _is_google(embeddings):
+        # Same task type as embed_query, so vectors match the single-query path.
+        return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return [embeddings.embed_query(t) for t in texts]
+
+def document_embeddings(backend=None, cache_path=None):
+    """
+    Ingestion embeddings: the backend behind the persistent embedding cache. The API
+    is paced and called concurrently; the local model gets one batch at a time, since
+    concurrent batches would only compete for the same CPU cores.
+    """
+    backend = _backend(backend)
+    cache = EmbeddingCache(cache_path or config.EMBEDDING_CACHE_PATH, embedding_model_name(backend))
+    if backend == "local":
+        return ScheduledEmbeddings(LocalEmbeddings(), cache, max_concurrency=1,
+                                   requests_per_minute=0, tokens_per_minute=0)
+    return ScheduledEmbeddings(query_embeddings(backend), cache)
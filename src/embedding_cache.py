@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+# SQLite caps the number of bound parameters per statement.
+_SQL_BATCH = 500
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Persistent store of chunk vectors keyed by (embedding model, text hash)."""
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes):
+        """Returns {text_hash: vector} for every hash present in the cache."""
+        hashes = list(hashes)
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), _SQL_BATCH):
+                batch = hashes[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [self.model, *batch]
+                )
+                for h, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[h] = vector.tolist()
+        return found
+
+    def put_many(self, items):
+        """Stores an iterable of (text_hash, vector) pairs."""
+        rows = [(self.model, h, array("f", v).tobytes()) for h, v in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model,)
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model so document vectors are only computed on cache misses."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(t) for t in texts]
+        found = self.cache.get_many(set(hashes))
+
+        # Identical chunks (e.g. repeated boilerplate) are embedded only once.
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+
+        if missing:
+            found.update(self._embed_missing(missing))
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [found[h] for h in hashes]
+
+    def _embed_missing(self, missing):
+        """Embeds {text_hash: text} and stores the results. Returns {text_hash: vector}."""
+        vectors = self.embeddings.embed_documents(list(missing.values()))
+        computed = dict(zip(missing.keys(), vectors))
+        self.cache.put_many(computed.items())
+        return computed
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU + TTL cache of query vectors, optionally persisted to a JSON file.
+
+    Keys include the embedding model so a model switch never serves stale vectors.
+    """
+
+    def __init__(self, model, max_size=1024, ttl=86400, persist_path=None, persist_every=50,
+                 clock=time.time):
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.persist_every = persist_every
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes save(): concurrent requests can each trigger one, and they share the .tmp file.
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        if persist_path:
+            self._load()
+
+    def _key(self, text):
+        return f"{self.model}\n{text.strip()}"
+
+    def get(self, text):
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, text, vector):
+        key = self._key(text)
+        with self._lock:
+            self._entries[key] = (list(vector), self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            due = self.persist_path and self._unsaved >= self.persist_every
+        if due:
+            self.save()
+
+    def get_or_embed(self, text, embed_fn):
+        vector = self.get(text)
+        if vector is None:
+            vector = embed_fn(text)
+            self.put(text, vector)
+        return vector
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable query cache {self.persist_path}: {e}")
+            return
+        now = self._clock()
+        for key, vector, created in rows[-self.max_size:]:
+            if now - created <= self.ttl:
+                self._entries[key] = (vector, created)
+
+    def save(self):
+        if not self.persist_path:
+            return
+        with self._save_lock:
+            # Snapshot inside the save lock, so the last save to finish writes the newest entries.
+            with self._lock:
+                rows = [[key, vector, created] for key, (vector, created) in self._entries.items()]
+                self._unsaved = 0
+            parent = os.path.dirname(self.persist_path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            tmp_path = self.persist_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, self.persist_path)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._entries)
+            }
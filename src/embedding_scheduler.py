@@ -0,0 +1,105 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import config
+from .embedding_cache import CachedEmbeddings
+from .rate_limit import (
+    RateLimiter, backoff_delay, estimate_tokens, is_provider_failure, is_rate_limit_error, retry_after_seconds
+)
+
+class ScheduledEmbeddings(CachedEmbeddings):
+    """
+    Cached embeddings whose misses are embedded in concurrent, rate-limited batches.
+
+    Every finished batch is written to the cache straight away, so the cache doubles
+    as the checkpoint: a crashed build re-run only embeds the batches that never
+    completed.
+    """
+
+    def __init__(self, embeddings, cache, batch_size=None, max_concurrency=None,
+                 requests_per_minute=None, tokens_per_minute=None, max_retries=None,
+                 verbose=True, sleep=time.sleep):
+        super().__init__(embeddings, cache)
+        self.batch_size = batch_size or config.EMBED_BATCH_SIZE
+        self.max_concurrency = max_concurrency or config.EMBED_MAX_CONCURRENCY
+        self.max_retries = config.EMBED_MAX_RETRIES if max_retries is None else max_retries
+        self.limiter = RateLimiter(
+            requests_per_minute if requests_per_minute is not None else config.EMBED_REQUESTS_PER_MINUTE,
+            tokens_per_minute if tokens_per_minute is not None else config.EMBED_TOKENS_PER_MINUTE
+        )
+        self.verbose = verbose
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.retries = 0
+
+    def _embed_batch(self, texts):
+        tokens = sum(estimate_tokens(t) for t in texts)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                # A bad request (auth, oversized input) fails the same way on every retry.
+                if attempt == self.max_retries or not is_provider_failure(e):
+                    raise
+                delay = backoff_delay(attempt)
+                if is_rate_limit_error(e):
+                    delay = max(delay, retry_after_seconds(e) or 0)
+                with self._lock:
+                    self.retries += 1
+                if self.verbose:
+                    print(f"Embedding batch failed ({e}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                self._sleep(delay)
+
+    def _embed_missing(self, missing):
+        items = list(missing.items())
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        computed = {}
+        start = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = {
+                pool.submit(self._embed_batch, [text for _, text in batch]): batch
+                for batch in batches
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                batch = futures[future]
+                vectors = future.result()
+                results = list(zip([h for h, _ in batch], vectors))
+                self.cache.put_many(results)
+                computed.update(results)
+                with self._lock:
+                    self.batches += 1
+                if self.verbose:
+                    elapsed = time.time() - start
+                    print(f"Embedded batch {done}/{len(batches)} "
+                          f"({len(computed)}/{len(items)} chunks, {len(computed) / max(elapsed, 1e-9):.1f} chunks/s)")
+        return computed
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"batches": self.batches, "retries": self.retries})
+        return stats
+
+if __name__ == "__main__":
+    # Offline smoke run against the fake embedder with latency and injected 429s.
+    import tempfile
+    import os
+    from .embedding_cache import EmbeddingCache
+    from .fakes import FakeEmbeddings
+
+    texts = [f"Pasal {i} tentang perlindungan konsumen dan ketenagakerjaan" for i in range(500)]
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(os.path.join(tmp, "cache.sqlite"), "fake")
+        fake = FakeEmbeddings(dim=64, latency=0.05, error_rate=0.3, retry_after=0.1, seed=7)
+        embedder = ScheduledEmbeddings(fake, cache, batch_size=25, max_concurrency=4,
+                                       requests_per_minute=6000, tokens_per_minute=None)
+        vectors = embedder.embed_documents(texts)
+        assert len(vectors) == len(texts)
+        print("First run:", embedder.stats(), f"fake calls={fake.calls} errors={fake.errors}")
+
+        rerun = ScheduledEmbeddings(fake, cache, batch_size=25, verbose=False)
+        resumed = rerun.embed_documents(texts)
+        assert all(abs(a - b) < 1e-6 for u, v in zip(resumed, vectors) for a, b in zip(u, v))
+        print("Resumed run:", rerun.stats())
@@ -0,0 +1,143 @@
+"""
+Concurrent, resumable runner for the evaluation scripts.
+
+Each finished item is appended as one JSON line to a checkpoint file, flushed to disk
+straight away, so an interrupted run resumes with only the missing items. Items run on
+a thread pool; every attempt first takes a slot from an AdaptiveRateLimiter, and an
+attempt rejected with a 429 slows the limiter down and is retried after the server's
+Retry-After (or a backoff). Other errors are reported and left out of the checkpoint,
+so the next run retries them.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import config
+from .rate_limit import AdaptiveRateLimiter, backoff_delay, is_rate_limit_error, retry_after_seconds
+
+def checkpoint_path(name):
+    return os.path.join(config.EVAL_CHECKPOINT_DIR, f"{name}.jsonl")
+
+class CheckpointLog:
+    """Append-only JSONL of per-item records keyed by "key"; a later record of a key wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tail_checked = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        records = {}
+        if not self.exists():
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves a truncated last line; that item is redone.
+                    continue
+                records[record["key"]] = record
+        return records
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            if not self._tail_checked:
+                # Terminate a truncated last line so it does not swallow this record.
+                self._tail_checked = True
+                if os.path.exists(self.path) and os.path.getsize(self.path):
+                    with open(self.path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            line = "\n" + line
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+def run_items(items, work, checkpoint, key, limiter=None, requests_per_item=1, concurrency=None,
+              max_retries=None, sleep=time.sleep, batch_size=1):
+    """
+    Runs `work(item)` -> record dict for every item whose `key(item)` is not yet in
+    `checkpoint`, and appends each record (with its "key") as it finishes. `limiter`
+    (None = unpaced) is charged `requests_per_item` per item and attempt.
+
+    With `batch_size` > 1, `work` takes a list of up to `batch_size` pending items and
+    returns one record or exception per item, in order; only the items rejected with a
+    429 are retried, together. `concurrency` then counts batches.
+    Returns (all records by key, including earlier runs', {key: error} of failed items).
+    """
+    concurrency = concurrency or config.EVAL_CONCURRENCY
+    max_retries = config.EVAL_MAX_RETRIES if max_retries is None else max_retries
+    records = checkpoint.load()
+    pending = [item for item in items if key(item) not in records]
+    if records:
+        print(f"[Checkpoint] {len(items) - len(pending)}/{len(items)} items already done in {checkpoint.path}")
+    errors = {}
+
+    def work_batch(batch):
+        if batch_size > 1:
+            return work(batch)
+        try:
+            return [work(batch[0])]
+        except Exception as e:
+            return [e]
+
+    def attempt(batch):
+        outcomes = {}
+        for retry in range(max_retries + 1):
+            issued_at = limiter.acquire(requests_per_item * len(batch)) if limiter is not None else None
+            try:
+                results = work_batch(batch)
+            except Exception as e:
+                results = [e] * len(batch)
+            limited = []
+            for item, result in zip(batch, results):
+                if isinstance(result, Exception) and is_rate_limit_error(result) and retry < max_retries:
+                    limited.append((item, result))
+                else:
+                    outcomes[key(item)] = result
+            if not limited:
+                if limiter is not None and any(not isinstance(r, Exception) for r in results):
+                    limiter.on_success()
+                break
+            retry_after = max((retry_after_seconds(e) or 0 for _, e in limited), default=0) or None
+            if limiter is not None:
+                limiter.on_rate_limit(retry_after, issued_at)
+            delay = max(backoff_delay(retry), retry_after or 0)
+            label = key(limited[0][0])[:60] if len(limited) == 1 else f"{len(limited)} items"
+            print(f"  [429] {label!r}: retry {retry + 1}/{max_retries} in {delay:.1f}s "
+                  f"(pacing {limiter.rate if limiter else 0:.1f}/min)")
+            sleep(delay)
+            batch = [item for item, _ in limited]
+        return outcomes
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    start = time.time()
+    done = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(attempt, batch) for batch in batches]
+        for future in as_completed(futures):
+            for item_key, result in future.result().items():
+                done += 1
+                if isinstance(result, Exception):
+                    errors[item_key] = str(result)
+                    print(f"  [ERROR] {item_key[:60]!r}: {result}")
+                    continue
+                record = {"key": item_key, **result}
+                checkpoint.append(record)
+                records[item_key] = record
+                print(f"[{done}/{len(pending)}] done in {time.time() - start:.0f}s: {item_key[:60]!r}")
+    return records, errors
+
+def eval_limiter(requests_per_minute=None):
+    return AdaptiveRateLimiter(requests_per_minute or config.EVAL_REQUESTS_PER_MINUTE)
@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import sys
+import time
+import faiss
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Go up TWO levels to reach project root (src/evaluation -> src -> root)
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from src import ann, config
+
+# (label, build params, search params) swept by default.
+CONFIGS = [
+    ("flat", {"type": "flat"}, {}),
+    ("hnsw M=16 ef=32", {"type": "hnsw", "m": 16, "ef_construction": 200}, {"ef_search": 32}),
+    ("hnsw M=32 ef=64", {"type": "hnsw", "m": 32, "ef_construction": 200}, {"ef_search": 64}),
+    ("hnsw M=32 ef=128", {"type": "hnsw", "m": 32, "ef_construction": 200}, {"ef_search": 128}),
+    ("ivf_flat nprobe=8", {"type": "ivf_flat", "nlist": 0}, {"nprobe": 8}),
+    ("ivf_flat nprobe=32", {"type": "ivf_flat", "nlist": 0}, {"nprobe": 32}),
+    ("ivf_sq nprobe=16", {"type": "ivf_sq", "nlist": 0}, {"nprobe": 16}),
+    ("ivf_pq nprobe=16", {"type": "ivf_pq", "nlist": 0, "pq_m": 64, "pq_nbits": 8}, {"nprobe": 16}),
+]
+
+def load_vectors(index_path):
+    """Reconstructs the stored vectors of a built index."""
+    index = faiss.read_index(os.path.join(index_path, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+def synthetic_vectors(n, dim, seed=0):
+    """Clustered unit vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size=n)] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_queries(vectors, num_queries, seed=1):
+    """Perturbed corpus vectors, so each query has a meaningful neighbourhood."""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.choice(len(vectors), size=num_queries, replace=len(vectors) < num_queries)]
+    queries = picks + 0.05 * rng.normal(size=picks.shape).astype(np.float32)
+    return np.ascontiguousarray(queries, dtype=np.float32)
+
+def benchmark(label, build_params, search_params, vectors, queries, truth, k):
+    start = time.perf_counter()
+    index = ann.make_index(vectors.shape[1], build_params, vectors[:config.ANN_TRAIN_SIZE])
+    index.add(vectors)
+    build_s = time.perf_counter() - start
+    ann.set_search_params(index, **search_params)
+
+    latencies = []
+    found = []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+    return {
+        "config": label,
+        "build": build_params,
+        "search": search_params,
+        "recall_at_k": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "memory_mb": round(ann.memory_bytes(index) / 1e6, 2),
+        "build_s": round(build_s, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency/memory benchmark of FAISS index types.")
+    parser.add_argument("--index-path", default=config.INDEX_PATH, help="Built index whose vectors are used")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the index")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=15, help="Neighbours per query (hop-2 depth)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    elif os.path.exists(os.path.join(args.index_path, "index.faiss")):
+        vectors = load_vectors(args.index_path)
+    else:
+        print(f"No index at {args.index_path}; run ingestion or pass --synthetic N.")
+        sys.exit(1)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = make_queries(vectors, args.queries)
+    k = min(args.k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, recall@{k} vs flat\n")
+    print(f"{'config':<20} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'memory MB':>10} {'build s':>8}")
+    results = []
+    for label, build_params, search_params in CONFIGS:
+        result = benchmark(label, build_params, search_params, vectors, queries, truth, k)
+        results.append(result)
+        print(f"{label:<20} {result['recall_at_k']:>7.3f} {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f} "
+              f"{result['memory_mb']:>10.2f} {result['build_s']:>8.2f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+if __name__ == "__main__":
+    main()
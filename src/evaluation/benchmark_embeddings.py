@@ -0,0 +1,170 @@
+"""
+Compares embedding backends and index storage on the evaluation set.
+
+Every backend (--backends) builds a float32 flat index of data/ under --work-dir
+(reused unless --rebuild, with its own embedding cache so a rebuild measures real
+embedding throughput). The same vectors are then indexed at every storage precision
+(--storage) and each question of evaluation_dataset.json is embedded and searched,
+reporting build throughput, query embedding and search latency, hit rate / MRR of the
+expected article in the top k, recall@k against float32 and index size:
+
+    python src/evaluation/benchmark_embeddings.py --backends local,google --json emb.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Go up TWO levels to reach project root (src/evaluation -> src -> root)
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from src import ann, config, ingestion
+from src.chunk_store import ChunkStoreFAISS
+from src.embedding_backends import BACKENDS, document_embeddings, embedding_model_name
+from src.evaluation.evaluate_retrieval import calculate_mrr, find_rank
+
+BUILD_FILE = "benchmark_build.json"
+
+def build(backend, path, rebuild=False):
+    """(vectorstore, build stats, raw embeddings) of `backend`'s float32 index at `path`."""
+    cache_path = os.path.join(path, "embeddings.sqlite")
+    if rebuild and os.path.exists(cache_path):
+        os.remove(cache_path)
+    embeddings = document_embeddings(backend, cache_path=cache_path)
+    stats_path = os.path.join(path, BUILD_FILE)
+    if rebuild or not os.path.exists(stats_path):
+        start = time.perf_counter()
+        vectorstore = ingestion.build_index(path, embeddings=embeddings)
+        build_s = time.perf_counter() - start
+        stats = {
+            "model": embedding_model_name(backend),
+            "chunks": vectorstore.index.ntotal,
+            "dim": vectorstore.index.d,
+            "build_s": round(build_s, 2),
+            "chunks_per_s": round(vectorstore.index.ntotal / build_s, 1)
+        }
+        with open(stats_path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        stats = json.load(f)
+    vectorstore = ChunkStoreFAISS.load_local(path, embeddings, mmap=False)
+    return vectorstore, stats, embeddings.embeddings
+
+def embed_questions(embeddings, questions):
+    """Query vectors one at a time, as the engine embeds them, with per-query latency in ms."""
+    vectors, latencies = [], []
+    for question in questions:
+        start = time.perf_counter()
+        vectors.append(embeddings.embed_query(question))
+        latencies.append((time.perf_counter() - start) * 1000)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return np.ascontiguousarray(matrix), latencies
+
+def evaluate_storage(vectorstore, storage, rescore, queries, eval_data, k, truth=None):
+    vectors = ann.stored_vectors(vectorstore.index)
+    params = ann.ann_params("flat", storage=storage, rescore=rescore)
+    index = ann.make_index(vectors.shape[1], params, vectors[:config.ANN_TRAIN_SIZE])
+    index.add(vectors)
+
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, positions = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append([int(p) for p in positions[0] if p != -1])
+
+    docstore, id_map = vectorstore.docstore, vectorstore.index_to_docstore_id
+    hits, mrr = 0, 0.0
+    for item, positions in zip(eval_data, found):
+        docs = [docstore.search(id_map[p]).metadata for p in positions]
+        rank = find_rank(docs, item['expected_document_title'].lower())
+        hits += rank > 0
+        mrr += calculate_mrr(rank)
+    info = ann.describe(index)
+    result = {
+        "storage": storage,
+        "rescore": rescore if storage != "float32" else 0,
+        "hit_rate": round(hits / len(eval_data), 4),
+        "mrr": round(mrr / len(eval_data), 4),
+        "search_p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "search_p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "index_mb": round(info["bytes"] / 1e6, 2),
+        "rescore_mb": round(info.get("rescore_bytes", 0) / 1e6, 2)
+    }
+    if truth is not None:
+        result["recall_vs_float32"] = round(float(np.mean([
+            len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)
+        ])), 4)
+    return result, found
+
+def main():
+    default_backends = "local,google" if config.GOOGLE_API_KEY else "local"
+    parser = argparse.ArgumentParser(description="Embedding backend / storage benchmark on the evaluation set.")
+    parser.add_argument("--backends", default=default_backends, help=f"Comma-separated subset of {BACKENDS}")
+    parser.add_argument("--storage", default=",".join(ann.STORAGE_TYPES), help="Comma-separated storage types")
+    parser.add_argument("--rescore", type=int, default=config.EMBEDDING_RESCORE_FACTOR,
+                        help="Rescore factor for float16/int8 (0 = none)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "rag_embedding_benchmark"),
+                        help="Where each backend's index (and embedding cache) is built and reused")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the indexes with a cold embedding cache")
+    parser.add_argument("--data", default=os.path.join(root_dir, 'data', 'eval_datasets', 'evaluation_dataset.json'))
+    parser.add_argument("--k", type=int, default=8, help="Hits scored per question (hop-2 depth after rerank)")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with open(args.data, 'r', encoding='utf-8') as f:
+        eval_data = json.load(f)
+    questions = [item["question"] for item in eval_data]
+    storages = [s.strip() for s in args.storage.split(",") if s.strip()]
+    if "float32" in storages:
+        storages.remove("float32")
+    storages.insert(0, "float32")
+    # The float32 flat index is the reference every storage type is built from.
+    config.ANN_INDEX_TYPE = "flat"
+    config.EMBEDDING_STORAGE = "float32"
+    config.BM25_ENABLED = False
+
+    report = {"settings": {k: v for k, v in vars(args).items() if k != "json"}, "backends": {}}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        if backend not in BACKENDS:
+            parser.error(f"Unknown backend '{backend}'. Options: {', '.join(BACKENDS)}.")
+        print(f"\n=== {backend} ({embedding_model_name(backend)}) ===")
+        vectorstore, build_stats, embeddings = build(backend, os.path.join(args.work_dir, backend), args.rebuild)
+        queries, embed_latencies = embed_questions(embeddings, questions)
+        results, truth = [], None
+        for storage in storages:
+            result, found = evaluate_storage(vectorstore, storage, args.rescore, queries, eval_data, args.k, truth)
+            truth = truth if truth is not None else found
+            results.append(result)
+        report["backends"][backend] = {
+            "build": build_stats,
+            "query_embed_p50_ms": round(float(np.percentile(embed_latencies, 50)), 2),
+            "query_embed_p95_ms": round(float(np.percentile(embed_latencies, 95)), 2),
+            "storage": results
+        }
+
+    print(f"\n{'backend':<8} {'chunks/s':>9} {'embed p50 ms':>13} {'embed p95 ms':>13}")
+    for backend, entry in report["backends"].items():
+        print(f"{backend:<8} {entry['build']['chunks_per_s']:>9.1f} {entry['query_embed_p50_ms']:>13.2f} "
+              f"{entry['query_embed_p95_ms']:>13.2f}")
+    print(f"\n{'backend':<8} {'storage':<8} {'hit@' + str(args.k):>7} {'MRR':>6} {'recall':>7} "
+          f"{'search p50 ms':>14} {'index MB':>9} {'rescore MB':>11}")
+    for backend, entry in report["backends"].items():
+        for r in entry["storage"]:
+            print(f"{backend:<8} {r['storage']:<8} {r['hit_rate']:>7.3f} {r['mrr']:>6.3f} "
+                  f"{r.get('recall_vs_float32', 1.0):>7.3f} {r['search_p50_ms']:>14.3f} {r['index_mb']:>9.2f} "
+                  f"{r['rescore_mb']:>11.2f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Tail-latency benchmark of the LLM client layer against local stub servers.
+
+Two fakes.StubLLMServer instances stand in for Groq and Gemini, with injected slow
+replies and 429s (seeded, so every scenario sees the same ones). Each scenario builds
+the engine's LLM the way RAGEngine does (llm_router.build_llm, real SDK clients) and
+sends --calls concurrent requests through it:
+
+    direct    LLM_PROVIDER's client alone, with the SDK's own retries (LLM_ROUTER=false)
+    failover  the router without hedging: deadline, circuit breakers, failover
+    hedged    the router with hedged requests as well
+
+With --outage the primary rejects every request for the middle fifth of the run.
+Needs no API keys or network:
+
+    python src/evaluation/benchmark_llm_router.py --calls 400 --outage --json router.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Go up TWO levels to reach project root (src/evaluation -> src -> root)
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from src import config
+from src.fakes import StubLLMServer
+from src.llm_router import build_llm
+
+SCENARIOS = ("direct", "failover", "hedged")
+PERCENTILES = (50, 95, 99)
+PROMPT = "Pertanyaan User: {question}\n\nOutput: Query baku saja."
+
+def start_servers(args):
+    primary = StubLLMServer(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                            error_rate=args.error_rate, retry_after=args.retry_after, seed=1).start()
+    secondary = StubLLMServer(latency=args.latency * 1.5, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                              error_rate=args.error_rate, retry_after=args.retry_after, seed=2).start()
+    return primary, secondary
+
+def configure(scenario, primary, secondary, args):
+    config.LLM_PROVIDER = "groq"
+    config.GROQ_API_KEY = config.GOOGLE_API_KEY = "stub"
+    config.GROQ_MODEL = "stub-groq"
+    config.GROQ_BASE_URL, config.GEMINI_BASE_URL = primary.url, secondary.url
+    config.LLM_ROUTER = scenario != "direct"
+    config.LLM_FAILOVER = True
+    config.LLM_DEADLINE = args.deadline
+    config.LLM_HEDGE_PERCENTILE = args.hedge_percentile if scenario == "hedged" else 0
+
+def run_scenario(scenario, args):
+    primary, secondary = start_servers(args)
+    try:
+        configure(scenario, primary, secondary, args)
+        llm = build_llm()
+        llm = llm.route("reformulate") if hasattr(llm, "route") else llm
+        outage = range(int(args.calls * 0.4), int(args.calls * 0.6)) if args.outage else range(0)
+
+        def one(i):
+            if i == outage.start and args.outage:
+                primary.error_rate = 1.0
+            elif i == outage.stop and args.outage:
+                primary.error_rate = args.error_rate
+            start = time.perf_counter()
+            try:
+                message = llm.invoke(PROMPT.format(question=f"pertanyaan nomor {i}"))
+            except Exception as e:
+                return time.perf_counter() - start, None, type(e).__name__
+            return time.perf_counter() - start, message.response_metadata.get("llm_provider", "groq"), None
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            warm = list(pool.map(one, [-1 - i for i in range(args.warmup)]))
+        primary_before, secondary_before = primary.requests, secondary.requests
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(one, range(args.calls)))
+        wall = time.perf_counter() - start
+    finally:
+        primary.stop()
+        secondary.stop()
+
+    latencies = [seconds for seconds, _, error in outcomes if error is None]
+    errors = {}
+    for _, _, error in outcomes:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        "scenario": scenario,
+        "calls": args.calls,
+        "warmup_errors": sum(1 for _, _, error in warm if error is not None),
+        "throughput_cps": round(args.calls / wall, 2),
+        "latency_s": {f"p{p}": round(float(np.percentile(latencies, p)), 4) for p in PERCENTILES} if latencies else None,
+        "max_s": round(max(latencies), 4) if latencies else None,
+        "errors": errors,
+        "answered_by": {name: sum(1 for _, by, _ in outcomes if by == name) for name in ("groq", "gemini")},
+        "requests_sent": {"groq": primary.requests - primary_before, "gemini": secondary.requests - secondary_before}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM router tail-latency benchmark against local stub servers.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=60, help="Unmeasured calls first, so hedging has latencies")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="Normal reply latency of the primary (s)")
+    parser.add_argument("--slow-rate", type=float, default=0.02, help="Share of replies that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--error-rate", type=float, default=0.03, help="Share of requests rejected with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429s (s)")
+    parser.add_argument("--deadline", type=float, default=10.0)
+    parser.add_argument("--hedge-percentile", type=float, default=config.LLM_HEDGE_PERCENTILE)
+    parser.add_argument("--outage", action="store_true", help="The primary returns 429s for the middle fifth of the run")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    report = {"settings": {k: v for k, v in vars(args).items() if k != "json"}, "scenarios": []}
+    for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if scenario not in SCENARIOS:
+            parser.error(f"Unknown scenario '{scenario}'. Options: {', '.join(SCENARIOS)}.")
+        print(f"\n=== {scenario} ===")
+        report["scenarios"].append(run_scenario(scenario, args))
+
+    print(f"\n{'scenario':<9} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} {'errors':>7} "
+          f"{'by groq':>8} {'by gemini':>10} {'sent':>6}")
+    for r in report["scenarios"]:
+        latency = r["latency_s"] or {f"p{p}": float("nan") for p in PERCENTILES}
+        print(f"{r['scenario']:<9} {latency['p50']:>7.3f} {latency['p95']:>7.3f} {latency['p99']:>7.3f} "
+              f"{r['max_s'] or float('nan'):>7.3f} {sum(r['errors'].values()):>7} {r['answered_by']['groq']:>8} "
+              f"{r['answered_by']['gemini']:>10} {sum(r['requests_sent'].values()):>6}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+if __name__ == "__main__":
+    main()
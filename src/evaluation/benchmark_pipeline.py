@@ -0,0 +1,292 @@
+"""
+Offline end-to-end benchmark of RAGEngine with the stand-ins in src/fakes.py.
+
+Builds an index from data/ with the hashing embedder (once, then reused), drives the
+engine through single-query, batch, concurrent (asyncio) and threaded (one thread per
+in-flight request, as the Modal service runs) scenarios with a scripted LLM of
+configurable latency, and reports throughput, p50/p95/p99 latency per request and per
+stage (from each result's "metrics"), and peak memory. Needs no API keys or network,
+so it can run on every change:
+
+    python src/evaluation/benchmark_pipeline.py --json bench.json
+    python src/evaluation/benchmark_pipeline.py --compare bench.json
+    python src/evaluation/benchmark_pipeline.py --scenarios threaded --serial-reranker --rerank-call-latency 0.02 \
+        --micro-batching
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Go up TWO levels to reach project root (src/evaluation -> src -> root)
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from src import config, ingestion, metrics
+from src.fakes import FakeChatModel, FakeEmbeddings, FakeReranker
+
+SCENARIOS = ("single", "batch", "concurrent", "threaded")
+PERCENTILES = (50, 95, 99)
+
+def load_questions(num_queries):
+    """Evaluation questions, repeated with a numbered suffix to reach `num_queries` distinct queries."""
+    with open(os.path.join(root_dir, 'data', 'eval_datasets', 'evaluation_dataset.json'), 'r', encoding='utf-8') as f:
+        questions = [item["question"] for item in json.load(f)]
+    return [
+        questions[i % len(questions)] + (f" ({i // len(questions)})" if i >= len(questions) else "")
+        for i in range(num_queries)
+    ]
+
+def ensure_index(index_path, embeddings, rebuild=False):
+    if rebuild or not os.path.exists(os.path.join(index_path, "index.faiss")):
+        start = time.perf_counter()
+        ingestion.build_index(index_path, embeddings=embeddings)
+        print(f"Built benchmark index at {index_path} in {time.perf_counter() - start:.1f}s")
+
+def percentiles(values):
+    if not values:
+        return None
+    return {f"p{p}": round(float(np.percentile(values, p)), 4) for p in PERCENTILES}
+
+def run_single(engine, queries, args):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(engine.process_query(query))
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+def run_batch(engine, queries, args):
+    # Every query of a batch waits for the whole batch.
+    latencies, results = [], []
+    for start in range(0, len(queries), args.batch_size):
+        batch = queries[start:start + args.batch_size]
+        batch_start = time.perf_counter()
+        results.extend(engine.process_queries(batch, max_concurrency=args.concurrency))
+        latencies.extend([time.perf_counter() - batch_start] * len(batch))
+    return latencies, results
+
+def run_concurrent(engine, queries, args):
+    latencies, results = [], []
+
+    async def one(query, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                results.append(await engine.process_query_async(query))
+            except Exception as e:
+                results.append({"original_query": query, "error": str(e)})
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*(one(q, semaphore) for q in queries))
+
+    asyncio.run(main())
+    return latencies, results
+
+def run_threaded(engine, queries, args):
+    def one(query):
+        start = time.perf_counter()
+        try:
+            result = engine.process_query(query)
+        except Exception as e:
+            result = {"original_query": query, "error": str(e)}
+        return time.perf_counter() - start, result
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        outcomes = list(pool.map(one, queries))
+    return [seconds for seconds, _ in outcomes], [result for _, result in outcomes]
+
+RUNNERS = {"single": run_single, "batch": run_batch, "concurrent": run_concurrent, "threaded": run_threaded}
+
+def batchers(engine):
+    found = {"query_embed": engine.query_batcher, "rerank": getattr(engine.reranker, "batcher", None)}
+    return {name: batcher for name, batcher in found.items() if batcher is not None}
+
+def batch_stats(before, after):
+    """Batches sent between two MicroBatcher.stats() snapshots, with their mean size."""
+    batches = after["batches"] - before["batches"]
+    return {
+        "batches": batches,
+        "mean_items": round((after["items"] - before["items"]) / batches, 2) if batches else 0.0,
+        "mean_requests": round((after["requests"] - before["requests"]) / batches, 2) if batches else 0.0
+    }
+
+def output_digest(results):
+    """Hash of the reformulations and references; changes only if the pipeline's output does."""
+    digest = hashlib.sha1()
+    for result in sorted(results, key=lambda r: r["original_query"]):
+        links = [ref.get("link", "") for ref in result.get("references", [])]
+        digest.update(json.dumps([result["original_query"], result.get("reformulated_query"), links]).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+def summarize(name, latencies, results, wall_s, traced_peak):
+    ok = [r for r in results if "error" not in r]
+    stage_seconds = {}
+    tokens = {"input": 0, "output": 0, "reasoning": 0}
+    # Batch results share one batch-level trace; count each trace once.
+    traces = {id(r["metrics"]): r["metrics"] for r in ok if "metrics" in r}
+    for trace in traces.values():
+        for stage, entry in trace["stages"].items():
+            stage_seconds.setdefault(stage, []).append(entry["seconds"])
+        for kind in tokens:
+            tokens[kind] += trace["tokens"][kind]
+    return {
+        "scenario": name,
+        "queries": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": round(wall_s, 3),
+        "throughput_qps": round(len(ok) / wall_s, 2) if wall_s > 0 else None,
+        "latency_s": percentiles(latencies),
+        "stages_s": {stage: percentiles(values) for stage, values in stage_seconds.items()},
+        "llm_tokens": tokens,
+        "peak_rss_mb": round(ingestion.peak_rss_mb() or 0, 1),
+        "peak_traced_mb": round(traced_peak / 1e6, 1) if traced_peak is not None else None,
+        "output_digest": output_digest(ok)
+    }
+
+def run_scenario(engine, name, queries, args):
+    # Fresh query-embedding cache, so scenarios don't warm each other up.
+    engine.query_cache = type(engine.query_cache)("fake", max_size=config.QUERY_CACHE_SIZE)
+    batchers_before = {name: batcher.stats() for name, batcher in batchers(engine).items()}
+    if args.trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stdout):
+        latencies, results = RUNNERS[name](engine, queries, args)
+    wall_s = time.perf_counter() - start
+    traced_peak = None
+    if args.trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    summary = summarize(name, latencies, results, wall_s, traced_peak)
+    if batchers_before:
+        summary["micro_batches"] = {
+            name: batch_stats(batchers_before[name], batcher.stats()) for name, batcher in batchers(engine).items()
+        }
+    return summary
+
+def print_report(report):
+    print(f"\n{'scenario':<11} {'qps':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>7} {'RSS MB':>8}")
+    for result in report["scenarios"].values():
+        latency = result["latency_s"] or {"p50": 0, "p95": 0, "p99": 0}
+        print(f"{result['scenario']:<11} {result['throughput_qps'] or 0:>8.2f} {latency['p50']:>8.4f} "
+              f"{latency['p95']:>8.4f} {latency['p99']:>8.4f} {result['errors']:>7} {result['peak_rss_mb']:>8.1f}")
+    for result in report["scenarios"].values():
+        for batcher, sizes in result.get("micro_batches", {}).items():
+            print(f"[{result['scenario']}] {sizes['batches']} {batcher} micro-batches of {sizes['mean_items']} "
+                  f"items from {sizes['mean_requests']} requests on average")
+    for result in report["scenarios"].values():
+        print(f"\n[{result['scenario']}] per stage (s)")
+        for stage, values in result["stages_s"].items():
+            print(f"  {stage:<12} p50 {values['p50']:>8.4f}  p95 {values['p95']:>8.4f}  p99 {values['p99']:>8.4f}")
+
+def compare(report, baseline, max_regression):
+    """Prints p95 latency and throughput against `baseline`; returns the regressed scenarios."""
+    print(f"\nAgainst baseline (p95 latency / throughput, regression threshold {max_regression:.0%}):")
+    regressed = []
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or not base.get("latency_s") or not result["latency_s"]:
+            continue
+        p95_ratio = result["latency_s"]["p95"] / base["latency_s"]["p95"] if base["latency_s"]["p95"] else 1.0
+        qps_ratio = result["throughput_qps"] / base["throughput_qps"] if base["throughput_qps"] else 1.0
+        flags = []
+        if p95_ratio > 1 + max_regression or qps_ratio < 1 - max_regression:
+            flags.append("REGRESSION")
+            regressed.append(name)
+        if result["output_digest"] != base.get("output_digest"):
+            flags.append("output changed")
+        print(f"  {name:<11} p95 {p95_ratio:>6.2f}x  qps {qps_ratio:>6.2f}x  {' '.join(flags)}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark of the RAG pipeline.")
+    parser.add_argument("--index-path", default=os.path.join(tempfile.gettempdir(), "rag_benchmark_index"),
+                        help="Where the fake-embedding index is built and reused")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index even if it exists")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=768, help="Fake embedding dimension")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per LLM output token")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per embedding call")
+    parser.add_argument("--rerank-latency", type=float, default=0.0005, help="Seconds per reranked pair")
+    parser.add_argument("--rerank-call-latency", type=float, default=0.0, help="Seconds per reranker call")
+    parser.add_argument("--serial-reranker", action="store_true",
+                        help="Reranker calls run one at a time, like a local model using every core")
+    parser.add_argument("--micro-batching", action="store_true",
+                        help="Coalesce query embeddings and rerank pairs of concurrent requests")
+    parser.add_argument("--think-words", type=int, default=0, help="Length of a <think> block in LLM replies")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the semantic answer cache on")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report tracemalloc peaks (slower)")
+    parser.add_argument("--verbose", dest="quiet", action="store_false", help="Show the engine's output and debug log")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Relative p95/throughput change that fails --compare")
+    args = parser.parse_args()
+
+    # Results are compared across runs, so nothing may be served from earlier state.
+    config.ANSWER_CACHE_ENABLED = args.answer_cache
+    config.QUERY_CACHE_PATH = None
+    config.METRICS_LOG = False
+    if not args.quiet:
+        metrics.logger.setLevel(logging.DEBUG)
+
+    ensure_index(args.index_path, FakeEmbeddings(dim=args.dim), args.rebuild)
+    from src.rag_engine import RAGEngine
+
+    llm = FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency, think_words=args.think_words)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stdout):
+        engine = RAGEngine(
+            llm=llm,
+            embeddings=FakeEmbeddings(dim=args.dim, latency=args.embed_latency),
+            reranker=FakeReranker(latency=args.rerank_latency, call_latency=args.rerank_call_latency,
+                                  serial=args.serial_reranker),
+            index_path=args.index_path,
+            micro_batching=args.micro_batching
+        )
+
+    queries = load_questions(args.queries)
+    report = {
+        "settings": {k: v for k, v in vars(args).items() if k not in ("json", "compare", "quiet")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "chunks": engine.vectorstore.index.ntotal},
+        "scenarios": {}
+    }
+    for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if name not in RUNNERS:
+            parser.error(f"Unknown scenario '{name}'. Options: {', '.join(SCENARIOS)}.")
+        print(f"Running '{name}' ({len(queries)} queries)...")
+        report["scenarios"][name] = run_scenario(engine, name, queries, args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.max_regression):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
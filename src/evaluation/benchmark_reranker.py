@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Go up TWO levels to reach project root (src/evaluation -> src -> root)
+root_dir = os.path.dirname(os.path.dirname(current_dir))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from src import config, ingestion
+from src.reranker import OnnxReranker, TorchReranker
+
+def load_workload(num_queries, pairs_per_query):
+    """Evaluation questions, each paired with chunks from its expected category."""
+    with open(os.path.join(root_dir, 'data', 'eval_datasets', 'evaluation_dataset.json'), 'r', encoding='utf-8') as f:
+        eval_data = json.load(f)[:num_queries]
+
+    stripper = ingestion.BoilerplateStripper()
+    splitter = ingestion.get_text_splitter()
+    chunks_by_theme = {}
+    for doc in ingestion.iter_documents(ingestion.iter_entries(), stripper=stripper):
+        theme_chunks = chunks_by_theme.setdefault(doc.metadata["theme"], [])
+        if len(theme_chunks) < pairs_per_query:
+            theme_chunks.extend(s.page_content for s in splitter.split_documents([doc]))
+
+    workload = []
+    all_chunks = [c for chunks in chunks_by_theme.values() for c in chunks]
+    for item in eval_data:
+        chunks = chunks_by_theme.get(item["category"], all_chunks)[:pairs_per_query]
+        workload.append([[item["question"], c] for c in chunks])
+    return workload
+
+def spearman(a, b):
+    ra = np.argsort(np.argsort(a))
+    rb = np.argsort(np.argsort(b))
+    if len(a) < 2:
+        return 1.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+def run_backend(reranker, workload, repeats):
+    scores = [np.asarray(reranker.predict(pairs), dtype=np.float64) for pairs in workload]
+    latencies = []
+    for _ in range(repeats):
+        for pairs in workload:
+            start = time.perf_counter()
+            reranker.predict(pairs)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return scores, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Reranker backend parity and latency benchmark.")
+    parser.add_argument("--model", default=config.RERANKER_MODEL)
+    parser.add_argument("--max-length", type=int, default=config.RERANKER_MAX_LENGTH)
+    parser.add_argument("--batch-size", type=int, default=config.RERANK_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=config.RERANKER_THREADS)
+    parser.add_argument("--onnx-dir", default=config.RERANKER_ONNX_DIR)
+    parser.add_argument("--queries", type=int, default=15)
+    parser.add_argument("--pairs", type=int, default=15, help="Pairs per query (top_k_initial)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-top-k-overlap", type=float, default=0.9,
+                        help="Fail if the int8 backend keeps less of the torch top-8 than this")
+    args = parser.parse_args()
+
+    print("Preparing workload...")
+    workload = load_workload(args.queries, args.pairs)
+    common = dict(model_name=args.model, max_length=args.max_length, batch_size=args.batch_size, num_threads=args.threads)
+
+    backends = [
+        ("torch fp32", lambda: TorchReranker(**common)),
+        ("onnx fp32", lambda: OnnxReranker(onnx_dir=args.onnx_dir, quantize=False, **common)),
+        ("onnx int8", lambda: OnnxReranker(onnx_dir=args.onnx_dir, quantize=True, **common)),
+    ]
+
+    reference = None
+    failed = False
+    print(f"\n{'backend':<11} {'p50 ms':>8} {'p95 ms':>8} {'max|diff|':>10} {'spearman':>9} {'top8 kept':>10}")
+    for name, factory in backends:
+        scores, latencies = run_backend(factory(), workload, args.repeats)
+        if reference is None:
+            reference = scores
+        max_diff = max(float(np.max(np.abs(s - r))) if len(s) else 0.0 for s, r in zip(scores, reference))
+        rho = np.mean([spearman(s, r) for s, r in zip(scores, reference)])
+        overlap = np.mean([
+            len(set(np.argsort(-s)[:8]) & set(np.argsort(-r)[:8])) / min(8, len(r))
+            for s, r in zip(scores, reference) if len(r)
+        ])
+        print(f"{name:<11} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f} "
+              f"{max_diff:>10.4f} {rho:>9.4f} {overlap:>10.1%}")
+
+        if name == "onnx fp32" and max_diff > 1e-3:
+            print("  PARITY FAIL: fp32 ONNX scores differ from PyTorch by more than 1e-3")
+            failed = True
+        if name == "onnx int8" and overlap < args.min_top_k_overlap:
+            print(f"  PARITY FAIL: int8 keeps {overlap:.1%} of the PyTorch top-8 (< {args.min_top_k_overlap:.0%})")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
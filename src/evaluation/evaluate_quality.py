@@ -1,7 +1,7 @@
+import argparse
 import os
 import sys
 import json
-import time
 import pandas as pd
 
 # Note: We must insert root into path to import modules correctly
@@ -11,65 +11,87 @@ root_dir = os.path.dirname(os.path.dirname(current_dir))
 if root_dir not in sys.path:
     sys.path.append(root_dir)
 
-from src.rag_engine import RAGEngine
 from src import config
+from src.eval_runner import CheckpointLog, checkpoint_path, eval_limiter, run_items
 
-def generate_evaluation_dataset():
+def seed_checkpoint(checkpoint, cache_file):
+    """Imports the answers of an older all-or-nothing ragas_input.json run into an empty checkpoint."""
+    if checkpoint.exists() or not os.path.exists(cache_file):
+        return
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        data_dict = json.load(f)
+    imported = 0
+    for q, answer, ctx in zip(data_dict['question'], data_dict['answer'], data_dict['contexts']):
+        if answer != "Error generating answer.":
+            checkpoint.append({"key": q, "question": q, "answer": answer, "contexts": ctx})
+            imported += 1
+    print(f"[CACHE] Imported {imported} answers from {cache_file}")
+
+def generate_evaluation_dataset(checkpoint_file=None, concurrency=None, requests_per_minute=None, batch_size=None):
     print("--- RAG Response Generation for Manual Review ---")
     
     cache_file = os.path.join(root_dir, 'ragas_input.json')
-    
+    checkpoint = CheckpointLog(checkpoint_file or checkpoint_path("quality"))
+    seed_checkpoint(checkpoint, cache_file)
+
+    raw_data_path = os.path.join(root_dir, 'data', 'eval_datasets', 'evaluation_dataset.json')
+    with open(raw_data_path, 'r', encoding='utf-8') as f:
+        raw_data = json.load(f)
+    batch_questions = [item['question'] for item in raw_data]
+
+    engine = None
+    if len(checkpoint.load().keys() & set(batch_questions)) < len(batch_questions):
+        print("\n[GENERATOR] Initializing RAG Engine to generate the missing answers...")
+        from src.rag_engine import RAGEngine
+        engine = RAGEngine()
+        # Every question must get its own answer, never a cached one for a similar question.
+        engine.answer_cache = None
+
+    concurrency = concurrency or config.EVAL_CONCURRENCY
+    batch_size = batch_size or config.EVAL_BATCH_SIZE
+
+    def generate(questions):
+        # One batched embedding, matrix search and cross-encoder pass per chunk of questions.
+        results = engine.process_queries(questions, max_concurrency=concurrency)
+        return [
+            RuntimeError(result["error"]) if "error" in result else {
+                "question": q,
+                "answer": result['answer'],
+                "contexts": [doc.page_content for doc in result['final_docs']]
+            }
+            for q, result in zip(questions, results)
+        ]
+
+    print(f"Generating answers for {len(raw_data)} questions ({batch_size} per batch, {concurrency} LLM calls "
+          f"concurrent, checkpoint {checkpoint.path})...")
+    # Reformulation + answer: two LLM calls per question. Batches run one at a time; the
+    # concurrency is in the LLM calls inside each batch.
+    records, errors = run_items(
+        batch_questions, generate, checkpoint, key=lambda q: q,
+        limiter=eval_limiter(requests_per_minute), requests_per_item=2, concurrency=1, batch_size=batch_size
+    )
+
     questions = []
     answers = []
     contexts = []
+    for q in batch_questions:
+        questions.append(q)
+        if q not in records:
+            print(f"Error processing {q}: {errors.get(q, 'not generated')}")
+            answers.append("Error generating answer.")
+            contexts.append(["Error retrieving context."])
+            continue
+        answers.append(records[q]['answer'])
+        contexts.append(records[q]['contexts'])
 
-    if os.path.exists(cache_file):
-        print(f"\n[CACHE] Found existing data at {cache_file}")
-        print("Skipping Generation Phase. Loading cached answers...")
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            data_dict = json.load(f)
-            questions = data_dict['question']
-            answers = data_dict['answer']
-            contexts = data_dict['contexts']
-    else:
-        print("\n[GENERATOR] No cache found. Initializing RAG Engine to generate answers...")
-        engine = RAGEngine()
-        
-        raw_data_path = os.path.join(root_dir, 'data', 'eval_datasets', 'evaluation_dataset.json')
-        with open(raw_data_path, 'r', encoding='utf-8') as f:
-            raw_data = json.load(f)
-            
-        print(f"Starting Generation Loop for {len(raw_data)} questions (with 5s safety delay)...")
-        
-        for i, item in enumerate(raw_data):
-            q = item['question']
-            print(f"[{i+1}/{len(raw_data)}] Processing: {q[:40]}...")
-            
-            try:
-                result = engine.process_query(q)
-                
-                questions.append(q)
-                answers.append(result['answer'])
-                
-                ctx_texts = [doc.page_content for doc in result['final_docs']]
-                contexts.append(ctx_texts)
-                
-                time.sleep(5) 
-                
-            except Exception as e:
-                print(f"Error processing {q}: {e}")
-                questions.append(q)
-                answers.append("Error generating answer.")
-                contexts.append(["Error retrieving context."])
-        
-        print(f"\n[CACHE] Saving generated answers to {cache_file}...")
-        cache_data = {
-            'question': questions,
-            'answer': answers,
-            'contexts': contexts
-        }
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+    print(f"\n[CACHE] Saving generated answers to {cache_file}...")
+    cache_data = {
+        'question': questions,
+        'answer': answers,
+        'contexts': contexts
+    }
+    with open(cache_file, 'w', encoding='utf-8') as f:
+        json.dump(cache_data, f, ensure_ascii=False, indent=2)
 
     # 3. Export to CSV for Manual Review
     print("\n[EXPORT] Converting to CSV for manual evaluation...")
@@ -102,4 +124,12 @@ def generate_evaluation_dataset():
     print(f"SUCCESS: Dataset saved to: {output_csv}")
 
 if __name__ == "__main__":
-    generate_evaluation_dataset()
+    parser = argparse.ArgumentParser(description="Generates answers for manual review, resuming from a checkpoint.")
+    parser.add_argument("--checkpoint", help="Append-only JSONL of generated answers (resumed if present)")
+    parser.add_argument("--concurrency", type=int, default=config.EVAL_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--batch-size", type=int, default=config.EVAL_BATCH_SIZE,
+                        help="Questions per process_queries call")
+    parser.add_argument("--rpm", type=int, default=config.EVAL_REQUESTS_PER_MINUTE,
+                        help="Starting (and maximum) LLM requests per minute")
+    args = parser.parse_args()
+    generate_evaluation_dataset(args.checkpoint, args.concurrency, args.rpm, args.batch_size)
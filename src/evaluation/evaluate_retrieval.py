@@ -1,3 +1,4 @@
+import argparse
 import json
 import os
 import sys
@@ -12,85 +13,201 @@ root_dir = os.path.dirname(os.path.dirname(current_dir))
 if root_dir not in sys.path:
     sys.path.append(root_dir)
 
-from src.rag_engine import RAGEngine
+from src import config
+from src.eval_runner import CheckpointLog, checkpoint_path, eval_limiter, run_items
 
 def calculate_mrr(rank):
     if rank == 0:
         return 0
     return 1.0 / rank
 
-def run_evaluation(data_path):
-    print(f"Loading evaluation set from: {data_path}")
-    with open(data_path, 'r', encoding='utf-8') as f:
-        eval_data = json.load(f)
-    
-    engine = RAGEngine()
-    
-    total_questions = len(eval_data)
-    hits = 0
-    mrr_sum = 0
-    
-    print(f"\n--- Starting Evaluation on {total_questions} Questions ---\n")
-    
-    for i, item in enumerate(eval_data):
-        q = item['question']
+def find_rank(docs, target_doc):
+    """Rank of the first doc record whose title or source contains `target_doc`, 0 if none."""
+    for rank, doc in enumerate(docs, start=1):
+        doc_title = doc.get('title', '').lower()
+        doc_source = doc.get('source', '').lower()
+
+        if target_doc in doc_title or target_doc in doc_source:
+            return rank
+    return 0
+
+def doc_record(doc):
+    """What a checkpoint keeps of a retrieved chunk: enough to score it again later."""
+    return {
+        "id": getattr(doc, "id", None),
+        "title": doc.metadata.get("title", ""),
+        "source": doc.metadata.get("source", ""),
+        "link": doc.metadata.get("link", "")
+    }
+
+def new_tally(modes):
+    return {mode: {"hits": 0, "mrr": 0.0, "seconds": 0.0, "pairs": 0} for mode in modes}
+
+def record(tally, rank, seconds, pairs=0):
+    tally["hits"] += rank > 0
+    tally["mrr"] += calculate_mrr(rank)
+    tally["seconds"] += seconds
+    tally["pairs"] += pairs
+
+def retrieval_modes(engine):
+    # Hop 1 is scored on the raw question (top 3). BM25 runs first so the dense
+    # timing includes its embedding call rather than a query-cache hit.
+    hop1_modes = ["bm25", "dense"] if engine.bm25 is not None else ["dense"]
+    # Every hop-2 mode sees the same reformulated query, so differences are the mode's.
+    hop2_modes = {
+        "dense": {"retriever": "dense", "cascade": False},
+        "dense+cascade": {"retriever": "dense", "cascade": True},
+    }
+    if engine.bm25 is not None:
+        hop2_modes["bm25"] = {"retriever": "bm25", "cascade": False}
+        hop2_modes["hybrid"] = {"retriever": "hybrid", "cascade": False}
+    return hop1_modes, hop2_modes
+
+def evaluate_question(engine, item, hop1_modes, hop2_modes, reformulated_query=None):
+    """
+    Both hops for one question, as a checkpoint record. With `reformulated_query`
+    (from an earlier run) the LLM is not called.
+    """
+    q = item['question']
+    result = {"question": q, "index_version": engine.index_version, "hop1": {}, "hop2": {}}
+
+    # 1. Hop 1: Context
+    initial_docs = None
+    for mode in hop1_modes:
+        start = time.perf_counter()
+        docs = engine.initial_retrieval(q, retriever=mode)
+        result["hop1"][mode] = {"docs": [doc_record(d) for d in docs], "seconds": time.perf_counter() - start}
+        if mode == engine.hop1_retriever:
+            initial_docs = docs
+
+    # 2. Reformulation (The Core Feature)
+    if reformulated_query is None:
+        reformulated_query = engine.reformulate_query(q, initial_docs)
+    result["reformulated_query"] = reformulated_query
+
+    # 3. Hop 2: Precision Search using NEW Query
+    for mode, options in hop2_modes.items():
+        retrieved_docs, stats = engine.rerank_candidates(
+            reformulated_query, top_k_initial=15, top_k_final=8, **options
+        )
+        result["hop2"][mode] = {
+            "docs": [doc_record(d) for d in retrieved_docs],
+            "seconds": stats["seconds"],
+            "pairs": stats["pairs_scored"]
+        }
+    return result
+
+def report(eval_data, records):
+    """Hit rate / MRR per mode over the questions that have a record."""
+    scored = [(item, records[item['question']]) for item in eval_data if item['question'] in records]
+    total_questions = len(scored)
+    if not total_questions:
+        print("No finished questions to score.")
+        return
+    hop1 = new_tally(scored[0][1]["hop1"])
+    hop2 = new_tally(scored[0][1]["hop2"])
+
+    for item, result in scored:
         target_doc = item['expected_document_title'].lower()
-        
-        print(f"Query: {q}")
-        
-        try:
-            # 1. Hop 1: Context
-            initial_docs = engine.initial_retrieval(q)
-            
-            # 2. Reformulation (The Core Feature)
-            reformulated_query = engine.reformulate_query(q, initial_docs)
-            print(f"  [Ref. Query] {reformulated_query}")
-            
-            # 3. Hop 2: Precision Search using NEW Query
-            retrieved_docs = engine.final_retrieval_and_rerank(reformulated_query, top_k_initial=15, top_k_final=8)
-            
-            # Check for Hit
-            found_rank = 0 
-            
-            for rank, doc in enumerate(retrieved_docs, start=1):
-                doc_title = doc.metadata.get('title', '').lower()
-                doc_source = doc.metadata.get('source', '').lower()
-                
-                if target_doc in doc_title or target_doc in doc_source:
-                    found_rank = rank
-                    break
-            
-            if found_rank > 0:
-                print(f"  [HIT] Found at Rank {found_rank}")
-                hits += 1
-                mrr_sum += calculate_mrr(found_rank)
-            else:
-                print(f"  [MISS] Correct Doc '{target_doc}' not in top {len(retrieved_docs)}")
-                
-        except Exception as e:
-            print(f"  [ERROR] {e}")
-
-        # Rate Limit Pause (1m 30s)
-        if i < total_questions - 1:
-            print("  [Safety] Pausing 90s for API limits...", end='\r')
-            time.sleep(90)
-            print("  [Resume] Continuing...                        ")
+        for mode, tally in hop1.items():
+            entry = result["hop1"][mode]
+            record(tally, find_rank(entry["docs"], target_doc), entry["seconds"])
+        for mode, tally in hop2.items():
+            entry = result["hop2"][mode]
+            record(tally, find_rank(entry["docs"], target_doc), entry["seconds"], entry["pairs"])
 
     # Final Stats
-    hit_rate = (hits / total_questions) * 100
-    mrr_score = mrr_sum / total_questions
-    
     print("\n=== EVALUATION RESULTS ===")
-    print(f"Total Questions: {total_questions}")
-    print(f"Hit Rate: {hit_rate:.1f}%")
-    print(f"MRR Score: {mrr_score:.3f}")
+    print(f"Total Questions: {total_questions} of {len(eval_data)}")
+    print("Hop 1 (raw question, top 3):")
+    for mode, tally in hop1.items():
+        print(f"  [{mode}] Hit Rate: {tally['hits'] / total_questions * 100:.1f}% | "
+              f"MRR Score: {tally['mrr'] / total_questions:.3f} | "
+              f"Avg Latency: {tally['seconds'] / total_questions * 1000:.0f}ms")
+    print("Hop 2 (reformulated query, top 8 after rerank):")
+    for mode, tally in hop2.items():
+        print(f"  [{mode}] Hit Rate: {tally['hits'] / total_questions * 100:.1f}% | "
+              f"MRR Score: {tally['mrr'] / total_questions:.3f} | "
+              f"Avg Pairs Scored: {tally['pairs'] / total_questions:.1f} | "
+              f"Avg Retrieve+Rerank Time: {tally['seconds'] / total_questions * 1000:.0f}ms")
+    print("(Latencies are measured under concurrent load.)")
     print("===========================")
 
+def run_evaluation(data_path, checkpoint_file=None, rescore=False, output_file=None, report_only=False,
+                   concurrency=None, requests_per_minute=None):
+    """
+    Evaluates both hops on every question, resuming from `checkpoint_file`.
+
+    With `rescore`, the reformulations cached in `checkpoint_file` are reused, so only
+    retrieval runs (no LLM calls) and the records go to `output_file`; use it to score
+    a retrieval change against the same reformulated queries. Without `output_file`
+    each rescore writes a new timestamped file, so an earlier rescore is never resumed
+    as if it were current. `report_only` scores the checkpoint without running anything.
+    """
+    print(f"Loading evaluation set from: {data_path}")
+    with open(data_path, 'r', encoding='utf-8') as f:
+        eval_data = json.load(f)
+
+    checkpoint = CheckpointLog(checkpoint_file or checkpoint_path("retrieval"))
+    if report_only:
+        report(eval_data, checkpoint.load())
+        return
+
+    from src.rag_engine import RAGEngine
+    engine = RAGEngine()
+    hop1_modes, hop2_modes = retrieval_modes(engine)
+
+    if rescore:
+        cached = {key: r["reformulated_query"] for key, r in checkpoint.load().items()}
+        items = [item for item in eval_data if item['question'] in cached]
+        if len(items) < len(eval_data):
+            print(f"[Rescore] {len(eval_data) - len(items)} questions have no cached reformulation; skipped.")
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        output = CheckpointLog(output_file or checkpoint.path.replace(".jsonl", f".rescore-{stamp}.jsonl"))
+        print(f"[Rescore] Writing to {output.path} (score it again with --checkpoint {output.path} --report)")
+        work = lambda item: evaluate_question(engine, item, hop1_modes, hop2_modes, cached[item['question']])
+        # Retrieval only: nothing to pace.
+        limiter = None
+    else:
+        items = eval_data
+        output = checkpoint
+        work = lambda item: evaluate_question(engine, item, hop1_modes, hop2_modes)
+        limiter = eval_limiter(requests_per_minute)
+
+    stale = {r.get("index_version") for r in output.load().values()} - {engine.index_version}
+    if stale:
+        print(f"[Checkpoint] Warning: {output.path} holds results from another index version; "
+              f"use a new checkpoint to re-evaluate from scratch.")
+
+    print(f"\n--- Starting Evaluation on {len(items)} Questions "
+          f"({concurrency or config.EVAL_CONCURRENCY} concurrent) ---\n")
+    records, errors = run_items(
+        items, work, output, key=lambda item: item['question'],
+        limiter=limiter, concurrency=concurrency
+    )
+    if errors:
+        print(f"{len(errors)} questions failed; run again to retry them.")
+    report(eval_data, records)
+
 if __name__ == "__main__":
     generated_path = os.path.join(root_dir, 'data', 'eval_datasets', 'evaluation_dataset.json')
-    
-    if os.path.exists(generated_path):
-        run_evaluation(generated_path)
+
+    parser = argparse.ArgumentParser(description="Two-hop retrieval evaluation (hit rate / MRR per mode).")
+    parser.add_argument("--data", default=generated_path)
+    parser.add_argument("--checkpoint", help="Append-only JSONL of finished questions (resumed if present)")
+    parser.add_argument("--rescore", action="store_true",
+                        help="Reuse the checkpoint's reformulated queries; run retrieval only")
+    parser.add_argument("--output", help="Checkpoint for --rescore results, resumed if present "
+                                         "(default: a new <checkpoint>.rescore-<timestamp>.jsonl per run)")
+    parser.add_argument("--report", action="store_true", help="Only score the existing checkpoint")
+    parser.add_argument("--concurrency", type=int, default=config.EVAL_CONCURRENCY)
+    parser.add_argument("--rpm", type=int, default=config.EVAL_REQUESTS_PER_MINUTE,
+                        help="Starting (and maximum) LLM requests per minute")
+    args = parser.parse_args()
+
+    if os.path.exists(args.data):
+        run_evaluation(args.data, args.checkpoint, args.rescore, args.output, args.report,
+                       args.concurrency, args.rpm)
     else:
-        print(f"Dataset not found at: {generated_path}")
+        print(f"Dataset not found at: {args.data}")
         print("Please run: python src/generate_eval_data.py")
@@ -0,0 +1,336 @@
+"""Deterministic offline stand-ins for the remote models, for tests and benchmarks."""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from .rate_limit import RateLimitError, estimate_tokens
+from .reranker import lexical_overlap
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def hash_vector(text, dim):
+    """Signed feature-hashing bag of words, L2-normalised."""
+    vector = [0.0] * dim
+    for token in _TOKEN_RE.findall(text.lower()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        sign = 1.0 if value & 1 else -1.0
+        vector[(value >> 1) % dim] += sign
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashing embedder with optional per-call latency and injected 429 errors.
+
+    Similar texts share tokens and therefore get similar vectors, so retrieval
+    behaves plausibly without any network access.
+    """
+
+    def __init__(self, dim=768, latency=0.0, error_rate=0.0, retry_after=None, seed=0):
+        self.dim = dim
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = 0
+        self.errors = 0
+        self.texts_embedded = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, texts):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise RateLimitError("429 RESOURCE_EXHAUSTED (injected)", retry_after=self.retry_after)
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return [hash_vector(t, self.dim) for t in texts]
+
+    def embed_documents(self, texts):
+        return self._call(texts)
+
+    def embed_query(self, text):
+        return self._call([text])[0]
+
+    def embed_queries(self, texts):
+        """Several queries in one call, as LocalEmbeddings offers."""
+        return self._call(texts)
+
+_QUESTION_RE = re.compile(r"Pertanyaan(?: User)?:\s*(.+)")
+
+class FakeChatModel(BaseChatModel):
+    """
+    Scripted chat model for the engine's two prompts, with configurable latency.
+
+    The reformulation prompt gets the question back with a fixed legal suffix; the
+    answer prompt gets the first `answer_words` words of its reference context,
+    optionally behind a <think> block of `think_words` words. Replies report
+    usage_metadata like a provider would. Each call waits `latency` seconds, plus
+    `token_latency` per output token (spread over the chunks when streaming).
+    """
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 120
+    think_words: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def reply(self, prompt):
+        questions = _QUESTION_RE.findall(prompt)
+        question = questions[-1].strip() if questions else ""
+        if "Query baku" in prompt:
+            return f"{question} menurut peraturan perundang-undangan"
+        context = prompt.split("Dokumen Referensi:", 1)[-1].rsplit("Pertanyaan:", 1)[0]
+        words = _TOKEN_RE.findall(context)[:self.answer_words] or ["Tidak", "ada", "referensi."]
+        answer = " ".join(words)
+        if self.think_words:
+            answer = "<think>" + " ".join(["menimbang"] * self.think_words) + "</think>\n\n" + answer
+        return answer
+
+    def _reply_for(self, messages):
+        self.calls += 1
+        prompt = messages[-1].content
+        text = self.reply(prompt)
+        usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text)}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return text, usage
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply_for(messages)
+        time.sleep(self.latency + self.token_latency * usage["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply_for(messages)
+        await asyncio.sleep(self.latency + self.token_latency * usage["output_tokens"])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._reply_for(messages)
+        time.sleep(self.latency)
+        pieces = re.findall(r"\S+\s*", text) or [text]
+        for i, piece in enumerate(pieces):
+            time.sleep(self.token_latency * estimate_tokens(piece))
+            # Usage arrives with the last chunk, as with OpenAI-style stream_usage.
+            chunk = AIMessageChunk(content=piece, usage_metadata=usage if i == len(pieces) - 1 else None)
+            yield ChatGenerationChunk(message=chunk)
+
+class FakeReranker:
+    """
+    Lexical-overlap stand-in for the cross-encoder: `latency` seconds per scored pair
+    plus `call_latency` per predict call (a real model's fixed per-batch overhead).
+    With `serial`, calls run one at a time, like a CPU model that uses every core.
+    """
+
+    def __init__(self, latency=0.0, call_latency=0.0, serial=False):
+        self.latency = latency
+        self.call_latency = call_latency
+        self.serial = serial
+        self.calls = 0
+        self.pairs_scored = 0
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    def predict(self, pairs, batch_size=None):
+        if pairs and (self.latency or self.call_latency):
+            if self.serial:
+                with self._model_lock:
+                    time.sleep(self.call_latency + self.latency * len(pairs))
+            else:
+                time.sleep(self.call_latency + self.latency * len(pairs))
+        with self._lock:
+            self.calls += 1
+            self.pairs_scored += len(pairs)
+        return [lexical_overlap(q, p) for q, p in pairs]
+
+class StubLLMServer:
+    """
+    Local HTTP server speaking the Groq (OpenAI-compatible) and Gemini chat REST APIs,
+    so the real SDK clients and llm_router can be exercised offline: point
+    GROQ_BASE_URL / GEMINI_BASE_URL at `url`. Replies are FakeChatModel's, streamed
+    word by word when asked. Each request waits `latency` seconds, or `slow_latency`
+    with probability `slow_rate`, and is rejected with a 429 (Retry-After
+    `retry_after`) with probability `error_rate`. The knobs can be changed while it
+    runs, e.g. error_rate=1.0 for an outage.
+    """
+
+    def __init__(self, latency=0.0, slow_rate=0.0, slow_latency=0.0, error_rate=0.0, retry_after=None,
+                 answer_words=60, seed=0, port=0):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.model = FakeChatModel(answer_words=answer_words)
+        self.port = port
+        self.requests = 0
+        self.rate_limited = 0
+        self.slow = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections alive, so client-side pooling is exercised.
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                try:
+                    stub._handle(self, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up, e.g. a hedge that lost.
+                    self.close_connection = True
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="stub-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle(self, handler, body):
+        with self._lock:
+            self.requests += 1
+            rate_limited = self._rng.random() < self.error_rate
+            slow = not rate_limited and self._rng.random() < self.slow_rate
+            if rate_limited:
+                self.rate_limited += 1
+            if slow:
+                self.slow += 1
+        path = handler.path.split("?", 1)[0]
+        gemini = ":generateContent" in path or ":streamGenerateContent" in path
+        if rate_limited:
+            if gemini:
+                error = {"error": {"code": 429, "message": "Resource has been exhausted (injected)",
+                                   "status": "RESOURCE_EXHAUSTED"}}
+            else:
+                error = {"error": {"message": "Rate limit reached (injected)", "type": "tokens",
+                                   "code": "rate_limit_exceeded"}}
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            return self._send_json(handler, 429, error, headers)
+        time.sleep(self.slow_latency if slow else self.latency)
+
+        if gemini:
+            prompt = "\n".join(part.get("text", "") for content in body.get("contents", [])[-1:]
+                               for part in content.get("parts", []))
+        else:
+            content = (body.get("messages") or [{}])[-1].get("content", "")
+            prompt = content if isinstance(content, str) else " ".join(p.get("text", "") for p in content)
+        text = self.model.reply(prompt)
+        usage = (estimate_tokens(prompt), estimate_tokens(text))
+        if gemini:
+            model = path.rsplit("/", 1)[-1].split(":", 1)[0]
+            if ":streamGenerateContent" in path:
+                return self._send_stream(handler, [self._gemini(model, piece, None) for piece in _pieces(text)]
+                                         + [self._gemini(model, "", usage)])
+            return self._send_json(handler, 200, self._gemini(model, text, usage))
+        model = body.get("model", "stub")
+        if body.get("stream"):
+            call_id = f"chatcmpl-{uuid.uuid4().hex}"
+            events = [self._groq_chunk(call_id, model, piece, None) for piece in _pieces(text)]
+            return self._send_stream(handler, events + [self._groq_chunk(call_id, model, "", usage), "[DONE]"])
+        return self._send_json(handler, 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": _openai_usage(usage)
+        })
+
+    @staticmethod
+    def _gemini(model, text, usage):
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        response = {"candidates": [candidate], "modelVersion": model}
+        if usage is not None:
+            candidate["finishReason"] = "STOP"
+            response["usageMetadata"] = {"promptTokenCount": usage[0], "candidatesTokenCount": usage[1],
+                                         "totalTokenCount": sum(usage)}
+        return response
+
+    @staticmethod
+    def _groq_chunk(call_id, model, text, usage):
+        chunk = {
+            "id": call_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": text} if usage is None else {},
+                         "finish_reason": None if usage is None else "stop"}]
+        }
+        if usage is not None:
+            # Groq reports stream usage in its x_groq extension.
+            chunk["x_groq"] = {"id": call_id, "usage": _openai_usage(usage)}
+        return chunk
+
+    @staticmethod
+    def _send_json(handler, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    @staticmethod
+    def _send_stream(handler, events):
+        """Server-sent events, chunked so the connection stays reusable."""
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for event in events:
+            data = f"data: {event if isinstance(event, str) else json.dumps(event)}\n\n".encode("utf-8")
+            handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+def _pieces(text):
+    return re.findall(r"\S+\s*", text) or [text]
+
+def _openai_usage(usage):
+    return {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": sum(usage)}
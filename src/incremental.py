@@ -0,0 +1,299 @@
+import threading
+import uuid
+from contextlib import contextmanager
+from . import ann, config, ingestion
+from .chunk_store import ChunkStore
+
+def is_live(metadata):
+    """Search filter that hides tombstoned chunks until the next compaction."""
+    return not metadata.get("tombstoned", False)
+
+class IndexUpdateError(RuntimeError):
+    """
+    An update that failed partway (embedding API, I/O). `stats` counts what `operation`
+    had applied before the failure: those changes are live in memory but not saved.
+    The original error is the __cause__.
+    """
+
+    def __init__(self, operation, stats, error):
+        super().__init__(f"{operation} stopped after {stats}: {type(error).__name__}: {error}")
+        self.operation = operation
+        self.stats = stats
+
+class IndexLock:
+    """
+    Lets any number of searches run together while keeping them out of the FAISS
+    index, BM25 postings and tombstones during an update. Shared holds are re-entrant;
+    an update waits for the searches in progress, which are short.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+class IncrementalIndex:
+    """
+    Upserts and deletes articles, keyed by their `link`, in a loaded FAISS vectorstore.
+
+    Replaced chunks are tombstoned (flagged and filtered out of searches) instead of
+    being removed right away, because removing ids from a flat FAISS index shifts every
+    position after them. Tombstones are physically removed in one pass once they exceed
+    `config.TOMBSTONE_COMPACT_RATIO` of the index.
+
+    Searches running in other threads hold `search_lock` shared; an update takes it
+    exclusively only while it changes the index, not while it embeds.
+    """
+
+    def __init__(self, vectorstore, index_path=None, embeddings=None, bm25=None, search_lock=None):
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.index_path = index_path or config.INDEX_PATH
+        self._embeddings = embeddings
+        self._lock = threading.Lock()
+        self.search_lock = search_lock or IndexLock()
+        # Bumped under the exclusive search lock by every change to the chunk set or the
+        # FAISS positions, so readers never pair a new layout with a stale derived index.
+        self._layout_changes = 0
+        self.stripper = ingestion.BoilerplateStripper.load(self.index_path) if config.CLEAN_BOILERPLATE else None
+        self._dedup = None
+
+        manifest = ingestion.load_manifest(self.index_path)
+        if manifest is None:
+            manifest = self._manifest_from_docstore()
+        self.manifest = manifest
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = ingestion.get_document_embeddings()
+        return self._embeddings
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def index_version(self):
+        """Identifies this exact index state: the build it came from plus its update count."""
+        return f"{self.manifest.get('build_id', 'legacy')}:{self.manifest['version']}"
+
+    @property
+    def layout_version(self):
+        """
+        Like index_version, but also changes with every article an upsert applies and
+        when compaction renumbers FAISS positions.
+        """
+        return f"{self.index_version}:{self._layout_changes}"
+
+    @property
+    def dedup(self):
+        """
+        The build's near-duplicate filter (None with DEDUP_CHUNKS off), loaded on first
+        use. Indexes built before it was saved get one from their live chunks.
+        """
+        if not config.DEDUP_CHUNKS:
+            return None
+        if self._dedup is None:
+            self._dedup = ingestion.NearDuplicateFilter.load(self.index_path)
+        if self._dedup is None:
+            self._dedup = ingestion.NearDuplicateFilter()
+            for doc_id in self.vectorstore.index_to_docstore_id.values():
+                doc = self.vectorstore.docstore.search(doc_id)
+                if not isinstance(doc, str) and is_live(doc.metadata):
+                    self._dedup.add(self._dedup.signature(doc.page_content), doc_id)
+        return self._dedup
+
+    def _manifest_from_docstore(self):
+        """Rebuilds the manifest for indexes created before it existed."""
+        articles = {}
+        tombstones = []
+        for doc_id in self.vectorstore.index_to_docstore_id.values():
+            doc = self.vectorstore.docstore.search(doc_id)
+            if not is_live(doc.metadata):
+                tombstones.append(doc_id)
+                continue
+            link = doc.metadata.get("link", "")
+            # Unknown hash: the first upsert of each article always re-embeds it.
+            article = articles.setdefault(link, {"hash": "", "chunk_ids": []})
+            article["chunk_ids"].append(doc_id)
+        return {"version": 1, "articles": articles, "tombstones": tombstones}
+
+    def live_filter(self):
+        """Returns the search filter to use, or None when nothing is tombstoned."""
+        return is_live if self.manifest["tombstones"] else None
+
+    def _tombstone(self, chunk_ids):
+        if self.bm25 is not None:
+            self.bm25.delete(chunk_ids)
+        for doc_id in chunk_ids:
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, str):
+                # InMemoryDocstore returns an error string for unknown ids.
+                continue
+            doc.metadata["tombstoned"] = True
+            if isinstance(self.vectorstore.docstore, ChunkStore):
+                # Chunk store documents are materialized per lookup; persist the flag.
+                self.vectorstore.docstore.update(doc_id, doc)
+            self.manifest["tombstones"].append(doc_id)
+
+    def upsert(self, entries):
+        """
+        Adds new articles and replaces changed ones. Unchanged articles are skipped.
+        Invalid input raises ValueError before anything is applied; a failure partway
+        raises IndexUpdateError with the stats of the articles already applied.
+        """
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "chunks_added": 0, "chunks_dropped": 0}
+        splitter = ingestion.get_text_splitter()
+        if not all(entry.get("link") for entry in entries):
+            raise ValueError("Every article needs a 'link' to be upserted.")
+
+        with self._lock:
+            try:
+                for entry in entries:
+                    self._upsert_article(entry, splitter, stats)
+            except Exception as e:
+                stats["failed_link"] = entry["link"]
+                raise IndexUpdateError("upsert", stats, e) from e
+            finally:
+                # Applied articles are live either way: searches and caches see a new version.
+                with self.search_lock.exclusive():
+                    if stats["added"] or stats["updated"]:
+                        self.manifest["version"] += 1
+                    stats["compacted"] = self._maybe_compact()
+        return stats
+
+    def _upsert_article(self, entry, splitter, stats):
+        """Applies one article; `stats` is only updated once it is live."""
+        link = entry["link"]
+        new_hash = ingestion.article_hash(entry)
+        existing = self.manifest["articles"].get(link)
+        if existing and existing["hash"] == new_hash:
+            stats["unchanged"] += 1
+            return
+
+        doc = ingestion.clean_document(ingestion.entry_to_document(entry), self.stripper)
+        splits = splitter.split_documents([doc])
+        ids = [str(uuid.uuid4()) for _ in splits]
+        pending, dropped = [], 0
+        dedup = self.dedup
+        if dedup is not None:
+            # Same filter as build_index; the article's own old chunks do not count.
+            old_ids = set(existing["chunk_ids"]) if existing else set()
+            kept, pending = dedup.unique([s.page_content for s in splits], ids, ignore=old_ids)
+            dropped = len(splits) - len(kept)
+            splits, ids = [splits[i] for i in kept], [ids[i] for i in kept]
+        texts = [s.page_content for s in splits]
+        vectors = self.embeddings.embed_documents(texts) if splits else []
+
+        with self.search_lock.exclusive():
+            if splits:
+                self.vectorstore.add_embeddings(
+                    list(zip(texts, vectors)),
+                    metadatas=[s.metadata for s in splits],
+                    ids=ids
+                )
+                if self.bm25 is not None:
+                    self.bm25.add(ids, texts)
+
+            if existing:
+                self._tombstone(existing["chunk_ids"])
+            if dedup is not None:
+                if existing:
+                    dedup.forget(existing["chunk_ids"])
+                for sig, chunk_id in pending:
+                    dedup.add(sig, chunk_id)
+            self.manifest["articles"][link] = {"hash": new_hash, "chunk_ids": ids}
+            self._layout_changes += 1
+        stats["updated" if existing else "added"] += 1
+        stats["chunks_added"] += len(ids)
+        stats["chunks_dropped"] += dropped
+
+    def delete(self, links):
+        """Removes articles by link. Unknown links are reported, not raised."""
+        stats = {"deleted": 0, "missing": 0}
+        with self._lock, self.search_lock.exclusive():
+            for link in links:
+                existing = self.manifest["articles"].pop(link, None)
+                if existing is None:
+                    stats["missing"] += 1
+                    continue
+                self._tombstone(existing["chunk_ids"])
+                if self._dedup is not None:
+                    self._dedup.forget(existing["chunk_ids"])
+                self._layout_changes += 1
+                stats["deleted"] += 1
+
+            if stats["deleted"]:
+                self.manifest["version"] += 1
+            stats["compacted"] = self._maybe_compact()
+        return stats
+
+    def _maybe_compact(self):
+        total = self.vectorstore.index.ntotal
+        tombstones = len(self.manifest["tombstones"])
+        if total and tombstones / total >= config.TOMBSTONE_COMPACT_RATIO:
+            return self._compact()
+        return 0
+
+    def _compact(self):
+        tombstones = self.manifest["tombstones"]
+        if not tombstones:
+            return 0
+        if ann.supports_remove(self.vectorstore.index):
+            self.vectorstore.delete(tombstones)
+        else:
+            self._rebuild_without(tombstones)
+        self.manifest["tombstones"] = []
+        self._layout_changes += 1
+        return len(tombstones)
+
+    def _rebuild_without(self, doc_ids):
+        """Compaction for approximate indexes (HNSW, IVF): rebuild from the kept vectors."""
+        doc_ids = set(doc_ids)
+        id_map = self.vectorstore.index_to_docstore_id
+        positions = [pos for pos, doc_id in id_map.items() if doc_id in doc_ids]
+        self.vectorstore.index, keep = ann.rebuild_without(self.vectorstore.index, positions)
+        self.vectorstore.index_to_docstore_id = {i: id_map[pos] for i, pos in enumerate(keep)}
+        self.vectorstore.docstore.delete(list(doc_ids))
+
+    def compact(self):
+        """Physically removes every tombstoned chunk from the index and docstore."""
+        with self._lock, self.search_lock.exclusive():
+            return self._compact()
+
+    def save(self):
+        with self._lock:
+            self.vectorstore.save_local(self.index_path)
+            if self.bm25 is not None:
+                self.bm25.save(self.index_path)
+            if self._dedup is not None:
+                self._dedup.save(self.index_path)
+            ingestion.save_manifest(self.index_path, self.manifest)
@@ -1,70 +1,601 @@
+import hashlib
 import json
 import os
+import random
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+import numpy as np
 from langchain_community.document_loaders import JSONLoader
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from . import config
+from . import ann, config
+from .bm25 import BM25Index
+from .chunk_store import ChunkStoreFAISS, ChunkStoreWriter
+from .embedding_backends import document_embeddings
+from .rate_limit import estimate_tokens
 
-def load_data():
-    if not os.path.exists(config.DATA_PATH):
-        raise FileNotFoundError(f"Data directory not found at {config.DATA_PATH}")
-    all_data = []
-    for filename in os.listdir(config.DATA_PATH):
-        if filename.endswith(".json"):
-            file_path = os.path.join(config.DATA_PATH, filename)
-            print(f"Loading data from {filename}...")
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        all_data.extend(data)
-                    else:
-                        print(f"Warning: {filename} does not contain a list of objects. Skipping.")
-            except Exception as e:
-                print(f"Error loading {filename}: {e}")
+MANIFEST_FILE = "articles.json"
+BOILERPLATE_FILE = "boilerplate.json"
+DEDUP_FILE = "dedup.npz"
 
-    docs = []
-    for entry in all_data:
-        metadata = {
-            "title": entry.get("title", ""),
-            "link": entry.get("link", ""),
-            "publish_date": entry.get("publish_date", ""),
-            "tags": entry.get("tags", []),
-            "theme": entry.get("theme", "")
-        }
-        content = entry.get("content", "")
-        doc = Document(page_content=content, metadata=metadata)
-        docs.append(doc)
-    return docs
-
-def build_index():
-    print("Loading data...")
-    raw_docs = load_data()
-    
-    print(f"Splitting {len(raw_docs)} documents...")
-    text_splitter = RecursiveCharacterTextSplitter(
+# hukumonline page chrome that is known up front.
+DECLARED_BOILERPLATE = [
+    # Site navigation, share buttons and byline, up to "Bacaan 5 Menit 08 Desember 2025".
+    re.compile(r"^.*?\bBacaan \d+ Menit \d{1,2} \w+ \d{4}\s+", re.DOTALL),
+    # Lawyer directory, "KLINIK TERBARU", "TIPS HUKUM" and related-article footer.
+    re.compile(r"\s+TAGS Temukan pengacara dan kantor hukum.*$", re.DOTALL),
+]
+
+# Learned n-grams touching these are never treated as boilerplate, so frequently
+# cited regulations (e.g. "Undang-Undang Nomor 6 Tahun 2023 ...") stay intact.
+_PROTECTED_TERMS = re.compile(r"\d|undang|pasal|peraturan|perppu|kuh|\bUU\b|\bPP\b", re.IGNORECASE)
+_WORD_RE = re.compile(r"\S+")
+
+def entry_to_document(entry):
+    metadata = {
+        "title": entry.get("title", ""),
+        "link": entry.get("link", ""),
+        "publish_date": entry.get("publish_date", ""),
+        "tags": entry.get("tags", []),
+        "theme": entry.get("theme", "")
+    }
+    content = entry.get("content", "")
+    return Document(page_content=content, metadata=metadata)
+
+def article_hash(entry):
+    """Fingerprint of everything in an article that ends up in the index."""
+    doc = entry_to_document(entry)
+    payload = json.dumps([doc.page_content, doc.metadata], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=config.CHUNK_SIZE,
         chunk_overlap=config.CHUNK_OVERLAP
     )
-    splits = text_splitter.split_documents(raw_docs)
-    
+
+def get_document_embeddings():
+    """Cached document embeddings of the configured backend (config.EMBEDDING_BACKEND)."""
+    return document_embeddings()
+
+def embedding_info(embeddings, dim):
+    """What the manifest records about the vectors; the engine checks it against its backend."""
+    model = getattr(getattr(embeddings, "cache", None), "model", None) or getattr(embeddings, "model_name", None)
+    return {"model": model or type(embeddings).__name__, "dim": int(dim)}
+
+def load_manifest(index_path):
+    """Reads the link -> chunk ids manifest written next to the index, if any."""
+    path = os.path.join(index_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(index_path, manifest):
+    os.makedirs(index_path, exist_ok=True)
+    path = os.path.join(index_path, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class BoilerplateStripper:
+    """
+    Removes site chrome from article content.
+
+    Declared patterns strip the known header and footer. On top of that, word
+    n-grams that appear in at least `min_df` of a sample of articles are learned as
+    boilerplate (disclaimers, upsell banners, table-of-contents labels) and every
+    run of text they cover is cut out.
+    """
+
+    def __init__(self, ngram_size=None, min_df=None, ngrams=None):
+        self.ngram_size = ngram_size or config.BOILERPLATE_NGRAM_SIZE
+        self.min_df = config.BOILERPLATE_MIN_DF if min_df is None else min_df
+        self.ngrams = set(ngrams or [])
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def _strip_declared(self, text):
+        for pattern in DECLARED_BOILERPLATE:
+            text = pattern.sub("", text)
+        return text
+
+    def _ngrams(self, words):
+        n = self.ngram_size
+        for i in range(len(words) - n + 1):
+            yield i, " ".join(words[i:i + n])
+
+    def fit(self, texts):
+        df = Counter()
+        count = 0
+        for text in texts:
+            words = self._strip_declared(text).split()
+            df.update({gram for _, gram in self._ngrams(words)})
+            count += 1
+        min_count = max(2, self.min_df * count)
+        self.ngrams = {
+            gram for gram, n in df.items()
+            if n >= min_count and not _PROTECTED_TERMS.search(gram)
+        }
+        return self
+
+    def strip(self, text):
+        self.chars_in += len(text)
+        text = self._strip_declared(text)
+        if self.ngrams:
+            spans = [m.span() for m in _WORD_RE.finditer(text)]
+            words = [text[a:b] for a, b in spans]
+            covered = [False] * len(words)
+            for i, gram in self._ngrams(words):
+                if gram in self.ngrams:
+                    covered[i:i + self.ngram_size] = [True] * self.ngram_size
+            if any(covered):
+                kept = []
+                prev_end = 0
+                for (start, end), cut in zip(spans, covered):
+                    if cut:
+                        kept.append(text[prev_end:start])
+                        prev_end = end
+                kept.append(text[prev_end:])
+                text = re.sub(r"[ \t]{2,}", " ", "".join(kept))
+        text = text.strip()
+        self.chars_out += len(text)
+        return text
+
+    def save(self, index_path):
+        os.makedirs(index_path, exist_ok=True)
+        with open(os.path.join(index_path, BOILERPLATE_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"ngram_size": self.ngram_size, "ngrams": sorted(self.ngrams)}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_path):
+        """Loads the stripper learned at build time; falls back to the declared patterns only."""
+        path = os.path.join(index_path, BOILERPLATE_FILE)
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(ngram_size=data["ngram_size"], ngrams=data["ngrams"])
+
+class NearDuplicateFilter:
+    """
+    Drops chunks whose word-shingle Jaccard similarity to an already kept chunk is at
+    least `threshold`, using MinHash signatures bucketed by LSH bands. Band collisions
+    are only candidates; the signature agreement is checked before dropping.
+
+    Kept signatures are stored with their chunk ids and saved next to the index, so
+    incremental upserts are filtered against the whole index like a full build, and
+    the chunks of replaced or deleted articles can be forgotten.
+    """
+
+    _PRIME = (1 << 31) - 1
+
+    def __init__(self, threshold=None, num_perm=None, bands=None, shingle_size=5, seed=1):
+        self.threshold = config.DEDUP_THRESHOLD if threshold is None else threshold
+        self.num_perm = num_perm or config.DEDUP_NUM_PERM
+        self.bands = bands or config.DEDUP_BANDS
+        if self.num_perm % self.bands:
+            raise ValueError("DEDUP_NUM_PERM must be divisible by DEDUP_BANDS.")
+        self.rows = self.num_perm // self.bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, self._PRIME, size=(self.num_perm, 1)).astype(np.uint64)
+        self._b = rng.randint(0, self._PRIME, size=(self.num_perm, 1)).astype(np.uint64)
+        self._buckets = {}
+        self._signatures = []
+        self._ids = []
+        self._positions = {}
+        self._forgotten = set()
+        self.dropped = 0
+        self.tokens_dropped = 0
+
+    def __len__(self):
+        return len(self._signatures) - len(self._forgotten)
+
+    def signature(self, text):
+        words = text.lower().split()
+        n = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") % self._PRIME
+             for s in shingles],
+            dtype=np.uint64
+        )
+        return ((self._a * hashes + self._b) % self._PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, sig):
+        return [(band, sig[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def _similar(self, sig, other):
+        return np.mean(other == sig) >= self.threshold
+
+    def matches(self, sig, ignore=()):
+        """Whether a kept chunk (other than the ids in `ignore`) is a near-duplicate of `sig`."""
+        seen = set()
+        for key in self._band_keys(sig):
+            for idx in self._buckets.get(key, ()):
+                if idx in seen or idx in self._forgotten:
+                    continue
+                seen.add(idx)
+                if self._ids[idx] not in ignore and self._similar(sig, self._signatures[idx]):
+                    return True
+        return False
+
+    def add(self, sig, chunk_id=None):
+        idx = len(self._signatures)
+        self._signatures.append(sig)
+        self._ids.append(chunk_id)
+        if chunk_id is not None:
+            self._positions[chunk_id] = idx
+        for key in self._band_keys(sig):
+            self._buckets.setdefault(key, []).append(idx)
+
+    def forget(self, chunk_ids):
+        """Stops matching against the chunks of replaced or deleted articles."""
+        for chunk_id in chunk_ids:
+            idx = self._positions.pop(chunk_id, None)
+            if idx is not None:
+                self._forgotten.add(idx)
+
+    def drop(self, text):
+        self.dropped += 1
+        self.tokens_dropped += estimate_tokens(text)
+
+    def is_duplicate(self, text, chunk_id=None):
+        """Checks `text` against kept chunks and remembers it (as `chunk_id`) if it is new."""
+        sig = self.signature(text)
+        if self.matches(sig):
+            self.drop(text)
+            return True
+        self.add(sig, chunk_id)
+        return False
+
+    def unique(self, texts, chunk_ids, ignore=()):
+        """
+        Which of `texts` are new, checked against the kept chunks (except `ignore`) and
+        each other, without remembering them: (kept indices, [(signature, chunk id)]
+        to add() once the kept chunks are in the index).
+        """
+        kept, pending = [], []
+        for i, (text, chunk_id) in enumerate(zip(texts, chunk_ids)):
+            sig = self.signature(text)
+            if self.matches(sig, ignore) or any(self._similar(sig, other) for other, _ in pending):
+                self.drop(text)
+                continue
+            kept.append(i)
+            pending.append((sig, chunk_id))
+        return kept, pending
+
+    def save(self, index_path):
+        live = [i for i in range(len(self._signatures)) if i not in self._forgotten and self._ids[i] is not None]
+        signatures = np.array([self._signatures[i] for i in live], dtype=np.uint32).reshape(len(live), self.num_perm)
+        ids = np.array([self._ids[i].encode("utf-8") for i in live], dtype=bytes)
+        params = np.array([self.num_perm, self.bands, self.shingle_size, self.seed], dtype=np.int64)
+        os.makedirs(index_path, exist_ok=True)
+        path = os.path.join(index_path, DEDUP_FILE)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, signatures=signatures, ids=ids, params=params)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_path):
+        """The filter saved with the index, or None for indexes built without one."""
+        path = os.path.join(index_path, DEDUP_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            num_perm, bands, shingle_size, seed = (int(v) for v in data["params"])
+            dedup = cls(num_perm=num_perm, bands=bands, shingle_size=shingle_size, seed=seed)
+            for sig, chunk_id in zip(data["signatures"], data["ids"]):
+                dedup.add(sig, chunk_id.decode("utf-8"))
+        return dedup
+
+def clean_document(doc, stripper):
+    if stripper is not None:
+        doc.page_content = stripper.strip(doc.page_content)
+    return doc
+
+def fit_boilerplate(entries, sample_size=None, seed=0):
+    """Learns boilerplate n-grams from a reservoir sample of the streamed entries."""
+    sample_size = sample_size or config.BOILERPLATE_SAMPLE_SIZE
+    rng = random.Random(seed)
+    sample = []
+    for i, entry in enumerate(entries):
+        content = entry.get("content", "")
+        if len(sample) < sample_size:
+            sample.append(content)
+        else:
+            j = rng.randint(0, i)
+            if j < sample_size:
+                sample[j] = content
+    return BoilerplateStripper().fit(sample)
+
+def iter_json_array(file_path, read_size=1 << 16):
+    """
+    Yields the elements of a top-level JSON array one at a time.
+
+    Only the current element (plus one read buffer) is held in memory, so file
+    size does not matter.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buf = f.read(read_size)
+        pos = 0
+        eof = not buf
+
+        def skip(chars):
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                buf, pos = f.read(read_size), 0
+                eof = not buf
+
+        skip(" \t\r\n")
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError("expected a top-level JSON array")
+        pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if pos >= len(buf):
+                raise ValueError("unterminated JSON array")
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element straddles the buffer boundary: drop what was consumed and read on.
+                more = f.read(read_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield item
+            pos = end
+            if pos > read_size:
+                buf, pos = buf[pos:], 0
+
+def iter_entries(data_path=None, stats=None):
+    """Streams raw article entries from every *.json file in the data directory."""
+    data_path = data_path or config.DATA_PATH
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(f"Data directory not found at {data_path}")
+    for filename in sorted(os.listdir(data_path)):
+        if not filename.endswith(".json"):
+            continue
+        file_path = os.path.join(data_path, filename)
+        print(f"Loading data from {filename}...")
+        entries = iter_json_array(file_path)
+        while True:
+            start = time.perf_counter()
+            try:
+                entry = next(entries)
+            except StopIteration:
+                break
+            except ValueError as e:
+                print(f"Warning: {filename} is not a valid list of objects ({e}). Skipping rest of file.")
+                break
+            except Exception as e:
+                print(f"Error loading {filename}: {e}")
+                break
+            if stats:
+                stats.add("load", 1, time.perf_counter() - start)
+            if isinstance(entry, dict):
+                yield entry
+
+def iter_documents(entries, stats=None, stripper=None):
+    for entry in entries:
+        start = time.perf_counter()
+        doc = clean_document(entry_to_document(entry), stripper)
+        if stats:
+            stats.add("clean", 1, time.perf_counter() - start)
+        yield doc
+
+def iter_splits(docs, text_splitter, stats=None):
+    for doc in docs:
+        start = time.perf_counter()
+        splits = text_splitter.split_documents([doc])
+        if stats:
+            stats.add("split", len(splits), time.perf_counter() - start)
+        yield from splits
+
+def iter_unique_splits(splits, dedup, stats=None):
+    """Drops near-duplicate splits; kept ones get their docstore id, recorded by `dedup`."""
+    for split in splits:
+        start = time.perf_counter()
+        split.id = str(uuid.uuid4())
+        duplicate = dedup.is_duplicate(split.page_content, split.id)
+        if stats:
+            stats.add("dedup", 1, time.perf_counter() - start)
+        if not duplicate:
+            yield split
+
+def windowed(iterable, size):
+    window = []
+    for item in iterable:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class StageStats:
+    """Accumulates item counts and wall time per pipeline stage."""
+
+    def __init__(self):
+        self.items = {}
+        self.seconds = {}
+
+    def add(self, stage, items, seconds):
+        self.items[stage] = self.items.get(stage, 0) + items
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def report(self):
+        lines = []
+        for stage, items in self.items.items():
+            seconds = self.seconds[stage]
+            rate = items / seconds if seconds > 0 else float("inf")
+            lines.append(f"  {stage:<6} {items:>8} items {seconds:>8.2f}s {rate:>10.1f} items/s")
+        return "\n".join(lines)
+
+def load_entries():
+    return list(iter_entries())
+
+def load_data():
+    return [entry_to_document(entry) for entry in load_entries()]
+
+def new_vectorstore(embeddings, params, vectors, index_path):
+    """
+    Empty vectorstore over an index of `params["type"]`, trained on `vectors` if needed.
+    Added chunks stream into the chunk files at `index_path`; save it there.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    index = ann.make_index(vectors.shape[1], params, vectors if ann.needs_training(params) else None)
+    return ChunkStoreFAISS(embeddings, index, ChunkStoreWriter(index_path), {})
+
+def build_index(index_path=None, theme=None, stripper=None, embeddings=None):
+    """
+    Streams load -> clean -> split -> embed -> index in windows of
+    config.INGEST_WINDOW_SIZE chunks, so only one window of text is in flight: each
+    flushed window's chunks go straight to the chunk store files at `index_path`.
+    IVF index types are the exception: windows are buffered until
+    config.ANN_TRAIN_SIZE vectors are available to train the index on.
+    With `theme`, only that theme's articles are indexed (one shard, see shards.py);
+    `stripper` is then the boilerplate stripper learned on the whole corpus.
+    `embeddings` replaces the configured document embeddings (e.g. fakes.FakeEmbeddings).
+    Returns the built vectorstore.
+    """
+    index_path = index_path or config.INDEX_PATH
+
+    def source(stats=None):
+        entries = iter_entries(stats=stats)
+        if theme is None:
+            return entries
+        return (entry for entry in entries if entry.get("theme", "") == theme)
+
     print("Initializing Embeddings...")
-    if not config.GOOGLE_API_KEY:
-        raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+    embeddings = embeddings or get_document_embeddings()
+    text_splitter = get_text_splitter()
+    stats = StageStats()
+    articles = {}
+    vectorstore = None
+    params = ann.ann_params()
+    print(f"Index type: {params}")
+    pending = []
+    bm25 = BM25Index() if config.BM25_ENABLED else None
 
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model=config.EMBEDDING_MODEL,
-        google_api_key=config.GOOGLE_API_KEY
-    )
-    
-    print("Creating FAISS index...")
-    vectorstore = FAISS.from_documents(splits, embeddings)
-    
-    print(f"Saving index to {config.INDEX_PATH}...")
-    vectorstore.save_local(config.INDEX_PATH)
+    if not config.CLEAN_BOILERPLATE:
+        stripper = None
+    elif stripper is None:
+        print("Learning boilerplate from a sample of articles...")
+        stripper = fit_boilerplate(source())
+        print(f"Learned {len(stripper.ngrams)} boilerplate n-grams")
+    dedup = NearDuplicateFilter() if config.DEDUP_CHUNKS else None
+
+    def track_articles(entries):
+        for entry in entries:
+            article = articles.setdefault(entry.get("link", ""), {"hash": "", "chunk_ids": []})
+            article["hash"] = article_hash(entry)
+            yield entry
+
+    print("Streaming data into FAISS index...")
+    entries = track_articles(source(stats=stats))
+    splits = iter_splits(iter_documents(entries, stats, stripper), text_splitter, stats)
+    if dedup is not None:
+        splits = iter_unique_splits(splits, dedup, stats)
+    def flush():
+        nonlocal vectorstore
+        start = time.perf_counter()
+        count = sum(len(texts) for texts, _, _, _ in pending)
+        if vectorstore is None:
+            vectorstore = new_vectorstore(embeddings, params, np.concatenate([v for _, v, _, _ in pending]), index_path)
+        for texts, vectors, metadatas, ids in pending:
+            vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            if bm25 is not None:
+                bm25.add(ids, texts)
+            for doc_id, metadata in zip(ids, metadatas):
+                articles[metadata.get("link", "")]["chunk_ids"].append(doc_id)
+        stats.add("index", count, time.perf_counter() - start)
+        pending.clear()
+        print(f"Indexed {vectorstore.index.ntotal} chunks (peak RSS {peak_rss_mb() or 0:.0f} MB)")
+
+    for window in windowed(splits, config.INGEST_WINDOW_SIZE):
+        texts = [s.page_content for s in window]
+        metadatas = [s.metadata for s in window]
+        ids = [s.id or str(uuid.uuid4()) for s in window]
+
+        start = time.perf_counter()
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        stats.add("embed", len(texts), time.perf_counter() - start)
+
+        pending.append((texts, vectors, metadatas, ids))
+        buffered = sum(len(v) for _, v, _, _ in pending)
+        if vectorstore is None and ann.needs_training(params) and buffered < config.ANN_TRAIN_SIZE:
+            continue
+        flush()
+
+    if pending:
+        flush()
+
+    if vectorstore is None:
+        scope = f" for theme '{theme}'" if theme is not None else ""
+        raise ValueError(f"No documents found in {config.DATA_PATH}{scope}")
+
+    if hasattr(embeddings, "stats"):
+        cache_stats = embeddings.stats()
+        print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+              f"({cache_stats['hit_rate']:.1%} reused), {cache_stats['batches']} batches, {cache_stats['retries']} retries")
+    if stripper is not None:
+        saved = stripper.chars_in - stripper.chars_out
+        print(f"Boilerplate stripping removed {saved} chars (~{saved // 4} tokens, "
+              f"{saved / max(stripper.chars_in, 1):.1%} of raw content)")
+    if dedup is not None:
+        print(f"Near-duplicate filter dropped {dedup.dropped} chunks (~{dedup.tokens_dropped} tokens)")
+    print("Stage throughput:")
+    print(stats.report())
+    print(f"FAISS index: {ann.describe(vectorstore.index)}")
+
+    print(f"Saving index to {index_path}...")
+    vectorstore.save_local(index_path)
+    save_manifest(index_path, {
+        "build_id": uuid.uuid4().hex,
+        "version": 1,
+        "ann": params,
+        "embedding": embedding_info(embeddings, vectorstore.index.d),
+        "articles": articles,
+        "tombstones": []
+    })
+    if stripper is not None:
+        stripper.save(index_path)
+    if dedup is not None:
+        dedup.save(index_path)
+    if bm25 is not None:
+        print(f"BM25 index: {bm25.save(index_path)}")
     print("Index built and saved successfully.")
+    return vectorstore
 
 if __name__ == "__main__":
-    build_index()
+    if config.SHARD_BY_THEME:
+        from .shards import build_shards
+        build_shards()
+    else:
+        build_index()
@@ -0,0 +1,479 @@
+"""
+LLM routing: one chat model in front of the configured providers (Groq, Gemini).
+
+A call goes to the first provider whose circuit is closed. If no reply has come back
+once that provider's recent latency for the prompt reaches LLM_HEDGE_PERCENTILE, a
+duplicate request (hedge) goes to the next provider, or to the same one if there is
+no other, and whichever answers first wins. An error fails over to the next provider
+at once, and the whole call, hedges and failovers included, gives up after
+LLM_DEADLINE seconds. A provider that keeps failing (429, 5xx, timeouts) has its
+circuit opened: it is skipped for LLM_BREAKER_RESET seconds, or the Retry-After of
+its last 429, then one trial call decides whether it is closed again.
+
+Streams hedge and fail over the same way until their first chunk; after that they
+stay on the provider that sent it. The engine binds a route per prompt
+(`llm.route("reformulate")`), so latencies and hedge delays are tracked per provider
+and prompt. Clients are built once per provider, without SDK retries, over a pool of
+keep-alive connections.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+from . import config, metrics
+from .rate_limit import is_provider_failure, is_rate_limit_error, retry_after_seconds
+
+PROVIDERS = ("groq", "gemini")
+
+class LLMDeadlineExceeded(TimeoutError):
+    """No provider answered within the call's deadline."""
+
+class NoProviderAvailable(RuntimeError):
+    """Every provider's circuit is open."""
+
+class CircuitBreaker:
+    """
+    Closed, calls go through. After `failures` consecutive provider failures it opens
+    and refuses calls for `reset_seconds`, or the Retry-After of the last one if it was
+    a 429; then it lets one trial call through (half-open), whose outcome closes it or
+    opens it again.
+    """
+
+    def __init__(self, name, failures=None, reset_seconds=None, clock=time.monotonic):
+        self.name = name
+        self.failures = failures or config.LLM_BREAKER_FAILURES
+        self.reset_seconds = config.LLM_BREAKER_RESET if reset_seconds is None else reset_seconds
+        self._clock = clock
+        self._consecutive = 0
+        self._open_until = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._open_until is None:
+                return "closed"
+            return "open" if self._clock() < self._open_until else "half_open"
+
+    def allow(self):
+        """Whether a call may go out now; in half-open, only the trial call may."""
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if self._clock() < self._open_until or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            # A reply to a request sent before the circuit opened does not close it early.
+            if self._open_until is not None and self._clock() < self._open_until:
+                return
+            closed = self._open_until is not None
+            self._open_until = None
+            self._trial = False
+        if closed:
+            metrics.LLM_CIRCUIT.inc(provider=self.name, state="closed")
+            metrics.log("llm_circuit", logging.INFO, provider=self.name, state="closed")
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self._consecutive += 1
+            trial, self._trial = self._trial, False
+            if not (trial or self._consecutive >= self.failures):
+                return
+            now = self._clock()
+            was_open = self._open_until is not None and now < self._open_until
+            open_for = retry_after or self.reset_seconds
+            self._open_until = max(self._open_until or 0.0, now + open_for)
+        if not was_open:
+            metrics.LLM_CIRCUIT.inc(provider=self.name, state="open")
+            metrics.log("llm_circuit", logging.WARNING, provider=self.name, state="open", seconds=open_for)
+
+    def release(self):
+        """Gives the trial slot back, for a call that ended without a verdict (cancelled)."""
+        with self._lock:
+            self._trial = False
+
+class Provider:
+    """A chat model the router can call, with its circuit breaker and recent latencies per route."""
+
+    def __init__(self, name, model, breaker=None, window=None):
+        self.name = name
+        self.model = model
+        self.breaker = breaker or CircuitBreaker(name)
+        self._window = window or config.LLM_LATENCY_WINDOW
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    def latency_percentile(self, key, percentile, min_samples):
+        """The `percentile` of the recent latencies under `key`, or None with fewer than `min_samples`."""
+        with self._lock:
+            samples = list(self._latencies.get(key, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return float(np.percentile(samples, percentile))
+
+    def succeeded(self, route, seconds=None):
+        self.breaker.record_success()
+        metrics.LLM_ATTEMPTS.inc(route=route, provider=self.name, outcome="ok")
+        if seconds is not None:
+            self.observe(route, seconds)
+            metrics.LLM_ATTEMPT_SECONDS.observe(seconds, route=route, provider=self.name)
+
+    def failed(self, route, error):
+        rate_limited = is_rate_limit_error(error)
+        if is_provider_failure(error):
+            self.breaker.record_failure(retry_after_seconds(error) if rate_limited else None)
+        else:
+            # The provider answered, it just rejected this request.
+            self.breaker.record_success()
+        metrics.LLM_ATTEMPTS.inc(route=route, provider=self.name, outcome="rate_limited" if rate_limited else "error")
+        metrics.log("llm_attempt_failed", provider=self.name, route=route, error=type(error).__name__,
+                    detail=str(error)[:200])
+
+    def cancelled(self, route):
+        self.breaker.release()
+        metrics.LLM_ATTEMPTS.inc(route=route, provider=self.name, outcome="cancelled")
+
+class _Call:
+    """Bookkeeping of one routed call: providers tried, hedge clock, deadline and last error."""
+
+    def __init__(self, router, route, latency_key=None):
+        self.router = router
+        self.route = route
+        self.latency_key = latency_key or route
+        self.deadline_at = time.monotonic() + router.deadline
+        self.tried = []
+        self.hedges = 0
+        self.failovers = 0
+        self.hedge_at = None
+        self.last_error = None
+
+    def next(self, via):
+        """The provider for a `via` ("primary", "hedge", "failover") attempt, or None."""
+        provider = next((p for p in self.router.providers if p not in self.tried and p.breaker.allow()), None)
+        if provider is None and via == "hedge":
+            # No other provider to hedge on: duplicate the request on the same one.
+            provider = self.tried[-1]
+        if provider is None:
+            return None
+        self.tried.append(provider)
+        if via == "hedge":
+            self.hedges += 1
+        elif via == "failover":
+            self.failovers += 1
+        self.hedge_at = None
+        if self.router.hedge_percentile and self.hedges < self.router.max_hedges:
+            delay = provider.latency_percentile(self.latency_key, self.router.hedge_percentile,
+                                                self.router.hedge_min_samples)
+            if delay is not None:
+                self.hedge_at = time.monotonic() + delay
+        return provider
+
+    def hedge_due(self):
+        return self.hedge_at is not None and time.monotonic() >= self.hedge_at
+
+    def wait_timeout(self):
+        """Seconds until the next hedge or the deadline; raises once the deadline has passed."""
+        now = time.monotonic()
+        if now >= self.deadline_at:
+            metrics.LLM_ROUTED.inc(route=self.route, provider="", via="deadline")
+            raise LLMDeadlineExceeded(
+                f"No LLM reply for {self.route} within {self.router.deadline:g}s "
+                f"(tried {', '.join(p.name for p in self.tried)})"
+            )
+        return min(self.deadline_at, self.hedge_at or self.deadline_at) - now
+
+    def exhausted(self):
+        """The error to raise once every attempt failed and no provider is left."""
+        metrics.LLM_ROUTED.inc(route=self.route, provider="", via="failed")
+        if self.last_error is not None:
+            return self.last_error
+        return NoProviderAvailable(f"Every LLM provider's circuit is open ({self.router.describe()})")
+
+    def won(self, provider, via, message=None):
+        metrics.LLM_ROUTED.inc(route=self.route, provider=provider.name, via=via)
+        if self.hedges or self.failovers:
+            metrics.count(self.route, hedges=self.hedges, failovers=self.failovers)
+        if message is None:
+            return None
+        message.response_metadata["llm_provider"] = provider.name
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def settle(self, done, pending):
+        """Takes the finished attempts out of `pending`; the winner's ChatResult, or None."""
+        for attempt in done:
+            provider, via = pending.pop(attempt)
+            error = attempt.exception()
+            if error is None:
+                return self.won(provider, via, attempt.result())
+            self.last_error = error
+        return None
+
+class LLMRouter(BaseChatModel):
+    """
+    Chat model that sends each call to `providers` (in order of preference) with
+    hedging, failover, circuit breakers and a deadline; see the module docstring.
+    """
+    providers: list
+    deadline: float = Field(default_factory=lambda: config.LLM_DEADLINE)
+    hedge_percentile: float = Field(default_factory=lambda: config.LLM_HEDGE_PERCENTILE)
+    hedge_min_samples: int = Field(default_factory=lambda: config.LLM_HEDGE_MIN_SAMPLES)
+    max_hedges: int = Field(default_factory=lambda: config.LLM_MAX_HEDGES)
+    workers: int = Field(default_factory=lambda: config.LLM_WORKERS)
+    _pool = PrivateAttr(default=None)
+    _pool_lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return "llm-router"
+
+    def route(self, name):
+        """This router with the prompt's route bound, for chains: `prompt | llm.route("generate")`."""
+        return self.bind(llm_route=name)
+
+    def describe(self):
+        return {p.name: p.breaker.state for p in self.providers}
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="llm")
+            return self._pool
+
+    def _call(self, provider, route, messages, stop, kwargs):
+        start = time.perf_counter()
+        try:
+            message = provider.model.invoke(messages, stop=stop, **kwargs)
+        except Exception as e:
+            provider.failed(route, e)
+            raise
+        provider.succeeded(route, time.perf_counter() - start)
+        return message
+
+    async def _acall(self, provider, route, messages, stop, kwargs):
+        start = time.perf_counter()
+        try:
+            message = await provider.model.ainvoke(messages, stop=stop, **kwargs)
+        except asyncio.CancelledError:
+            provider.cancelled(route)
+            raise
+        except Exception as e:
+            provider.failed(route, e)
+            raise
+        provider.succeeded(route, time.perf_counter() - start)
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        call = _Call(self, kwargs.pop("llm_route", "default"))
+        pool = self._executor()
+        pending = {}
+
+        def launch(via):
+            provider = call.next(via)
+            if provider is not None:
+                pending[pool.submit(self._call, provider, call.route, messages, stop, kwargs)] = (provider, via)
+            return provider
+
+        if launch("primary") is None:
+            raise call.exhausted()
+        try:
+            while True:
+                done, _ = wait(list(pending), timeout=call.wait_timeout(), return_when=FIRST_COMPLETED)
+                result = call.settle(done, pending)
+                if result is not None:
+                    return result
+                if not pending:
+                    if launch("failover") is None:
+                        raise call.exhausted()
+                elif call.hedge_due():
+                    launch("hedge")
+        finally:
+            # Running requests cannot be stopped; they finish in the pool and still
+            # feed the latencies and circuit breakers.
+            for attempt in pending:
+                attempt.cancel()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        call = _Call(self, kwargs.pop("llm_route", "default"))
+        pending = {}
+
+        def launch(via):
+            provider = call.next(via)
+            if provider is not None:
+                task = asyncio.ensure_future(self._acall(provider, call.route, messages, stop, kwargs))
+                pending[task] = (provider, via)
+            return provider
+
+        if launch("primary") is None:
+            raise call.exhausted()
+        try:
+            while True:
+                done, _ = await asyncio.wait(list(pending), timeout=call.wait_timeout(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                result = call.settle(done, pending)
+                if result is not None:
+                    return result
+                if not pending:
+                    if launch("failover") is None:
+                        raise call.exhausted()
+                elif call.hedge_due():
+                    launch("hedge")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _pump(self, attempt, provider, call, messages, stop, kwargs, out, cancel):
+        """Runs one streaming attempt on its own thread, putting (attempt, event, value) on `out`."""
+        start = time.perf_counter()
+        first = True
+        stream = provider.model.stream(messages, stop=stop, **kwargs)
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    stream.close()
+                    provider.cancelled(call.route)
+                    return
+                if first:
+                    provider.observe(call.latency_key, time.perf_counter() - start)
+                    first = False
+                out.put((attempt, "chunk", chunk))
+        except Exception as e:
+            provider.failed(call.route, e)
+            out.put((attempt, "error", e))
+            return
+        provider.succeeded(call.route)
+        out.put((attempt, "done", None))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        route = kwargs.pop("llm_route", "default")
+        call = _Call(self, route, latency_key=f"{route}:first_chunk")
+        out = queue.Queue()
+        pending = {}
+
+        def launch(via):
+            provider = call.next(via)
+            if provider is not None:
+                attempt, cancel = len(call.tried), threading.Event()
+                pending[attempt] = (provider, via, cancel)
+                threading.Thread(
+                    target=self._pump, args=(attempt, provider, call, messages, stop, kwargs, out, cancel),
+                    name=f"llm-stream-{provider.name}", daemon=True
+                ).start()
+            return provider
+
+        if launch("primary") is None:
+            raise call.exhausted()
+        winner, winner_cancel = None, None
+        try:
+            # Until the first chunk: hedge, fail over, enforce the deadline.
+            while winner is None:
+                try:
+                    attempt, event, value = out.get(timeout=call.wait_timeout())
+                except queue.Empty:
+                    if call.hedge_due():
+                        launch("hedge")
+                    continue
+                if attempt not in pending:
+                    continue
+                if event == "error":
+                    call.last_error = value
+                    del pending[attempt]
+                    if not pending and launch("failover") is None:
+                        raise call.exhausted()
+                    continue
+                winner = attempt
+                provider, via, winner_cancel = pending.pop(winner)
+                call.won(provider, via)
+                for _, _, cancel in pending.values():
+                    cancel.set()
+                pending.clear()
+            # Then the winner's chunks, as they come.
+            while event == "chunk":
+                yield ChatGenerationChunk(message=value)
+                attempt, event, value = out.get()
+                while attempt != winner:
+                    attempt, event, value = out.get()
+            if event == "error":
+                raise value
+        finally:
+            # Also stops the winner if the consumer closes the stream early.
+            for _, _, cancel in pending.values():
+                cancel.set()
+            if winner_cancel is not None:
+                winner_cancel.set()
+
+def _has_key(name):
+    return bool(config.GROQ_API_KEY if name == "groq" else config.GOOGLE_API_KEY)
+
+def _http_clients():
+    """Sync and async httpx clients sharing the pool limits; one pair per provider."""
+    import httpx
+    limits = httpx.Limits(max_connections=config.LLM_POOL_SIZE, max_keepalive_connections=config.LLM_POOL_SIZE)
+    timeout = httpx.Timeout(config.LLM_DEADLINE, connect=min(10.0, config.LLM_DEADLINE))
+    return httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def provider_model(name, routed=True):
+    """
+    The LangChain chat model of provider `name` (the SDKs are imported here). Routed,
+    it makes one attempt per call, bounded by LLM_DEADLINE; retrying is the router's job.
+    """
+    if name == "groq":
+        if not config.GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY not set but LLM_PROVIDER is 'groq'")
+        from langchain_groq import ChatGroq
+        metrics.log("llm", provider="groq", model=config.GROQ_MODEL)
+        kwargs = {}
+        if routed:
+            http_client, http_async_client = _http_clients()
+            kwargs.update(max_retries=0, request_timeout=config.LLM_DEADLINE,
+                          http_client=http_client, http_async_client=http_async_client)
+        if config.GROQ_BASE_URL:
+            kwargs["base_url"] = config.GROQ_BASE_URL
+        return ChatGroq(model=config.GROQ_MODEL, api_key=config.GROQ_API_KEY, temperature=0.7, **kwargs)
+    if name == "gemini":
+        if not config.GOOGLE_API_KEY:
+            raise ValueError("GOOGLE_API_KEY not set.")
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        metrics.log("llm", provider="gemini", model=config.GEMINI_MODEL)
+        # The genai client keeps its own keep-alive pool for the model's lifetime.
+        kwargs = {"timeout": config.LLM_DEADLINE, "max_retries": 0} if routed else {}
+        if config.GEMINI_BASE_URL:
+            kwargs["base_url"] = config.GEMINI_BASE_URL
+        return ChatGoogleGenerativeAI(model=config.GEMINI_MODEL, google_api_key=config.GOOGLE_API_KEY,
+                                      temperature=0.7, **kwargs)
+    raise ValueError(f"Unknown LLM_PROVIDER '{name}'. Options: {', '.join(PROVIDERS)}.")
+
+def build_llm():
+    """
+    The engine's LLM: an LLMRouter over LLM_PROVIDER and, with LLM_FAILOVER, the other
+    provider if its key is set; with LLM_ROUTER off, LLM_PROVIDER's client alone.
+    """
+    primary = config.LLM_PROVIDER
+    if not config.LLM_ROUTER:
+        return provider_model(primary, routed=False)
+    names = [primary] + [n for n in PROVIDERS if n != primary and config.LLM_FAILOVER]
+    providers = []
+    for name in names:
+        if name != primary and not _has_key(name):
+            metrics.log("llm_failover_skipped", provider=name, reason="no API key")
+            continue
+        providers.append(Provider(name, provider_model(name)))
+    metrics.log("llm_router", providers=[p.name for p in providers], deadline=config.LLM_DEADLINE,
+                hedge_percentile=config.LLM_HEDGE_PERCENTILE)
+    return LLMRouter(providers=providers)
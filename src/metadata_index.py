@@ -0,0 +1,169 @@
+"""
+Metadata indexes for filtered retrieval on theme, tags and publish date.
+
+Chunks share their article's metadata, so everything is indexed per article and mapped
+to FAISS positions through one article number per position:
+  themes, tags   value -> numbers of the articles carrying it
+  days           each article's publish date as days since 1970-01-01 (-1 = unknown)
+A filter resolves to a boolean mask over FAISS positions, which the vector search
+applies through an ID selector (ann.filtered_search) instead of over-fetching.
+"""
+import json
+import numpy as np
+from .chunk_store import CHUNK_KEYS, ChunkIdMap, ChunkStore
+
+FILTER_KEYS = ("theme", "tags", "date_from", "date_to")
+UNKNOWN_DAY = -1
+
+def parse_day(value):
+    """Days since epoch of an ISO date or datetime ("2025-11-04T03:00:00-05:00"), or None."""
+    try:
+        day = np.datetime64(str(value)[:10], "D")
+    except ValueError:
+        return None
+    # An empty string parses as NaT.
+    return None if np.isnat(day) else int(day.astype(np.int64))
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [v for v in value if v]
+
+def parse_filters(filters):
+    """
+    Validates a filter dict {"theme": str | [str], "tags": str | [str],
+    "date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"}. Several themes or tags match any
+    of them and dates are inclusive. Returns only the keys in use, or None if none are.
+    """
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}. Options: {', '.join(FILTER_KEYS)}.")
+    parsed = {}
+    for key in ("theme", "tags"):
+        values = _as_list(filters.get(key))
+        if values:
+            parsed[key] = values
+    for key in ("date_from", "date_to"):
+        value = filters.get(key)
+        if not value:
+            continue
+        if parse_day(value) is None:
+            raise ValueError(f"Invalid {key} '{value}', expected YYYY-MM-DD.")
+        parsed[key] = str(value)[:10]
+    return parsed or None
+
+def matches(metadata, filters):
+    """The test MetadataIndex.mask applies, for a single chunk's metadata."""
+    if "theme" in filters and metadata.get("theme") not in filters["theme"]:
+        return False
+    if "tags" in filters and not set(metadata.get("tags") or []) & set(filters["tags"]):
+        return False
+    if "date_from" in filters or "date_to" in filters:
+        day = parse_day(metadata.get("publish_date", ""))
+        if day is None:
+            return False
+        if "date_from" in filters and day < parse_day(filters["date_from"]):
+            return False
+        if "date_to" in filters and day > parse_day(filters["date_to"]):
+            return False
+    return True
+
+class MetadataIndex:
+    def __init__(self, articles, article_of, hidden):
+        self._article_of = article_of
+        self._hidden = hidden
+        self._themes = {}
+        self._tags = {}
+        self._days = np.full(len(articles), UNKNOWN_DAY, dtype=np.int32)
+        for number, metadata in enumerate(articles):
+            self._themes.setdefault(metadata.get("theme", ""), []).append(number)
+            for tag in metadata.get("tags") or []:
+                self._tags.setdefault(tag, []).append(number)
+            day = parse_day(metadata.get("publish_date", ""))
+            if day is not None:
+                self._days[number] = day
+        self._themes = {k: np.array(v, dtype=np.int64) for k, v in self._themes.items()}
+        self._tags = {k: np.array(v, dtype=np.int64) for k, v in self._tags.items()}
+        self.num_articles = len(articles)
+
+    def __len__(self):
+        return len(self._article_of)
+
+    @classmethod
+    def build(cls, vectorstore):
+        """
+        Indexes every FAISS position of `vectorstore`. A freshly loaded chunk store is read
+        column-wise; chunks added since load, and other docstores, are looked up one by one.
+        """
+        count = vectorstore.index.ntotal
+        article_of = np.zeros(count, dtype=np.int32)
+        hidden = np.zeros(count, dtype=bool)
+        articles = []
+        numbers = {}
+
+        def number(metadata):
+            shared = {k: v for k, v in metadata.items() if k not in CHUNK_KEYS}
+            key = json.dumps(shared, sort_keys=True, ensure_ascii=False)
+            if key not in numbers:
+                numbers[key] = len(articles)
+                articles.append(shared)
+            return numbers[key]
+
+        store, id_map = vectorstore.docstore, vectorstore.index_to_docstore_id
+        start = 0
+        if isinstance(store, ChunkStore) and isinstance(id_map, ChunkIdMap):
+            # Until the first compaction, base positions are the chunk table's rows.
+            start = min(count, store.base_size)
+            base_articles, base_tombstoned = store.base_columns()
+            article_of[:start] = base_articles[:start]
+            hidden[:start] = base_tombstoned[:start]
+            for shared in store.articles:
+                number(shared)
+            for row, doc in store.changed_rows():
+                if row < start:
+                    article_of[row] = number(doc.metadata)
+                    hidden[row] = bool(doc.metadata.get("tombstoned"))
+
+        for position in range(start, count):
+            doc = store.search(id_map[position])
+            if isinstance(doc, str):
+                hidden[position] = True
+                continue
+            article_of[position] = number(doc.metadata)
+            hidden[position] = bool(doc.metadata.get("tombstoned"))
+        return cls(articles, article_of, hidden)
+
+    def _article_mask(self, postings, values):
+        mask = np.zeros(self.num_articles, dtype=bool)
+        for value in values:
+            if value in postings:
+                mask[postings[value]] = True
+        return mask
+
+    def mask(self, filters):
+        """Boolean mask over FAISS positions: live chunks passing every filter in `filters`."""
+        allowed = np.ones(self.num_articles, dtype=bool)
+        if "theme" in filters:
+            allowed &= self._article_mask(self._themes, filters["theme"])
+        if "tags" in filters:
+            allowed &= self._article_mask(self._tags, filters["tags"])
+        if "date_from" in filters or "date_to" in filters:
+            allowed &= self._days != UNKNOWN_DAY
+            if "date_from" in filters:
+                allowed &= self._days >= parse_day(filters["date_from"])
+            if "date_to" in filters:
+                allowed &= self._days <= parse_day(filters["date_to"])
+        return allowed[self._article_of] & ~self._hidden
+
+    def themes(self):
+        return sorted(self._themes)
+
+    def stats(self):
+        return {
+            "chunks": len(self), "articles": self.num_articles,
+            "themes": len(self._themes), "tags": len(self._tags)
+        }
@@ -0,0 +1,343 @@
+"""
+Per-request tracing and process-wide Prometheus metrics for the RAG pipeline.
+
+A request opens a Trace (`with metrics.trace("process_query") as t:`), which becomes the
+current trace of its context, including asyncio tasks and asyncio.to_thread workers.
+Pipeline stages then record into it with `metrics.stage(name)`, `metrics.count(...)`
+and `metrics.record_llm(...)` without the trace being passed around. Every stage is
+also observed in the Prometheus metrics, traced or not; render() returns them in the
+text exposition format.
+
+Stages: embed_query (answer-cache lookup), hop1_embed, hop1_search, reformulate,
+hop2_embed, hop2_search, rerank, context, generate, references. Routed LLM calls add
+hedges / failovers counts to reformulate and generate (llm_router.py). With
+micro-batching (batching.py) the batchers export their queue depth and batch sizes.
+
+Finished requests and diagnostics are logged as JSON lines by the "rag" logger:
+`metrics.log("rerank", pairs_scored=...)` at DEBUG level unless told otherwise.
+"""
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from . import config
+from .rate_limit import estimate_tokens
+from .utils import strip_think
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+BATCH_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STARTUP_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_REGISTRY = []
+_current = contextvars.ContextVar("rag_trace", default=None)
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout, so contextlib.redirect_stdout still captures the lines."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+logger = logging.getLogger("rag")
+if not logger.handlers:
+    _handler = _StdoutHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(config.LOG_LEVEL)
+    logger.propagate = False
+
+def log(event, level=logging.DEBUG, **fields):
+    """Logs `event` and `fields` as one JSON line, tagged with the current trace's path."""
+    if not logger.isEnabledFor(level):
+        return
+    trace_ = _current.get()
+    if trace_ is not None:
+        fields.setdefault("path", trace_.path)
+    logger.log(level, json.dumps({"event": event, "level": logging.getLevelName(level).lower(), **fields},
+                                 ensure_ascii=False, default=str))
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(key)} {value}"
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, observed = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, observed + 1)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(counts), total, observed) for key, (counts, total, observed) in self._values.items())
+        for key, counts, total, observed in items:
+            for bound, count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}"
+            yield f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {observed}"
+            yield f"{self.name}_sum{_format_labels(key)} {total}"
+            yield f"{self.name}_count{_format_labels(key)} {observed}"
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of one pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end request duration.", ("path", "cache"))
+REQUESTS = Counter("rag_requests", "Requests by entry point and outcome.", ("path", "outcome"))
+STAGE_ITEMS = Counter("rag_stage_items", "Documents, candidates and pairs handled per stage.", ("stage", "kind"))
+LLM_TOKENS = Counter("rag_llm_tokens", "LLM tokens by stage and kind (input, output, reasoning).", ("stage", "kind"))
+LLM_COST = Counter("rag_llm_cost_usd", "Estimated LLM cost in USD from the configured token prices.", ("stage",))
+LLM_ATTEMPTS = Counter("rag_llm_attempts", "LLM provider requests by route, provider and outcome "
+                      "(ok, error, rate_limited, cancelled).", ("route", "provider", "outcome"))
+LLM_ATTEMPT_SECONDS = Histogram("rag_llm_attempt_seconds", "Latency of successful LLM provider requests.",
+                                ("route", "provider"))
+LLM_ROUTED = Counter("rag_llm_routed", "Routed LLM calls by route, answering provider and how it was reached "
+                     "(primary, hedge, failover; failed and deadline have no provider).", ("route", "provider", "via"))
+LLM_CIRCUIT = Counter("rag_llm_circuit_transitions", "Provider circuit breaker transitions.", ("provider", "state"))
+REQUESTS_IN_FLIGHT = Gauge("rag_requests_in_flight", "Requests currently being served, by entry point.", ("path",))
+BATCH_QUEUE_DEPTH = Gauge("rag_batch_queue_depth", "Items waiting in a micro-batcher's queue.", ("batcher",))
+BATCH_SIZE = Histogram("rag_batch_size", "Items per micro-batch sent to the model.", ("batcher",), BATCH_SIZE_BUCKETS)
+BATCH_REQUESTS = Histogram("rag_batch_requests", "Concurrent requests coalesced into one micro-batch.", ("batcher",),
+                           BATCH_SIZE_BUCKETS)
+BATCH_WAIT_SECONDS = Histogram("rag_batch_wait_seconds", "Time a request waited in a micro-batcher's queue.",
+                               ("batcher",), BATCH_WAIT_BUCKETS)
+STARTUP_SECONDS = Histogram("rag_startup_seconds", "Engine startup duration per phase.", ("phase",), STARTUP_BUCKETS)
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _REGISTRY:
+        name = f"{metric.name}_total" if metric.kind == "counter" else metric.name
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+def llm_usage(message, prompt_text=""):
+    """
+    Input/output/reasoning token counts of an LLM reply. Provider-reported usage is
+    preferred (LangChain usage_metadata, else OpenAI-style token_usage as Groq sends);
+    missing counts are estimated from the text, and reasoning from <think> blocks.
+    Reasoning tokens are a part of the output tokens, not in addition to them.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens")
+    output_tokens = usage.get("output_tokens")
+    reasoning_tokens = (usage.get("output_token_details") or {}).get("reasoning")
+    if input_tokens is None:
+        token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+        input_tokens = token_usage.get("prompt_tokens")
+        output_tokens = token_usage.get("completion_tokens")
+        reasoning_tokens = (token_usage.get("completion_tokens_details") or {}).get("reasoning_tokens")
+
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    estimated = input_tokens is None or output_tokens is None
+    if input_tokens is None:
+        input_tokens = estimate_tokens(prompt_text)
+    if output_tokens is None:
+        output_tokens = estimate_tokens(content)
+    if reasoning_tokens is None:
+        reasoning_tokens = 0
+        if "<think>" in content:
+            reasoning_tokens = max(0, estimate_tokens(content) - estimate_tokens(strip_think(content)))
+    return {
+        "input_tokens": int(input_tokens),
+        "output_tokens": int(output_tokens),
+        "reasoning_tokens": int(reasoning_tokens),
+        "estimated": estimated
+    }
+
+def llm_cost(usage):
+    return (usage["input_tokens"] * config.LLM_INPUT_COST_PER_MTOK
+            + usage["output_tokens"] * config.LLM_OUTPUT_COST_PER_MTOK) / 1e6
+
+class Trace:
+    """Stage timings, item counts and LLM usage of one request."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cache = "miss"
+        self.outcome = None
+        self.stages = {}
+        self.llm = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        REQUESTS_IN_FLIGHT.inc(path=path)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+    def add_counts(self, name, counts):
+        with self._lock:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            for kind, value in counts.items():
+                entry[kind] = entry.get(kind, 0) + value
+
+    def add_llm(self, name, usage):
+        with self._lock:
+            entry = self.llm.setdefault(name, {"calls": 0, "input_tokens": 0, "output_tokens": 0,
+                                               "reasoning_tokens": 0, "estimated": False})
+            entry["calls"] += 1
+            for kind in ("input_tokens", "output_tokens", "reasoning_tokens"):
+                entry[kind] += usage[kind]
+            entry["estimated"] = entry["estimated"] or usage["estimated"]
+
+    def summary(self):
+        with self._lock:
+            stages = {name: {**entry, "seconds": round(entry["seconds"], 4)} for name, entry in self.stages.items()}
+            llm = {name: dict(entry) for name, entry in self.llm.items()}
+        tokens = {
+            kind: sum(entry[f"{kind}_tokens"] for entry in llm.values()) for kind in ("input", "output", "reasoning")
+        }
+        return {
+            "path": self.path,
+            "cache": self.cache,
+            "total_seconds": round(time.perf_counter() - self._start, 4),
+            "stages": stages,
+            "llm": llm,
+            "tokens": tokens,
+            "cost_usd": round(sum(llm_cost(entry) for entry in llm.values()), 6)
+        }
+
+    def finish(self, outcome):
+        """Records the request in the Prometheus metrics and emits its structured log line."""
+        if self.outcome is None:
+            REQUESTS_IN_FLIGHT.dec(path=self.path)
+        self.outcome = outcome
+        summary = self.summary()
+        REQUESTS.inc(path=self.path, outcome=outcome)
+        REQUEST_SECONDS.observe(summary["total_seconds"], path=self.path, cache=self.cache)
+        if config.METRICS_LOG:
+            log("rag_request", logging.INFO, outcome=outcome, **summary)
+        return summary
+
+def record_startup(timings):
+    """Observes an engine's startup phases ({phase: seconds}, including "total")."""
+    for phase, seconds in timings.items():
+        STARTUP_SECONDS.observe(seconds, phase=phase)
+
+def current():
+    return _current.get()
+
+@contextmanager
+def activate(trace_):
+    """Makes `trace_` current for the block. Generators must not yield inside it."""
+    token = _current.set(trace_)
+    try:
+        yield trace_
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def trace(path):
+    """Opens and activates a Trace for one request; finishes it when the block exits."""
+    trace_ = Trace(path)
+    outcome = "error"
+    try:
+        with activate(trace_):
+            yield trace_
+        outcome = "ok"
+    finally:
+        trace_.finish(outcome)
+
+def observe(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace_ = _current.get()
+    if trace_ is not None:
+        trace_.add_stage(name, seconds)
+
+@contextmanager
+def stage(name):
+    """Times the block as pipeline stage `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def count(name, **counts):
+    """Adds item counts (docs, candidates, pairs_scored, ...) to stage `name`."""
+    for kind, value in counts.items():
+        STAGE_ITEMS.inc(value, stage=name, kind=kind)
+    trace_ = _current.get()
+    if trace_ is not None:
+        trace_.add_counts(name, counts)
+
+def record_llm(name, message, prompt_text=""):
+    """Records the token usage (and estimated cost) of an LLM reply for stage `name`."""
+    usage = llm_usage(message, prompt_text)
+    for kind in ("input", "output", "reasoning"):
+        LLM_TOKENS.inc(usage[f"{kind}_tokens"], stage=name, kind=kind)
+    LLM_COST.inc(llm_cost(usage), stage=name)
+    trace_ = _current.get()
+    if trace_ is not None:
+        trace_.add_llm(name, usage)
+    return usage
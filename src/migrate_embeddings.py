@@ -0,0 +1,178 @@
+"""
+Re-embeds an existing index with the configured embedding backend and storage
+(config.EMBEDDING_BACKEND, EMBEDDING_STORAGE, ANN_INDEX_TYPE):
+
+    python -m src.migrate_embeddings                  # INDEX_PATH, swapped in place
+    python -m src.migrate_embeddings --target DIR     # leaves the source untouched
+    python -m src.migrate_embeddings --requantize     # same model, new storage: reuses the vectors
+
+Chunk texts, ids and metadata are carried over as they are (tombstoned chunks are
+dropped), so nothing is cleaned or split again and the manifest's article hashes stay
+valid for incremental updates. Documents go through the embedding cache, so an
+interrupted migration only re-embeds what it had not reached. A sharded index is
+migrated shard by shard and its router centroids are recomputed.
+
+In place, the new index is built in <path>.migrating and swapped in once complete; the
+old one is kept as <path>.prev.
+"""
+import argparse
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+from . import ann, config, ingestion, shards
+from .bm25 import BM25Index
+from .chunk_store import CHUNK_KEYS, ChunkStoreFAISS
+from .embedding_backends import embedding_model_name
+from .incremental import is_live
+
+def iter_live_chunks(vectorstore):
+    """(position, doc id, Document) of every live chunk, in FAISS position order."""
+    id_map = vectorstore.index_to_docstore_id
+    for position in range(vectorstore.index.ntotal):
+        doc_id = id_map[position]
+        doc = vectorstore.docstore.search(doc_id)
+        if isinstance(doc, str) or not is_live(doc.metadata):
+            continue
+        yield position, doc_id, doc
+
+def migrate_index(source, target, embeddings=None, requantize=False):
+    """
+    Writes the chunks of the index at `source` to a new index at `target`, embedded
+    with `embeddings` (default: the configured backend) or, with `requantize`, with the
+    vectors `source` already stores. Returns the new vectorstore.
+    """
+    print(f"=== {source} -> {target} ===")
+    old = ChunkStoreFAISS.load_local(source, None)
+    old_manifest = ingestion.load_manifest(source) or {}
+    stored = ann.stored_vectors(old.index) if requantize else None
+    if not requantize:
+        embeddings = embeddings or ingestion.get_document_embeddings()
+    params = ann.ann_params()
+    print(f"Index type: {params}")
+    bm25 = BM25Index() if config.BM25_ENABLED else None
+    vectorstore = None
+    pending = []
+    kept = {}
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal vectorstore
+        if vectorstore is None:
+            vectorstore = ingestion.new_vectorstore(
+                embeddings, params, np.concatenate([v for _, v, _, _ in pending]), target
+            )
+        for texts, vectors, metadatas, ids in pending:
+            vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+            if bm25 is not None:
+                bm25.add(ids, texts)
+        pending.clear()
+        elapsed = time.perf_counter() - start
+        print(f"Migrated {vectorstore.index.ntotal}/{old.index.ntotal} chunks "
+              f"({vectorstore.index.ntotal / max(elapsed, 1e-9):.1f} chunks/s)")
+
+    for window in ingestion.windowed(iter_live_chunks(old), config.INGEST_WINDOW_SIZE):
+        texts = [doc.page_content for _, _, doc in window]
+        metadatas = [{k: v for k, v in doc.metadata.items() if k not in CHUNK_KEYS} for _, _, doc in window]
+        ids = [doc_id for _, doc_id, _ in window]
+        if requantize:
+            vectors = stored[[position for position, _, _ in window]]
+        else:
+            vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        for doc_id, metadata in zip(ids, metadatas):
+            kept[doc_id] = metadata.get("link", "")
+        pending.append((texts, vectors, metadatas, ids))
+
+        buffered = sum(len(v) for _, v, _, _ in pending)
+        if vectorstore is None and ann.needs_training(params) and buffered < config.ANN_TRAIN_SIZE:
+            continue
+        flush()
+    if pending:
+        flush()
+    if vectorstore is None:
+        raise ValueError(f"No live chunks in {source}")
+
+    # Article hashes carry over, so unchanged articles are still skipped by upserts.
+    articles = {}
+    for doc_id, link in kept.items():
+        previous = old_manifest.get("articles", {}).get(link, {})
+        articles.setdefault(link, {"hash": previous.get("hash", ""), "chunk_ids": []})["chunk_ids"].append(doc_id)
+    if requantize:
+        embedding = old_manifest.get("embedding") or {"model": embedding_model_name(), "dim": int(old.index.d)}
+    else:
+        embedding = ingestion.embedding_info(embeddings, vectorstore.index.d)
+
+    print(f"FAISS index: {ann.describe(vectorstore.index)}")
+    vectorstore.save_local(target)
+    ingestion.save_manifest(target, {
+        "build_id": uuid.uuid4().hex,
+        "version": 1,
+        "ann": params,
+        "embedding": embedding,
+        "articles": articles,
+        "tombstones": []
+    })
+    if bm25 is not None:
+        print(f"BM25 index: {bm25.save(target)}")
+    # Chunk ids carry over, so the near-duplicate filter stays valid for the new index.
+    for name in (ingestion.BOILERPLATE_FILE, ingestion.DEDUP_FILE):
+        if os.path.exists(os.path.join(source, name)):
+            shutil.copy2(os.path.join(source, name), target)
+    return vectorstore
+
+def migrate_shards(source, target, embeddings=None, requantize=False):
+    """migrate_index for every shard listed in `source`'s shards.json, plus new router centroids."""
+    manifest = shards.load_shards_manifest(source)
+    if not requantize:
+        embeddings = embeddings or ingestion.get_document_embeddings()
+    for theme, info in sorted(manifest["shards"].items()):
+        shard_target = os.path.join(target, shards.SHARDS_DIR, info["dir"])
+        vectorstore = migrate_index(os.path.join(source, shards.SHARDS_DIR, info["dir"]), shard_target,
+                                    embeddings, requantize)
+        np.save(os.path.join(shard_target, shards.CENTROIDS_FILE),
+                shards.router_centroids(ann.stored_vectors(vectorstore.index)))
+        info.update(
+            chunks=vectorstore.index.ntotal,
+            build_id=ingestion.load_manifest(shard_target)["build_id"],
+            built_at=time.strftime("%Y-%m-%dT%H:%M:%S")
+        )
+    if os.path.exists(os.path.join(source, ingestion.BOILERPLATE_FILE)):
+        shutil.copy2(os.path.join(source, ingestion.BOILERPLATE_FILE), target)
+    shards.save_shards_manifest(target, manifest)
+
+def migrate(source=None, target=None, requantize=False):
+    source = os.path.abspath(source or config.INDEX_PATH)
+    in_place = target is None or os.path.abspath(target) == source
+    build_dir = source + ".migrating" if in_place else os.path.abspath(target)
+    if in_place and os.path.exists(build_dir):
+        # Left by an interrupted run; the embedding cache still has its vectors.
+        shutil.rmtree(build_dir)
+    elif os.path.exists(build_dir) and os.listdir(build_dir):
+        raise FileExistsError(f"{build_dir} is not empty.")
+
+    print(f"Migrating {source} to {config.EMBEDDING_BACKEND} embeddings ({embedding_model_name()}), "
+          f"{config.EMBEDDING_STORAGE} storage{' (vectors reused)' if requantize else ''}")
+    start = time.perf_counter()
+    if shards.ShardedIndex.exists(source):
+        migrate_shards(source, build_dir, requantize=requantize)
+    else:
+        migrate_index(source, build_dir, requantize=requantize)
+
+    if in_place:
+        backup = source + ".prev"
+        if os.path.exists(backup):
+            shutil.rmtree(backup)
+        os.replace(source, backup)
+        os.replace(build_dir, source)
+        print(f"Swapped the new index in at {source}; the old one is at {backup}")
+    print(f"Migration finished in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed an index with the configured embedding backend.")
+    parser.add_argument("--source", default=config.INDEX_PATH)
+    parser.add_argument("--target", help="Write here instead of replacing the source")
+    parser.add_argument("--requantize", action="store_true",
+                        help="Keep the stored vectors (same model) and only change EMBEDDING_STORAGE / ANN_INDEX_TYPE")
+    args = parser.parse_args()
+    migrate(args.source, args.target, args.requantize)
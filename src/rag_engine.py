@@ -1,68 +1,416 @@
+import asyncio
+import atexit
+import logging
 import os
+import threading
 import time
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import PromptTemplate
-from sentence_transformers import CrossEncoder
-from . import config, utils
+from . import ann, config, metrics, utils
+from .answer_cache import SemanticAnswerCache
+from .batching import BatchedReranker, MicroBatcher
+from .bm25 import BM25Index, reciprocal_rank_fusion
+from .chunk_store import ChunkStoreFAISS
+from .context import assemble_context
+from .embedding_backends import (
+    LocalEmbeddings, batches_queries, embed_query_batch, embedding_model_name, needs_google, query_embeddings
+)
+from .embedding_cache import QueryEmbeddingCache
+from .incremental import IncrementalIndex, IndexLock
+from .llm_router import LLMRouter, build_llm
+from .metadata_index import MetadataIndex, matches, parse_filters
+from .reranker import build_reranker, cascade_rerank
+from .shards import ShardedIndex
+
+class _EngineEmbeddings(Embeddings):
+    """Forwards to `engine.embeddings`, which may still be loading when the index is."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def embed_documents(self, texts):
+        return self.engine.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.engine.embeddings.embed_query(text)
 
 class RAGEngine:
-    def __init__(self):
-        if not config.GOOGLE_API_KEY:
-            raise ValueError("GOOGLE_API_KEY not set.")
-            
-        if not config.GOOGLE_API_KEY:
+    def __init__(self, llm=None, embeddings=None, reranker=None, index_path=None, parallel=None, warmup=None,
+                 micro_batching=None):
+        """
+        `llm`, `embeddings` and `reranker` replace the configured models, e.g. with the
+        offline stand-ins in fakes.py; no API key is needed for the ones passed in.
+
+        The LLM/embedding clients, the index and the reranker load on parallel threads
+        (config.STARTUP_PARALLEL), then the local models optionally run one warm-up
+        query (config.STARTUP_WARMUP). `startup_timings` holds the seconds per phase.
+
+        The engine is safe to share between threads serving concurrent requests. With
+        `micro_batching` (config.MICRO_BATCHING) their query embeddings and reranker
+        pairs are coalesced into shared batches (see batching.py).
+        """
+        start = time.perf_counter()
+        index_path = index_path or config.INDEX_PATH
+        parallel = config.STARTUP_PARALLEL if parallel is None else parallel
+        warmup = config.STARTUP_WARMUP if warmup is None else warmup
+        micro_batching = config.MICRO_BATCHING if micro_batching is None else micro_batching
+        google = (embeddings is None and needs_google()) or (llm is None and config.LLM_PROVIDER != "groq")
+        if google and not config.GOOGLE_API_KEY:
             raise ValueError("GOOGLE_API_KEY not set.")
-            
-        if config.LLM_PROVIDER == "groq":
-            if not config.GROQ_API_KEY:
-                raise ValueError("GROQ_API_KEY not set but LLM_PROVIDER is 'groq'")
-            
-            from langchain_groq import ChatGroq
-            print(f"DEBUG: Using Groq LLM ({config.GROQ_MODEL})")
-            self.llm = ChatGroq(
-                model=config.GROQ_MODEL,
-                api_key=config.GROQ_API_KEY,
-                temperature=0.7
-            )
+
+        self.startup_timings = {}
+        self.query_cache = QueryEmbeddingCache(
+            embedding_model_name(),
+            max_size=config.QUERY_CACHE_SIZE,
+            ttl=config.QUERY_CACHE_TTL,
+            persist_path=config.QUERY_CACHE_PATH
+        )
+        if config.QUERY_CACHE_PATH:
+            atexit.register(self.query_cache.save)
+
+        phases = [
+            ("clients", lambda: self._load_clients(llm, embeddings)),
+            ("index", lambda: self._load_index(index_path, embeddings)),
+            ("reranker", lambda: reranker or build_reranker()),
+        ]
+        if parallel:
+            with ThreadPoolExecutor(max_workers=len(phases), thread_name_prefix="startup") as pool:
+                futures = [(name, pool.submit(self._timed_phase, name, load)) for name, load in phases]
+                loaded = {name: future.result() for name, future in futures}
         else:
-            print(f"DEBUG: Using Gemini LLM ({config.LLM_MODEL})")
-            self.llm = ChatGoogleGenerativeAI(
-                model=config.LLM_MODEL,
-                google_api_key=config.GOOGLE_API_KEY,
-                temperature=0.7
+            loaded = {name: self._timed_phase(name, load) for name, load in phases}
+        self.llm, self.embeddings = loaded["clients"]
+        self.reranker = loaded["reranker"]
+
+        self.query_batcher = None
+        if micro_batching:
+            # Embeddings without a batched query call would embed a micro-batch one by one.
+            if batches_queries(self.embeddings):
+                # Concurrent batches would only compete for the local model's CPU cores.
+                workers = 1 if isinstance(self.embeddings, LocalEmbeddings) else config.EMBED_MICRO_BATCH_WORKERS
+                self.query_batcher = MicroBatcher(
+                    "query_embed", self._embed_batch, config.EMBED_MICRO_BATCH_SIZE, workers=workers
+                )
+            self.reranker = BatchedReranker(self.reranker)
+            batched = "queries and rerank pairs" if self.query_batcher is not None else "rerank pairs"
+            metrics.log("micro_batching", batched=batched, max_wait_ms=config.MICRO_BATCH_MAX_WAIT_MS)
+
+        self.answer_cache = None
+        if config.ANSWER_CACHE_ENABLED:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=config.ANSWER_CACHE_THRESHOLD,
+                max_size=config.ANSWER_CACHE_SIZE,
+                ttl=config.ANSWER_CACHE_TTL
             )
-        
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model=config.EMBEDDING_MODEL,
-            google_api_key=config.GOOGLE_API_KEY
-        )
-        
+
+        if warmup:
+            self._timed_phase("warmup", self.warmup)
+        self.startup_timings["total"] = round(time.perf_counter() - start, 3)
+        metrics.record_startup(self.startup_timings)
+        metrics.log("startup", timings=self.startup_timings, parallel=parallel)
+
+    def _timed_phase(self, name, load):
+        start = time.perf_counter()
         try:
-            self.vectorstore = FAISS.load_local(
-                config.INDEX_PATH, 
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
+            return load()
+        finally:
+            self.startup_timings[name] = round(time.perf_counter() - start, 3)
+
+    def _load_clients(self, llm=None, embeddings=None):
+        """(llm, embeddings); the provider SDKs are only imported here, not at module import."""
+        if llm is None:
+            llm = build_llm()
+
+        if embeddings is None:
+            embeddings = query_embeddings()
+            metrics.log("embeddings", backend=config.EMBEDDING_BACKEND, model=embedding_model_name())
+        return llm, embeddings
+
+    def _load_index(self, index_path, embeddings=None):
+        """
+        Loads the (sharded) index and BM25 index, in parallel with the clients, so the
+        vectorstores get a proxy for the engine's embeddings. `embeddings` is only the
+        override handed to incremental updates.
+        """
+        query_embeddings = _EngineEmbeddings(self)
+        self.index_lock = IndexLock()
+        self.vectorstore = None
+        self.shards = None
+        try:
+            if ShardedIndex.exists(index_path):
+                self.shards = ShardedIndex.load(index_path, query_embeddings)
+            else:
+                self.vectorstore = ChunkStoreFAISS.load_local(
+                    index_path,
+                    query_embeddings,
+                    allow_dangerous_deserialization=config.ALLOW_PICKLE_INDEX
+                )
         except Exception as e:
-            print(f"Index not found or error loading: {e}. Please run ingestion first.")
+            metrics.log("index_missing", logging.WARNING, error=str(e), hint="Please run ingestion first.")
             self.vectorstore = None
+            self.shards = None
+
+        self.bm25 = None
+        if self.vectorstore and BM25Index.exists(index_path):
+            self.bm25 = BM25Index.load(index_path)
+        self.hop1_retriever, self.hop2_retriever = config.HOP1_RETRIEVER, config.HOP2_RETRIEVER
+        if self.bm25 is None and "dense" not in (self.hop1_retriever, self.hop2_retriever):
+            metrics.log("bm25_missing", fallback="dense")
+        if self.bm25 is None:
+            self.hop1_retriever, self.hop2_retriever = "dense", "dense"
+        metrics.log("retrievers", hop1=self.hop1_retriever, hop2=self.hop2_retriever)
+
+        self.index_manager = None
+        if self.vectorstore:
+            self.index_manager = IncrementalIndex(
+                self.vectorstore, index_path, embeddings=embeddings, bm25=self.bm25, search_lock=self.index_lock
+            )
+            built_with = (self.index_manager.manifest.get("embedding") or {}).get("model")
+            if embeddings is None and built_with and built_with != embedding_model_name():
+                metrics.log("embedding_mismatch", logging.WARNING, index_model=built_with,
+                            backend=config.EMBEDDING_BACKEND, backend_model=embedding_model_name(),
+                            hint="Re-embed the index with `python -m src.migrate_embeddings`.")
+        self._metadata_index = None
+        self._metadata_version = None
+        self._metadata_lock = threading.Lock()
+        if self.has_index:
+            self.set_search_params(ef_search=config.ANN_EF_SEARCH, nprobe=config.ANN_NPROBE)
+
+    def warmup(self):
+        """
+        One throwaway pass through the local models: a FAISS search (which pages a
+        memory-mapped index in), a BM25 search, a reranker batch (first-call setup) and,
+        with the local embedding backend, one query embedding. Remote LLM and embedding
+        APIs are not called.
+        """
+        if self.has_index:
+            index = self.shards.shards[0].vectorstore.index if self.shards is not None else self.vectorstore.index
+            vector = np.ones(index.d, dtype=np.float32) / np.sqrt(index.d)
+            self._search_by_vectors([vector], 1)
+        if self.bm25 is not None:
+            self.bm25.search("warmup", 1)
+        self.reranker.predict([["warmup", "warmup"]])
+        if isinstance(self.embeddings, LocalEmbeddings):
+            self.embeddings.embed_query("warmup")
+
+    def set_search_params(self, ef_search=None, nprobe=None):
+        """Tunes this engine's ANN search (HNSW efSearch, IVF nprobe) without rebuilding."""
+        if self.shards is not None:
+            self.shards.set_search_params(ef_search=ef_search, nprobe=nprobe)
+            metrics.log("index", sharded=self.shards.describe())
+            return
+        ann.set_search_params(self.vectorstore.index, ef_search=ef_search, nprobe=nprobe)
+        metrics.log("index", faiss=ann.describe(self.vectorstore.index))
+
+    @property
+    def has_index(self):
+        return self.vectorstore is not None or self.shards is not None
+
+    @property
+    def index_version(self):
+        """Changes whenever the index is rebuilt or incrementally updated."""
+        if self.shards is not None:
+            return self.shards.version
+        return self.index_manager.index_version if self.index_manager else None
+
+    def metadata_index(self):
+        """Theme/tag/date index over the current FAISS positions, rebuilt when they change."""
+        with self._metadata_lock:
+            version = self.index_manager.layout_version
+            if self._metadata_index is None or self._metadata_version != version:
+                start = time.perf_counter()
+                self._metadata_index = MetadataIndex.build(self.vectorstore)
+                self._metadata_version = version
+                metrics.log("metadata_index", **self._metadata_index.stats(),
+                            seconds=round(time.perf_counter() - start, 4))
+            return self._metadata_index
+
+    def _embed_batch(self, queries):
+        """Query vectors for one micro-batch; repeated queries are embedded once."""
+        unique = list(dict.fromkeys(queries))
+        computed = dict(zip(unique, embed_query_batch(self.embeddings, unique)))
+        return [computed[q] for q in queries]
+
+    def embed_query(self, query):
+        """Query embedding through the LRU cache shared by both hops."""
+        if self.query_batcher is not None:
+            return self.query_cache.get_or_embed(query, lambda q: self.query_batcher([q])[0])
+        return self.query_cache.get_or_embed(query, self.embeddings.embed_query)
+
+    async def aembed_query(self, query):
+        vector = self.query_cache.get(query)
+        if vector is None:
+            if self.query_batcher is not None:
+                vector = (await self.query_batcher.acall([query]))[0]
+            else:
+                vector = await self.embeddings.aembed_query(query)
+            self.query_cache.put(query, vector)
+        return vector
+
+    async def _ahop2_docs(self, query, k, filters=None):
+        vector = None
+        if self.hop2_retriever != "bm25":
+            with metrics.stage("hop2_embed"):
+                vector = await self.aembed_query(query)
+        with metrics.stage("hop2_search"):
+            candidates = await asyncio.to_thread(self._hop2_candidates, query, vector, k, None, filters)
+        metrics.count("hop2_search", candidates=len(candidates))
+        return [doc for doc, _ in candidates]
 
-        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+    def _live_search_kwargs(self, k):
+        """Search kwargs that skip chunks tombstoned by incremental updates."""
+        live_filter = self.index_manager.live_filter()
+        if live_filter is None:
+            return {"k": k}
+        return {"k": k, "filter": live_filter, "fetch_k": k + len(self.index_manager.manifest["tombstones"])}
 
-    def initial_retrieval(self, query, top_k=3):
-        """Hop 1: Rough retrieval."""
-        if not self.vectorstore:
+    def _filtered_search_by_vectors(self, vectors, k, filters):
+        """
+        (doc, distance) pairs per query vector among live chunks matching `filters`.
+        The metadata mask is applied inside the FAISS search, so every query gets its
+        k best matching chunks without over-fetching. Sharded indexes fan out instead.
+        Callers hold index_lock.
+        """
+        if self.shards is not None:
+            return self.shards.search(vectors, k, filters)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self.vectorstore._normalize_L2:
+            faiss.normalize_L2(matrix)
+        mask = self.metadata_index().mask(filters)
+        distances, positions = ann.filtered_search(self.vectorstore.index, matrix, k, mask)
+        docstore, id_map = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        return [
+            [(docstore.search(id_map[i]), float(d)) for d, i in zip(row_distances, row) if i != -1]
+            for row_distances, row in zip(distances, positions)
+        ]
+
+    def _search_by_vector(self, vector, k, filters=None):
+        with self.index_lock.shared():
+            if filters or self.shards is not None:
+                return [doc for doc, _ in self._filtered_search_by_vectors([vector], k, filters)[0]]
+            return self.vectorstore.similarity_search_by_vector(vector, **self._live_search_kwargs(k))
+
+    def _search_with_relevance_by_vector(self, vector, k, filters=None):
+        """(doc, relevance) pairs, relevance normalised so that higher is better."""
+        with self.index_lock.shared():
+            if filters or self.shards is not None:
+                pairs = self._filtered_search_by_vectors([vector], k, filters)[0]
+            else:
+                pairs = self.vectorstore.similarity_search_with_score_by_vector(vector, **self._live_search_kwargs(k))
+            if self.shards is not None:
+                relevance = self.shards.relevance_score_fn()
+            else:
+                relevance = self.vectorstore._select_relevance_score_fn()
+            return [(doc, relevance(score)) for doc, score in pairs]
+
+    def embed_queries(self, queries):
+        """Embeds many queries in one request, reusing cached vectors."""
+        vectors = [self.query_cache.get(q) for q in queries]
+        missing = list(dict.fromkeys(q for q, v in zip(queries, vectors) if v is None))
+        if missing:
+            if self.query_batcher is not None:
+                computed = self.query_batcher(missing)
+            else:
+                computed = embed_query_batch(self.embeddings, missing)
+            computed = dict(zip(missing, computed))
+            for q, v in computed.items():
+                self.query_cache.put(q, v)
+            vectors = [v if v is not None else computed[q] for q, v in zip(queries, vectors)]
+        return vectors
+
+    def _bm25_search(self, query, k, filters=None):
+        """(doc, BM25 score) pairs from the local lexical index. No network call."""
+        with self.index_lock.shared():
+            looked_up = {}
+
+            def accept(doc_id):
+                doc = looked_up[doc_id] = self.vectorstore.docstore.search(doc_id)
+                return not isinstance(doc, str) and matches(doc.metadata, filters)
+
+            results = []
+            for doc_id, score in self.bm25.search(query, k, accept if filters else None):
+                doc = looked_up.get(doc_id) or self.vectorstore.docstore.search(doc_id)
+                if isinstance(doc, str):
+                    # Removed from the docstore by compaction.
+                    continue
+                results.append((doc, score))
+            return results
+
+    def _hop2_candidates(self, query, vector, k, retriever=None, filters=None):
+        """
+        (doc, relevance) candidates for reranking, relevance higher-is-better and at most 1.
+        "hybrid" fuses the dense and BM25 rankings with reciprocal rank fusion.
+        """
+        retriever = retriever or self.hop2_retriever
+        if retriever == "dense":
+            return self._search_with_relevance_by_vector(vector, k, filters)
+        lexical = self._bm25_search(query, k, filters)
+        if retriever == "bm25":
+            ranked = lexical
+        else:
+            dense = self._search_with_relevance_by_vector(vector, k, filters)
+            ranked = reciprocal_rank_fusion(
+                [[d for d, _ in dense], [d for d, _ in lexical]], key=utils.doc_key
+            )[:k]
+        if not ranked:
             return []
-        
-        docs = self.vectorstore.similarity_search(query, k=top_k)
+        best = ranked[0][1] or 1.0
+        return [(doc, score / best) for doc, score in ranked]
+
+    def _search_by_vectors(self, vectors, k, filters=None):
+        """Batched _search_by_vector: one FAISS call for a matrix of query vectors."""
+        with self.index_lock.shared():
+            if filters or self.shards is not None:
+                return [[doc for doc, _ in pairs] for pairs in self._filtered_search_by_vectors(vectors, k, filters)]
+            live_filter = self.index_manager.live_filter()
+            fetch_k = k + len(self.index_manager.manifest["tombstones"]) if live_filter else k
+            matrix = np.asarray(vectors, dtype=np.float32)
+            if self.vectorstore._normalize_L2:
+                faiss.normalize_L2(matrix)
+            _, positions = self.vectorstore.index.search(matrix, fetch_k)
+
+            results = []
+            for row in positions:
+                docs = []
+                for i in row:
+                    if i == -1:
+                        continue
+                    doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[i])
+                    if live_filter is not None and not live_filter(doc.metadata):
+                        continue
+                    docs.append(doc)
+                    if len(docs) == k:
+                        break
+                results.append(docs)
+            return results
+
+    def initial_retrieval(self, query, top_k=3, retriever=None, filters=None):
+        """Hop 1: Rough retrieval, optionally restricted by metadata `filters` (see metadata_index)."""
+        if not self.has_index:
+            return []
+
+        filters = parse_filters(filters)
+        if (retriever or self.hop1_retriever) == "bm25":
+            with metrics.stage("hop1_search"):
+                docs = [doc for doc, _ in self._bm25_search(query, top_k, filters)]
+        else:
+            with metrics.stage("hop1_embed"):
+                vector = self.embed_query(query)
+            with metrics.stage("hop1_search"):
+                docs = self._search_by_vector(vector, top_k, filters)
+        metrics.count("hop1_search", docs=len(docs))
         return docs
 
-    def reformulate_query(self, original_query, context_docs):
-        """Uses LLM to reformulate query based on retrieved docs."""
-        if not context_docs:
-            return original_query
-            
+    def _route_llm(self, route):
+        """The LLM for one prompt; the router keeps latencies and hedge delays per route."""
+        if isinstance(self.llm, LLMRouter):
+            return self.llm.route(route)
+        return self.llm
+
+    def _reformulation_chain(self, original_query, context_docs):
         context_text = utils.format_docs_with_metadata(context_docs)
         
         template = """
@@ -87,41 +435,97 @@ class RAGEngine:
             template=template
         )
         
-        chain = prompt | self.llm
-        response = chain.invoke({
+        chain = prompt | self._route_llm("reformulate")
+        return chain, {
             "context_text": context_text,
             "original_query": original_query
-        })
-        
-        import re
-        content = response.content
-        cleaned_content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL).strip()
-        
-        return cleaned_content
+        }
 
-    def final_retrieval_and_rerank(self, formulated_query, top_k_initial=15, top_k_final=8):
-        """Hop 2: Retrieve with new query and Rerank."""
-        if not self.vectorstore:
-            return []
+    def reformulate_query(self, original_query, context_docs):
+        """Uses LLM to reformulate query based on retrieved docs."""
+        if not context_docs:
+            return original_query
+            
+        chain, inputs = self._reformulation_chain(original_query, context_docs)
+        with metrics.stage("reformulate"):
+            response = chain.invoke(inputs)
+        metrics.record_llm("reformulate", response, chain.first.format(**inputs))
+        return utils.strip_think(response.content)
 
-        docs = self.vectorstore.similarity_search(formulated_query, k=top_k_initial)
-        
+    async def areformulate_query(self, original_query, context_docs):
+        if not context_docs:
+            return original_query
+
+        chain, inputs = self._reformulation_chain(original_query, context_docs)
+        with metrics.stage("reformulate"):
+            response = await chain.ainvoke(inputs)
+        metrics.record_llm("reformulate", response, chain.first.format(**inputs))
+        return utils.strip_think(response.content)
+
+    def rerank_scores(self, query, docs):
+        """Cross-encoder relevance scores for (query, doc) pairs."""
         if not docs:
             return []
+        pairs = [[query, d.page_content] for d in docs]
+        return list(self.reranker.predict(pairs))
 
-        doc_texts = [d.page_content for d in docs]
-        pairs = [[formulated_query, text] for text in doc_texts]
-        
-        scores = self.reranker.predict(pairs)
-        
-        doc_score_pairs = list(zip(docs, scores))
-        doc_score_pairs.sort(key=lambda x: x[1], reverse=True)
-        
-        return [p[0] for p in doc_score_pairs[:top_k_final]]
+    def final_retrieval_and_rerank(self, formulated_query, top_k_initial=15, top_k_final=8, filters=None):
+        """Hop 2: Retrieve with new query and Rerank."""
+        return self.rerank_candidates(formulated_query, top_k_initial, top_k_final, filters=filters)[0]
 
-    def generate_answer(self, query, final_docs):
-        """Generates the final answer."""
-        context_text = utils.format_docs_with_metadata(final_docs)
+    def rerank_candidates(self, formulated_query, top_k_initial=15, top_k_final=8, cascade=None, retriever=None,
+                          filters=None):
+        """Hop 2 returning (final docs, rerank stats), including the number of pairs scored."""
+        if not self.has_index:
+            return [], {"mode": "none", "candidates": 0, "pairs_scored": 0}
+        retriever = retriever or self.hop2_retriever
+        vector = None
+        if retriever != "bm25":
+            with metrics.stage("hop2_embed"):
+                vector = self.embed_query(formulated_query)
+        return self._rerank_by_vector(
+            formulated_query, vector, top_k_initial, top_k_final, cascade, retriever, parse_filters(filters)
+        )
+
+    def _rerank_by_vector(self, query, vector, top_k_initial, top_k_final, cascade=None, retriever=None,
+                          filters=None):
+        cascade = config.RERANK_CASCADE if cascade is None else cascade
+        retriever = retriever or self.hop2_retriever
+        start = time.perf_counter()
+        if cascade:
+            with metrics.stage("hop2_search"):
+                candidates = self._hop2_candidates(
+                    query, vector, max(top_k_initial, config.CASCADE_MAX_DEPTH), retriever, filters
+                )
+            with metrics.stage("rerank"):
+                final_docs, stats = cascade_rerank(self.reranker, query, candidates, top_k_final)
+        else:
+            with metrics.stage("hop2_search"):
+                docs = [doc for doc, _ in self._hop2_candidates(query, vector, top_k_initial, retriever, filters)]
+            with metrics.stage("rerank"):
+                scores = self.rerank_scores(query, docs)
+
+            doc_score_pairs = list(zip(docs, scores))
+            doc_score_pairs.sort(key=lambda x: x[1], reverse=True)
+
+            final_docs = [p[0] for p in doc_score_pairs[:top_k_final]]
+            stats = {"mode": "full", "candidates": len(docs), "pairs_scored": len(docs)}
+        stats["retriever"] = retriever
+        stats["seconds"] = round(time.perf_counter() - start, 4)
+        metrics.count("hop2_search", candidates=stats["candidates"])
+        metrics.count("rerank", pairs_scored=stats["pairs_scored"], docs=len(final_docs))
+        metrics.log("rerank", **stats)
+        return final_docs, stats
+
+    def _answer_chain(self, query, final_docs):
+        if config.CONTEXT_ASSEMBLY:
+            with metrics.stage("context"):
+                context_text, stats = assemble_context(query, final_docs)
+            metrics.count("context", tokens_before=stats["tokens_before"], tokens_after=stats["tokens_after"],
+                          tokens_saved=stats["tokens_saved"], sentences_dropped=stats["sentences_dropped"])
+            metrics.log("context", **stats)
+        else:
+            context_text = utils.format_docs_with_metadata(final_docs)
         
         template = """
         Role: Asisten Hukum AI yang Deskriptif dan Tuntas.
@@ -144,68 +548,434 @@ class RAGEngine:
             template=template
         )
         
-        chain = prompt | self.llm
-        response = chain.invoke({
+        chain = prompt | self._route_llm("generate")
+        return chain, {
             "context_text": context_text,
             "query": query
-        })
-        
-        import re
-        content = response.content
-        cleaned_content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL).strip()
-        
-        return cleaned_content
+        }
+
+    def generate_answer(self, query, final_docs):
+        """Generates the final answer."""
+        chain, inputs = self._answer_chain(query, final_docs)
+        with metrics.stage("generate"):
+            response = chain.invoke(inputs)
+        metrics.record_llm("generate", response, chain.first.format(**inputs))
+        return utils.strip_think(response.content)
+
+    async def agenerate_answer(self, query, final_docs):
+        chain, inputs = self._answer_chain(query, final_docs)
+        with metrics.stage("generate"):
+            response = await chain.ainvoke(inputs)
+        metrics.record_llm("generate", response, chain.first.format(**inputs))
+        return utils.strip_think(response.content)
+
+    def _cached_result(self, user_query, query_vector, start_time, filters=None):
+        """Returns the cached result for a semantically equivalent query, if any."""
+        if self.answer_cache is None or filters:
+            return None
+        cached, similarity = self.answer_cache.lookup(query_vector, self.index_version)
+        if cached is None:
+            return None
+        execution_time = round(time.time() - start_time, 2)
+        metrics.log("answer_cache_hit", similarity=round(similarity, 4), seconds=execution_time)
+        trace = metrics.current()
+        if trace is not None:
+            trace.cache = "hit"
+        return {
+            **cached,
+            "original_query": user_query,
+            "execution_time": execution_time,
+            "rerank": {"mode": "cache", "candidates": 0, "pairs_scored": 0},
+            "cache": {"hit": True, "similarity": round(similarity, 4), **self.answer_cache.stats()}
+        }
+
+    def _build_result(self, user_query, query_vector, new_query, final_docs, answer, start_time, rerank_stats=None,
+                      filters=None):
+        execution_time = round(time.time() - start_time, 2)
+        metrics.log("pipeline_finished", seconds=execution_time, query_cache=self.query_cache.stats())
+
+        with metrics.stage("references"):
+            references = utils.extract_references(final_docs)
+        result = {
+            "original_query": user_query,
+            "reformulated_query": new_query,
+            "final_docs": final_docs,
+            "answer": answer,
+            "references": references,
+            "execution_time": execution_time
+        }
+        if rerank_stats is not None:
+            result["rerank"] = rerank_stats
+        if filters:
+            result["filters"] = filters
+        if self.answer_cache is not None:
+            # Entries are matched on the query alone, so filtered answers are not stored.
+            if not filters:
+                self.answer_cache.store(query_vector, result, self.index_version)
+            result = {**result, "cache": {"hit": False, **self.answer_cache.stats()}}
+        return result
+
+    def process_query(self, user_query, filters=None):
+        """
+        Pipeline execution. `filters` restricts both hops by theme, tags and publish date.
+        The result's "metrics" holds per-stage timings, item counts and LLM token usage.
+        """
+        with metrics.trace("process_query") as trace:
+            result = self._process_query(user_query, filters)
+            result["metrics"] = trace.summary()
+        return result
 
-    def process_query(self, user_query):
-        """Pipeline execution."""
+    def _process_query(self, user_query, filters=None):
         start_time = time.time()
+        filters = parse_filters(filters)
+
+        # 0. Semantic answer cache
+        query_vector = None
+        if self.answer_cache is not None:
+            with metrics.stage("embed_query"):
+                query_vector = self.embed_query(user_query)
+            cached = self._cached_result(user_query, query_vector, start_time, filters)
+            if cached is not None:
+                return cached
         
         # 1. Hop 1
-        print("--- Hop 1: Initial Retrieval ---")
-        initial_docs = self.initial_retrieval(user_query)
-        print(f"DEBUG: Found {len(initial_docs)} docs in Hop 1")
+        initial_docs = self.initial_retrieval(user_query, filters=filters)
         
         # 2. Reformulate
-        print("--- Reformulating Query ---")
         new_query = self.reformulate_query(user_query, initial_docs)
-        print(f"DEBUG: Reformulated Query: {new_query}")
         
         # 3. Hop 2 & Rerank
-        print("--- Hop 2: Final Retrieval & Rerank ---")
-        final_docs = self.final_retrieval_and_rerank(new_query)
-        print(f"DEBUG: Found {len(final_docs)} final docs")
-        for i, d in enumerate(final_docs[:3]):
-            print(f"DEBUG: Top Doc {i+1}: {d.metadata.get('title', 'No Title')}")
+        final_docs, rerank_stats = self.rerank_candidates(new_query, filters=filters)
+        metrics.log("retrieved", hop1_docs=len(initial_docs), final_docs=len(final_docs),
+                    top_titles=[d.metadata.get('title', 'No Title') for d in final_docs[:3]])
         
         # 4. Generate
-        print("--- Generating Answer ---")
         answer = self.generate_answer(user_query, final_docs)
         
         # 5. Extract References (Deduplicated)
-        references = []
-        seen_urls = set()
-        for d in final_docs:
-            url = d.metadata.get("link", "#")
-            if url in seen_urls:
-                continue
-            seen_urls.add(url)
-            
-            ref = {
-                "title": d.metadata.get("title", "Unknown Title"),
-                "url": url,
-                "publish_date": d.metadata.get("publish_date", "Unknown Date"),
-                "theme": d.metadata.get("theme", "General")
-            }
-            references.append(ref)
+        return self._build_result(
+            user_query, query_vector, new_query, final_docs, answer, start_time, rerank_stats, filters
+        )
 
-        execution_time = round(time.time() - start_time, 2)
-        print(f"--- Pipeline Finished in {execution_time}s ---")
+    def process_queries(self, user_queries, max_concurrency=None, top_k_initial=15, top_k_final=8, filters=None):
+        """
+        Batch version of process_query for offline jobs and evaluation.
 
-        return {
+        Query embeddings are requested in one call per hop, FAISS is searched once
+        with the whole query matrix, all (query, chunk) pairs go through the
+        cross-encoder together (with config.RERANK_CASCADE, each query is cascade-reranked
+        on its own instead), and LLM calls fan out with at most `max_concurrency`
+        in flight. Returns one result per query, in order, shaped like process_query;
+        a query whose LLM call fails gets {"original_query", "error"} instead.
+        `filters` applies to every query in the batch. Stages are timed per batch, so
+        every result carries the same batch-level "metrics".
+        """
+        with metrics.trace("process_queries") as trace:
+            results = self._process_queries(user_queries, max_concurrency, top_k_initial, top_k_final, filters)
+            summary = trace.summary()
+        for result in results:
+            result["metrics"] = summary
+        return results
+
+    def _process_queries(self, user_queries, max_concurrency=None, top_k_initial=15, top_k_final=8, filters=None):
+        filters = parse_filters(filters)
+        max_concurrency = max_concurrency or config.BATCH_LLM_CONCURRENCY
+        llm_config = {"max_concurrency": max_concurrency}
+        start_time = time.time()
+        results = [None] * len(user_queries)
+
+        # Needed by the answer cache and dense hop 1 only; a BM25 hop 1 makes no network call.
+        query_vectors = [None] * len(user_queries)
+        if self.answer_cache is not None or self.hop1_retriever != "bm25":
+            with metrics.stage("hop1_embed"):
+                query_vectors = self.embed_queries(user_queries)
+        pending = []
+        for i, (query, vector) in enumerate(zip(user_queries, query_vectors)):
+            cached = self._cached_result(query, vector, start_time, filters)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+
+        # 1. Hop 1 for every query in one matrix search
+        metrics.log("batch_hop1", queries=len(pending))
+        if self.has_index and self.hop1_retriever == "bm25":
+            hop1 = [self.initial_retrieval(user_queries[i], filters=filters) for i in pending]
+        elif self.has_index:
+            with metrics.stage("hop1_search"):
+                hop1 = self._search_by_vectors([query_vectors[i] for i in pending], 3, filters)
+            metrics.count("hop1_search", docs=sum(len(docs) for docs in hop1))
+        else:
+            hop1 = [[] for _ in pending]
+
+        # 2. Reformulate with bounded LLM concurrency
+        new_queries = {i: user_queries[i] for i, docs in zip(pending, hop1) if not docs}
+        to_reformulate = [(i, docs) for i, docs in zip(pending, hop1) if docs]
+        if to_reformulate:
+            chains = [self._reformulation_chain(user_queries[i], docs) for i, docs in to_reformulate]
+            with metrics.stage("reformulate"):
+                responses = chains[0][0].batch([inputs for _, inputs in chains], config=llm_config, return_exceptions=True)
+            for (i, _), (chain, inputs), response in zip(to_reformulate, chains, responses):
+                if isinstance(response, Exception):
+                    results[i] = {"original_query": user_queries[i], "error": str(response)}
+                else:
+                    metrics.record_llm("reformulate", response, chain.first.format(**inputs))
+                    new_queries[i] = utils.strip_think(response.content)
+        active = [i for i in pending if results[i] is None]
+
+        # 3. Hop 2: one embedding request, one matrix search, one reranker pass
+        metrics.log("batch_hop2", queries=len(active))
+        final_docs = {i: [] for i in active}
+        rerank_stats = {i: {"mode": "full", "candidates": 0, "pairs_scored": 0} for i in active}
+        if self.has_index and active:
+            if self.hop2_retriever == "bm25":
+                hop2_vectors = [None] * len(active)
+            else:
+                with metrics.stage("hop2_embed"):
+                    hop2_vectors = self.embed_queries([new_queries[i] for i in active])
+            if config.RERANK_CASCADE:
+                # The cascade decides per query how many pairs to score, so each query takes
+                # the single-query hop 2 and gets exactly process_query's ranking.
+                for i, vector in zip(active, hop2_vectors):
+                    final_docs[i], rerank_stats[i] = self._rerank_by_vector(
+                        new_queries[i], vector, top_k_initial, top_k_final, True, None, filters
+                    )
+            else:
+                with metrics.stage("hop2_search"):
+                    if self.hop2_retriever == "dense":
+                        candidates = self._search_by_vectors(hop2_vectors, top_k_initial, filters)
+                    else:
+                        candidates = [
+                            [d for d, _ in self._hop2_candidates(
+                                new_queries[i], vector, top_k_initial, filters=filters
+                            )]
+                            for i, vector in zip(active, hop2_vectors)
+                        ]
+                pairs = [[new_queries[i], d.page_content] for i, docs in zip(active, candidates) for d in docs]
+                with metrics.stage("rerank"):
+                    scores = list(self.reranker.predict(pairs)) if pairs else []
+                metrics.count("hop2_search", candidates=len(pairs))
+                metrics.count("rerank", pairs_scored=len(pairs))
+                offset = 0
+                for i, docs in zip(active, candidates):
+                    doc_score_pairs = list(zip(docs, scores[offset:offset + len(docs)]))
+                    offset += len(docs)
+                    doc_score_pairs.sort(key=lambda x: x[1], reverse=True)
+                    final_docs[i] = [p[0] for p in doc_score_pairs[:top_k_final]]
+                    rerank_stats[i] = {
+                        "mode": "full", "candidates": len(docs), "pairs_scored": len(docs),
+                        "retriever": self.hop2_retriever
+                    }
+
+        # 4. Generate with bounded LLM concurrency
+        if active:
+            chains = [self._answer_chain(user_queries[i], final_docs[i]) for i in active]
+            with metrics.stage("generate"):
+                responses = chains[0][0].batch([inputs for _, inputs in chains], config=llm_config, return_exceptions=True)
+            for i, (chain, inputs), response in zip(active, chains, responses):
+                if isinstance(response, Exception):
+                    results[i] = {"original_query": user_queries[i], "error": str(response)}
+                    continue
+                metrics.record_llm("generate", response, chain.first.format(**inputs))
+                answer = utils.strip_think(response.content)
+                results[i] = self._build_result(
+                    user_queries[i], query_vectors[i], new_queries[i], final_docs[i], answer, start_time,
+                    rerank_stats[i], filters
+                )
+        return results
+
+    def stream_query(self, user_query, filters=None):
+        """
+        Streaming variant of process_query. Yields event dicts in order:
+        "reformulated_query", "references", then "token" events carrying answer text
+        (with <think> blocks filtered out incrementally), and a final "done" event
+        that also carries the request's "metrics".
+        """
+        trace = metrics.Trace("stream_query")
+        try:
+            yield from self._stream_query(user_query, filters, trace)
+        except GeneratorExit:
+            if trace.outcome is None:
+                trace.finish("cancelled")
+            raise
+        except BaseException:
+            trace.finish("error")
+            raise
+
+    def _stream_query(self, user_query, filters, trace):
+        # The trace is only made current between yields: a context set inside a
+        # generator would leak into the consumer while it is suspended.
+        start_time = time.time()
+        filters = parse_filters(filters)
+
+        query_vector = None
+        if self.answer_cache is not None:
+            with metrics.activate(trace):
+                with metrics.stage("embed_query"):
+                    query_vector = self.embed_query(user_query)
+                cached = self._cached_result(user_query, query_vector, start_time, filters)
+            if cached is not None:
+                yield {"event": "reformulated_query", "data": {
+                    "original_query": user_query,
+                    "reformulated_query": cached["reformulated_query"]
+                }}
+                yield {"event": "references", "data": cached["references"]}
+                yield {"event": "token", "data": cached["answer"]}
+                yield {"event": "done", "data": {
+                    "execution_time": cached["execution_time"],
+                    "rerank": cached["rerank"],
+                    "cache": cached["cache"],
+                    "metrics": trace.finish("ok")
+                }}
+                return
+
+        with metrics.activate(trace):
+            initial_docs = self.initial_retrieval(user_query, filters=filters)
+            new_query = self.reformulate_query(user_query, initial_docs)
+        yield {"event": "reformulated_query", "data": {
             "original_query": user_query,
-            "reformulated_query": new_query,
-            "final_docs": final_docs,
-            "answer": answer,
-            "references": references,
-            "execution_time": execution_time
-        }
+            "reformulated_query": new_query
+        }}
+
+        with metrics.activate(trace):
+            final_docs, rerank_stats = self.rerank_candidates(new_query, filters=filters)
+        yield {"event": "references", "data": utils.extract_references(final_docs)}
+
+        with metrics.activate(trace):
+            chain, inputs = self._answer_chain(user_query, final_docs)
+        think_filter = utils.ThinkFilter()
+        parts = []
+        message = None
+        generate_start = time.perf_counter()
+        for chunk in chain.stream(inputs):
+            message = chunk if message is None else message + chunk
+            text = think_filter.feed(chunk.content)
+            if text:
+                parts.append(text)
+                yield {"event": "token", "data": text}
+        tail = think_filter.flush()
+        if tail:
+            parts.append(tail)
+            yield {"event": "token", "data": tail}
+
+        with metrics.activate(trace):
+            # Wall time of the stream, including the time the consumer took per token.
+            metrics.observe("generate", time.perf_counter() - generate_start)
+            if message is not None:
+                metrics.record_llm("generate", message, chain.first.format(**inputs))
+            answer = "".join(parts).strip()
+            result = self._build_result(
+                user_query, query_vector, new_query, final_docs, answer, start_time, rerank_stats, filters
+            )
+        done = {"execution_time": result["execution_time"], "rerank": rerank_stats}
+        if "cache" in result:
+            done["cache"] = result["cache"]
+        done["metrics"] = trace.finish("ok")
+        yield {"event": "done", "data": done}
+
+    async def process_query_async(self, user_query, overlap=None, top_k_initial=15, top_k_final=8, filters=None):
+        """
+        Asyncio version of process_query with per-stage timings.
+
+        With `overlap` (default config.ASYNC_OVERLAP), hop 1 fetches the full hop-2 depth
+        and reranks it against the original query on a worker thread while the
+        reformulation LLM call is in flight. The best config.ASYNC_OVERLAP_KEEP of those
+        join the hop-2 candidates, and only that merged set is reranked against the
+        reformulated query, so the result differs from process_query only by the kept
+        hop-1 documents that hop 2 did not retrieve.
+
+        "timings" holds the wall time of each awaited step; "metrics" holds the pipeline
+        stages as process_query reports them. Overlapping stages may sum to more than
+        the total.
+        """
+        with metrics.trace("process_query_async") as trace:
+            result = await self._process_query_async(user_query, overlap, top_k_initial, top_k_final, filters)
+            result["metrics"] = trace.summary()
+        return result
+
+    async def _process_query_async(self, user_query, overlap=None, top_k_initial=15, top_k_final=8, filters=None):
+        overlap = config.ASYNC_OVERLAP if overlap is None else overlap
+        filters = parse_filters(filters)
+        start_time = time.time()
+        timings = {}
+
+        async def timed(stage, awaitable, metric=None):
+            # `metric` names the pipeline stage for calls that do not record one themselves.
+            stage_start = time.perf_counter()
+            try:
+                return await awaitable
+            finally:
+                seconds = time.perf_counter() - stage_start
+                timings[stage] = round(seconds, 4)
+                if metric:
+                    metrics.observe(metric, seconds)
+
+        query_vector = None
+        if self.answer_cache is not None or self.hop1_retriever != "bm25":
+            query_vector = await timed("embed_query", self.aembed_query(user_query), "embed_query")
+        if self.answer_cache is not None:
+            cached = self._cached_result(user_query, query_vector, start_time, filters)
+            if cached is not None:
+                return {**cached, "timings": timings}
+
+        if not self.has_index:
+            hop1_docs = []
+        else:
+            hop1_k = top_k_initial if overlap else 3
+            if self.hop1_retriever == "bm25":
+                hop1_docs = await timed("hop1", asyncio.to_thread(
+                    self.initial_retrieval, user_query, hop1_k, None, filters
+                ))
+            else:
+                hop1_docs = await timed("hop1", asyncio.to_thread(
+                    self._search_by_vector, query_vector, hop1_k, filters
+                ), "hop1_search")
+                metrics.count("hop1_search", docs=len(hop1_docs))
+        initial_docs = hop1_docs[:3]
+
+        if overlap and hop1_docs:
+            new_query, hop1_scores = await asyncio.gather(
+                timed("reformulate", self.areformulate_query(user_query, initial_docs)),
+                timed("rerank_hop1", asyncio.to_thread(self.rerank_scores, user_query, hop1_docs), "rerank")
+            )
+        else:
+            new_query = await timed("reformulate", self.areformulate_query(user_query, initial_docs))
+            hop1_scores = []
+
+        if not self.has_index:
+            final_docs = []
+            rerank_stats = {"mode": "none", "candidates": 0, "pairs_scored": 0}
+        elif overlap:
+            hop2_docs = await timed("hop2", self._ahop2_docs(new_query, top_k_initial, filters))
+            # Merge policy: every hop-2 candidate plus the hop-1 documents that scored best
+            # against the original query; only this set is scored against new_query.
+            ranked_hop1 = [d for d, _ in sorted(zip(hop1_docs, hop1_scores), key=lambda x: x[1], reverse=True)]
+            seen = {utils.doc_key(d) for d in hop2_docs}
+            kept = [d for d in ranked_hop1[:config.ASYNC_OVERLAP_KEEP] if utils.doc_key(d) not in seen]
+            candidates = hop2_docs + kept
+            scores = await timed("rerank", asyncio.to_thread(self.rerank_scores, new_query, candidates), "rerank")
+            order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+            final_docs = [candidates[i] for i in order[:top_k_final]]
+            pairs_scored = len(hop1_docs) + len(candidates)
+            metrics.count("rerank", pairs_scored=pairs_scored, docs=len(final_docs))
+            rerank_stats = {
+                "mode": "overlap", "candidates": len(candidates), "hop1_kept": len(kept),
+                "pairs_scored": pairs_scored, "retriever": self.hop2_retriever
+            }
+        else:
+            hop2_vector = None
+            if self.hop2_retriever != "bm25":
+                hop2_vector = await timed("hop2", self.aembed_query(new_query), "hop2_embed")
+            final_docs, rerank_stats = await timed("rerank", asyncio.to_thread(
+                self._rerank_by_vector, new_query, hop2_vector, top_k_initial, top_k_final, None, None, filters
+            ))
+
+        answer = await timed("generate", self.agenerate_answer(user_query, final_docs))
+
+        result = self._build_result(
+            user_query, query_vector, new_query, final_docs, answer, start_time, rerank_stats, filters
+        )
+        result["timings"] = timings
+        return result
@@ -0,0 +1,195 @@
+import random
+import re
+import threading
+import time
+
+class RateLimitError(Exception):
+    """Raised (or recognised) when a remote API rejects a call with HTTP 429."""
+
+    def __init__(self, message="429 Too Many Requests", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+_RATE_LIMIT_MARKERS = ("429", "resource_exhausted", "resourceexhausted", "rate limit", "quota")
+# gRPC status names and message fragments of 5xx and timeout failures.
+_SERVER_STATUS_MARKERS = ("UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED")
+_SERVER_TEXT_MARKERS = ("timeout", "timed out", "deadline exceeded", "service unavailable",
+                        "internal server error", "bad gateway")
+# A 5xx code where messages put one: "503 ...", "status 502", "HTTP 500", "error code: 504".
+_SERVER_CODE = re.compile(r"(^|\b(status|code|http|error)\W{0,3})5\d\d\b", re.IGNORECASE)
+
+def error_chain(error):
+    """
+    `error` and the exceptions it wraps (`__cause__`, then `__context__`). SDK wrappers
+    such as LangChain's GoogleGenerativeAIError carry the real API error there.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+def _is_rate_limit(error):
+    if isinstance(error, RateLimitError):
+        return True
+    for attr in ("status_code", "code", "status"):
+        if getattr(error, attr, None) == 429:
+            return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RATE_LIMIT_MARKERS)
+
+def is_rate_limit_error(error):
+    return any(_is_rate_limit(e) for e in error_chain(error))
+
+def _is_server_failure(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    statuses = [getattr(error, attr, None) for attr in ("status_code", "code", "status")]
+    statuses.append(getattr(getattr(error, "response", None), "status_code", None))
+    if any(isinstance(status, int) and status >= 500 for status in statuses):
+        return True
+    name = type(error).__name__.lower()
+    if "timeout" in name or "connection" in name or "deadline" in name:
+        return True
+    message = str(error)
+    if any(marker in message for marker in _SERVER_STATUS_MARKERS):
+        return True
+    return bool(_SERVER_CODE.search(message)) or any(m in message.lower() for m in _SERVER_TEXT_MARKERS)
+
+def is_provider_failure(error):
+    """
+    Whether `error` says the provider is unhealthy (429, 5xx, timeout, connection
+    error) rather than that the request itself was bad. Wrapped errors are checked
+    down their cause chain, by status attributes and by message.
+    """
+    return is_rate_limit_error(error) or any(_is_server_failure(e) for e in error_chain(error))
+
+def retry_after_seconds(error):
+    """Server-requested wait from a RateLimitError or a Retry-After header, if any."""
+    for e in error_chain(error):
+        value = getattr(e, "retry_after", None)
+        if value is None:
+            response = getattr(e, "response", None)
+            headers = getattr(response, "headers", None) or {}
+            value = headers.get("Retry-After") or headers.get("retry-after")
+        if value is None:
+            continue
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Full-jitter exponential backoff for the given (0-based) retry attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """Blocks until `amount` tokens are available, then takes them."""
+        # A single request larger than the bucket would otherwise wait forever.
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            self._sleep(wait)
+
+    def set_rate(self, rate_per_minute, capacity=None):
+        """Changes the refill rate; the bucket keeps the tokens it has, up to the new capacity."""
+        with self._lock:
+            self._refill()
+            self.rate = rate_per_minute / 60.0
+            self.capacity = capacity if capacity is not None else rate_per_minute
+            self.tokens = min(self.tokens, self.capacity)
+
+    def drain(self, seconds):
+        """Empties the bucket and pauses refilling, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self.tokens = 0
+            self._updated = max(self._updated, self._clock()) + seconds
+
+class RateLimiter:
+    """Paces calls by requests/min and (optionally) tokens/min."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens=0):
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens and tokens:
+            self.tokens.acquire(tokens)
+
+class AdaptiveRateLimiter:
+    """
+    Request pacing that adapts to the server (AIMD): a 429 cuts the rate by
+    `decrease` and pauses the bucket for the Retry-After the server sent, and every
+    success raises it again by `increase` requests/min (default 5% of the maximum), up
+    to `requests_per_minute`.
+    A 429 for a request issued before the last cut says nothing about the new rate, so
+    concurrent requests rejected together cut it only once.
+    """
+
+    def __init__(self, requests_per_minute, min_per_minute=1.0, increase=None, decrease=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = float(requests_per_minute)
+        self.min_rate = min(float(min_per_minute), self.max_rate)
+        self.rate = self.max_rate
+        self.increase = increase or max(1.0, self.max_rate / 20)
+        self.decrease = decrease
+        # Capacity 1: no burst, so a cut takes effect on the very next request.
+        self.bucket = TokenBucket(self.rate, capacity=1, clock=clock, sleep=sleep)
+        self.rate_limited = 0
+        self._clock = clock
+        self._last_cut = None
+        self._lock = threading.Lock()
+
+    def acquire(self, requests=1):
+        """Waits for `requests` slots; returns the issue time to pass to on_rate_limit."""
+        for _ in range(requests):
+            self.bucket.acquire(1)
+        return self._clock()
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                self.bucket.set_rate(self.rate, capacity=1)
+
+    def on_rate_limit(self, retry_after=None, issued_at=None):
+        with self._lock:
+            self.rate_limited += 1
+            if self._last_cut is None or issued_at is None or issued_at >= self._last_cut:
+                self._last_cut = self._clock()
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.bucket.set_rate(self.rate, capacity=1)
+        if retry_after:
+            self.bucket.drain(retry_after)
+
+def estimate_tokens(text):
+    # Rough 4-characters-per-token heuristic; good enough for pacing.
+    return len(text) // 4 + 1
@@ -0,0 +1,226 @@
+"""
+Cross-encoder reranker backends.
+
+"torch" wraps sentence-transformers' CrossEncoder. "onnx" runs the same model
+through ONNX Runtime, by default with dynamic int8 weight quantization, which is
+markedly faster on CPU-only containers. Both expose `predict(pairs, batch_size=None)`
+returning one score per (query, passage) pair, like CrossEncoder.
+"""
+import os
+import re
+import numpy as np
+from . import config
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+_ACTIVATIONS = {"Sigmoid": _sigmoid, "Identity": None, "Tanh": np.tanh}
+
+def default_activation(model_config):
+    """
+    The activation CrossEncoder applies to this model's scores (None = raw logits).
+    sentence-transformers >= 4 stores it under config.sentence_transformers["activation_fn"],
+    older versions under sbert_ce_default_activation_function (ms-marco models declare
+    Identity); without either, single-label models get a sigmoid.
+    """
+    path = (getattr(model_config, "sentence_transformers", None) or {}).get("activation_fn")
+    if path is None:
+        path = getattr(model_config, "sbert_ce_default_activation_function", None)
+    if path is not None:
+        name = path.rsplit(".", 1)[-1]
+        # CrossEncoder also falls back to the default for activations it will not import.
+        if path.startswith("torch.") and name in _ACTIVATIONS:
+            return _ACTIVATIONS[name]
+    return _sigmoid if model_config.num_labels == 1 else None
+
+class TorchReranker:
+    def __init__(self, model_name=None, max_length=None, batch_size=None, num_threads=None):
+        from sentence_transformers import CrossEncoder
+
+        num_threads = config.RERANKER_THREADS if num_threads is None else num_threads
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        self.batch_size = batch_size or config.RERANK_BATCH_SIZE
+        self.model = CrossEncoder(
+            model_name or config.RERANKER_MODEL,
+            max_length=max_length or config.RERANKER_MAX_LENGTH
+        )
+
+    def predict(self, pairs, batch_size=None):
+        return self.model.predict(pairs, batch_size=batch_size or self.batch_size, show_progress_bar=False)
+
+class OnnxReranker:
+    def __init__(self, model_name=None, onnx_dir=None, quantize=None, max_length=None,
+                 batch_size=None, num_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        model_name = model_name or config.RERANKER_MODEL
+        onnx_dir = onnx_dir or config.RERANKER_ONNX_DIR
+        quantize = config.RERANKER_QUANTIZE if quantize is None else quantize
+        num_threads = config.RERANKER_THREADS if num_threads is None else num_threads
+        self.max_length = max_length or config.RERANKER_MAX_LENGTH
+        self.batch_size = batch_size or config.RERANK_BATCH_SIZE
+
+        path = os.path.join(onnx_dir, ONNX_INT8_FILE if quantize else ONNX_FILE)
+        if not os.path.exists(path):
+            print(f"ONNX reranker not found at {path}, exporting {model_name}...")
+            path = export_onnx(model_name, onnx_dir, quantize=quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        # The tokenizer is saved next to the exported model, so no hub access is needed later.
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        model_config = AutoConfig.from_pretrained(onnx_dir)
+        self._activation = default_activation(model_config)
+
+    def predict(self, pairs, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            encoded = self.tokenizer(
+                [q for q, _ in batch],
+                [p for _, p in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+            logits = self.session.run(None, feed)[0]
+            scores.append(logits[:, 0] if logits.ndim == 2 else logits)
+        if not scores:
+            return np.zeros(0, dtype=np.float32)
+        scores = np.concatenate(scores)
+        return self._activation(scores) if self._activation is not None else scores
+
+def export_onnx(model_name=None, onnx_dir=None, quantize=True):
+    """
+    Exports the cross-encoder to ONNX (needs torch and transformers once, at build
+    time) and optionally writes a dynamically int8-quantized copy. Returns the path
+    of the model to load.
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    model_name = model_name or config.RERANKER_MODEL
+    onnx_dir = onnx_dir or config.RERANKER_ONNX_DIR
+    os.makedirs(onnx_dir, exist_ok=True)
+    fp32_path = os.path.join(onnx_dir, ONNX_FILE)
+
+    if not os.path.exists(fp32_path):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        sample = tokenizer(["query"], ["passage"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["logits"] = {0: "batch"}
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+                # TorchScript exporter: handles dynamic_axes and needs no onnxscript.
+                dynamo=False
+            )
+        tokenizer.save_pretrained(onnx_dir)
+        model.config.save_pretrained(onnx_dir)
+
+    if not quantize:
+        return fp32_path
+
+    int8_path = os.path.join(onnx_dir, ONNX_INT8_FILE)
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+def build_reranker(backend=None, **kwargs):
+    backend = (backend or config.RERANKER_BACKEND).lower()
+    if backend == "onnx":
+        return OnnxReranker(**kwargs)
+    if backend == "torch":
+        return TorchReranker(**{k: v for k, v in kwargs.items() if k in ("model_name", "max_length", "batch_size", "num_threads")})
+    raise ValueError(f"Unknown RERANKER_BACKEND '{backend}'. Options: 'torch', 'onnx'.")
+
+def lexical_overlap(query, text):
+    """Share of the query's distinct terms that appear in `text`."""
+    terms = set(re.findall(r"\w+", query.lower()))
+    if not terms:
+        return 0.0
+    return len(terms & set(re.findall(r"\w+", text.lower()))) / len(terms)
+
+def cascade_rerank(reranker, query, candidates, top_k, min_depth=None, batch_size=None,
+                   patience=None, prune_margin=None, flat_margin=None, lexical_weight=None):
+    """
+    Cross-encodes only as many candidates as needed to settle the top `top_k`.
+
+    `candidates` are (doc, relevance) pairs from the first stage, higher is better.
+    They are ordered by relevance plus a lexical-overlap bonus, and anything more than
+    `prune_margin` below the best is dropped (keeping at least `top_k`). The first
+    `top_k` are scored in one batch, then `batch_size` at a time; scoring stops after
+    `patience` batches that leave the top-k set unchanged. Depth starts at `min_depth`
+    and only grows while the first-stage scores in the window are within `flat_margin`
+    of each other, i.e. while the cheap stage cannot tell the candidates apart.
+
+    Returns (top docs, stats).
+    """
+    min_depth = min_depth or config.CASCADE_MIN_DEPTH
+    batch_size = batch_size or config.CASCADE_BATCH_SIZE
+    patience = config.CASCADE_PATIENCE if patience is None else patience
+    prune_margin = config.CASCADE_PRUNE_MARGIN if prune_margin is None else prune_margin
+    flat_margin = config.CASCADE_FLAT_MARGIN if flat_margin is None else flat_margin
+    lexical_weight = config.CASCADE_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+
+    stats = {"mode": "cascade", "candidates": len(candidates), "pairs_scored": 0, "early_exit": False}
+    if not candidates:
+        return [], stats
+
+    ranked = sorted(
+        ((doc, relevance + lexical_weight * lexical_overlap(query, doc.page_content))
+         for doc, relevance in candidates),
+        key=lambda x: x[1], reverse=True
+    )
+    cutoff = ranked[0][1] - prune_margin
+    kept = [doc for i, (doc, cheap) in enumerate(ranked) if i < top_k or cheap >= cutoff]
+    cheap = [c for _, c in ranked[:len(kept)]]
+
+    depth = min(max(min_depth, top_k), len(kept))
+    scores = []
+    top = None
+    stable = 0
+    while len(scores) < depth:
+        size = top_k if not scores else batch_size
+        batch = kept[len(scores):min(len(scores) + size, depth)]
+        scores.extend(float(s) for s in reranker.predict([[query, d.page_content] for d in batch]))
+
+        new_top = frozenset(np.argsort(scores)[::-1][:top_k].tolist())
+        stable = stable + 1 if new_top == top else 0
+        top = new_top
+        if len(scores) == depth and depth < len(kept) and cheap[0] - cheap[depth - 1] < flat_margin:
+            depth = min(depth + batch_size, len(kept))
+        if patience and stable >= patience and len(scores) < depth:
+            stats["early_exit"] = True
+            break
+
+    stats.update({"pruned": len(candidates) - len(kept), "depth": depth, "pairs_scored": len(scores)})
+    order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+    return [kept[i] for i in order[:top_k]], stats
+
+if __name__ == "__main__":
+    print(f"Exported reranker to {export_onnx()}")
@@ -0,0 +1,236 @@
+"""
+Theme-sharded vector index.
+
+With SHARD_BY_THEME, ingestion builds one complete index directory per theme under
+<INDEX_PATH>/shards/<theme>, each with a few k-means centroids of its vectors
+(centroids.npy), and lists them in <INDEX_PATH>/shards.json. A shard can be rebuilt on
+its own (`python -m src.shards --theme pidana`) without touching the others.
+
+Searches fan out to the shards on a thread pool (FAISS releases the GIL while it
+searches) and the per-shard top-k lists are merged by distance, which every shard
+measures the same way. With a router (SHARD_ROUTER_TOP_N), each query only goes to the
+shards whose centroids are most similar to it.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from . import ann, config, ingestion
+from .chunk_store import ChunkStoreFAISS
+from .metadata_index import MetadataIndex
+
+SHARDS_FILE = "shards.json"
+SHARDS_DIR = "shards"
+CENTROIDS_FILE = "centroids.npy"
+
+def shard_dir(theme):
+    """Directory name of a theme's shard ("hak asasi manusia" -> "hak-asasi-manusia")."""
+    return re.sub(r"[^0-9a-z]+", "-", theme.lower()).strip("-") or "untitled"
+
+def load_shards_manifest(index_path):
+    path = os.path.join(index_path, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_shards_manifest(index_path, manifest):
+    os.makedirs(index_path, exist_ok=True)
+    path = os.path.join(index_path, SHARDS_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _unit(vectors):
+    vectors = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def router_centroids(vectors, count=None):
+    """Up to `count` unit-length k-means centroids summarising a shard's vectors."""
+    count = count or config.SHARD_ROUTER_CENTROIDS
+    vectors = _unit(vectors)
+    # Same ~39 points per centroid as IVF training; tiny shards get their mean.
+    count = min(count, len(vectors) // 39)
+    if count <= 1:
+        return _unit(vectors.mean(axis=0, keepdims=True))
+    kmeans = faiss.Kmeans(vectors.shape[1], count, niter=20, seed=1234, spherical=True)
+    kmeans.train(vectors)
+    return _unit(kmeans.centroids)
+
+def corpus_stripper(index_path):
+    """
+    Boilerplate stripper shared by all shards, learned once on the whole corpus: a
+    single theme's sample would also strip phrases that are merely common in it.
+    """
+    if not config.CLEAN_BOILERPLATE:
+        return None
+    if os.path.exists(os.path.join(index_path, ingestion.BOILERPLATE_FILE)):
+        return ingestion.BoilerplateStripper.load(index_path)
+    print("Learning boilerplate from a sample of all articles...")
+    stripper = ingestion.fit_boilerplate(ingestion.iter_entries())
+    stripper.save(index_path)
+    return stripper
+
+def build_shard(theme, index_path=None, stripper=None):
+    """(Re)builds the shard of `theme` and records it in shards.json; other shards are untouched."""
+    index_path = index_path or config.INDEX_PATH
+    name = shard_dir(theme)
+    path = os.path.join(index_path, SHARDS_DIR, name)
+    print(f"=== Shard '{theme}' -> {path} ===")
+    stripper = stripper or corpus_stripper(index_path)
+    vectorstore = ingestion.build_index(path, theme=theme, stripper=stripper)
+    centroids = router_centroids(ann.stored_vectors(vectorstore.index))
+    np.save(os.path.join(path, CENTROIDS_FILE), centroids)
+
+    manifest = load_shards_manifest(index_path) or {"shards": {}}
+    manifest["shards"][theme] = {
+        "dir": name,
+        "chunks": vectorstore.index.ntotal,
+        "build_id": ingestion.load_manifest(path)["build_id"],
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    save_shards_manifest(index_path, manifest)
+    return manifest["shards"][theme]
+
+def build_shards(index_path=None, themes=None):
+    """Builds one shard per theme found in the data (or per theme in `themes`)."""
+    index_path = index_path or config.INDEX_PATH
+    if themes is None:
+        themes = sorted({entry.get("theme", "") for entry in ingestion.iter_entries()})
+    stripper = corpus_stripper(index_path)
+    for theme in themes:
+        build_shard(theme, index_path, stripper)
+    print(f"Built {len(themes)} shards.")
+
+class Shard:
+    def __init__(self, theme, vectorstore, centroids):
+        self.theme = theme
+        self.vectorstore = vectorstore
+        self.centroids = centroids
+        self._metadata_index = None
+
+    def metadata_index(self):
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex.build(self.vectorstore)
+        return self._metadata_index
+
+    def search(self, matrix, k, filters=None):
+        """(doc, distance) lists for each row of `matrix`, best first."""
+        index = self.vectorstore.index
+        if filters:
+            distances, positions = ann.filtered_search(index, matrix, k, self.metadata_index().mask(filters))
+        else:
+            distances, positions = index.search(matrix, k)
+        docstore, id_map = self.vectorstore.docstore, self.vectorstore.index_to_docstore_id
+        return [
+            [(docstore.search(id_map[i]), float(d)) for d, i in zip(row_distances, row) if i != -1]
+            for row_distances, row in zip(distances, positions)
+        ]
+
+class ShardedIndex:
+    def __init__(self, shards, version, workers=None):
+        self.shards = shards
+        self.version = version
+        self._pool = ThreadPoolExecutor(max_workers=workers or config.SHARD_WORKERS, thread_name_prefix="shard")
+        self._centroids = np.concatenate([s.centroids for s in shards])
+        # Start row of each shard's block of centroids, for per-shard max similarity.
+        self._centroid_starts = np.cumsum([0] + [len(s.centroids) for s in shards[:-1]])
+        self.searches = 0
+        self.shard_searches = 0
+
+    @classmethod
+    def exists(cls, index_path):
+        return os.path.exists(os.path.join(index_path, SHARDS_FILE))
+
+    @classmethod
+    def load(cls, index_path, embeddings):
+        manifest = load_shards_manifest(index_path)
+        shards = []
+        for theme, info in sorted(manifest["shards"].items()):
+            path = os.path.join(index_path, SHARDS_DIR, info["dir"])
+            vectorstore = ChunkStoreFAISS.load_local(path, embeddings)
+            shards.append(Shard(theme, vectorstore, np.load(os.path.join(path, CENTROIDS_FILE))))
+        if not shards:
+            raise FileNotFoundError(f"{SHARDS_FILE} in {index_path} lists no shards.")
+        build_ids = ",".join(manifest["shards"][s.theme]["build_id"] for s in shards)
+        version = "shards:" + hashlib.sha1(build_ids.encode("utf-8")).hexdigest()[:12]
+        return cls(shards, version)
+
+    def __len__(self):
+        return sum(s.vectorstore.index.ntotal for s in self.shards)
+
+    def relevance_score_fn(self):
+        return self.shards[0].vectorstore._select_relevance_score_fn()
+
+    def set_search_params(self, ef_search=None, nprobe=None):
+        for shard in self.shards:
+            ann.set_search_params(shard.vectorstore.index, ef_search=ef_search, nprobe=nprobe)
+
+    def route(self, matrix, top_n, allowed=None):
+        """For each query row, the `top_n` allowed shard numbers with the most similar centroid."""
+        similarity = _unit(matrix) @ self._centroids.T
+        per_shard = np.maximum.reduceat(similarity, self._centroid_starts, axis=1)
+        if allowed is not None:
+            blocked = np.ones(len(self.shards), dtype=bool)
+            blocked[allowed] = False
+            per_shard[:, blocked] = -np.inf
+        order = np.argsort(-per_shard, axis=1, kind="stable")[:, :top_n]
+        return [list(row) for row in order]
+
+    def search(self, vectors, k, filters=None, top_n=None):
+        """
+        (doc, distance) lists per query vector, merged over the shards each query is
+        routed to. A theme filter limits the fan-out to that theme's shards.
+        """
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if self.shards[0].vectorstore._normalize_L2:
+            matrix = _unit(matrix)
+        top_n = config.SHARD_ROUTER_TOP_N if top_n is None else top_n
+        allowed = list(range(len(self.shards)))
+        if filters and "theme" in filters:
+            allowed = [i for i in allowed if self.shards[i].theme in filters["theme"]]
+        if top_n and top_n < len(allowed):
+            routes = self.route(matrix, top_n, allowed)
+        else:
+            routes = [allowed] * len(matrix)
+
+        rows_per_shard = {}
+        for row, shard_numbers in enumerate(routes):
+            for number in shard_numbers:
+                rows_per_shard.setdefault(number, []).append(row)
+        tasks = {
+            number: (self.shards[number], matrix[rows], k, filters) for number, rows in rows_per_shard.items()
+        }
+        if len(tasks) == 1:
+            found = {number: Shard.search(*args) for number, args in tasks.items()}
+        else:
+            futures = {number: self._pool.submit(Shard.search, *args) for number, args in tasks.items()}
+            found = {number: future.result() for number, future in futures.items()}
+
+        merged = [[] for _ in range(len(matrix))]
+        for number, rows in rows_per_shard.items():
+            for row, pairs in zip(rows, found[number]):
+                merged[row].extend(pairs)
+        self.searches += len(matrix)
+        self.shard_searches += sum(len(rows) for rows in rows_per_shard.values())
+        return [sorted(pairs, key=lambda pair: pair[1])[:k] for pairs in merged]
+
+    def describe(self):
+        return {
+            "shards": len(self.shards),
+            "chunks": len(self),
+            "router_top_n": config.SHARD_ROUTER_TOP_N or "all",
+            "avg_fanout": round(self.shard_searches / self.searches, 2) if self.searches else None
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the theme-sharded index.")
+    parser.add_argument("--theme", action="append", help="Rebuild only this theme's shard (repeatable)")
+    args = parser.parse_args()
+    build_shards(themes=args.theme)
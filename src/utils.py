@@ -1,3 +1,16 @@
+import json
+import re
+
+def format_metadata_header(meta):
+    """The metadata header (title, date, category, tags) that opens an article in the prompt."""
+    # Using the keys from the User's provided schema: title, publish_date, theme, tags
+    return (
+        f"[JUDUL]: {meta.get('title', 'Unknown')}\n"
+        f"[TANGGAL TERBIT]: {meta.get('publish_date', 'Unknown')}\n"
+        f"[KATEGORI]: {meta.get('theme', 'General')} | [TAGS]: {meta.get('tags', [])}\n"
+        f"[ISI KONTEN]:\n"
+    )
+
 def format_docs_with_metadata(docs):
     """
     Formats the retrieved documents into a string with rich metadata headers.
@@ -10,15 +23,98 @@ def format_docs_with_metadata(docs):
     """
     formatted = []
     for d in docs:
-        meta = d.metadata
         # Format text with Metadata Header so LLM is context-aware
-        # Using the keys from the User's provided schema: title, publish_date, theme, tags
         text = (
-            f"[JUDUL]: {meta.get('title', 'Unknown')}\n"
-            f"[TANGGAL TERBIT]: {meta.get('publish_date', 'Unknown')}\n"
-            f"[KATEGORI]: {meta.get('theme', 'General')} | [TAGS]: {meta.get('tags', [])}\n"
-            f"[ISI KONTEN]:\n{d.page_content}\n"
+            f"{format_metadata_header(d.metadata)}{d.page_content}\n"
             f"--------------------------------------------------"
         )
         formatted.append(text)
     return "\n\n".join(formatted)
+
+
+def strip_think(content):
+    """Removes <think>...</think> reasoning blocks emitted by reasoning models."""
+    return re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL).strip()
+
+def doc_key(doc):
+    """Identity of a chunk across separate searches (chunks carry no id in metadata)."""
+    return (doc.metadata.get("link", ""), doc.page_content)
+
+def extract_references(docs):
+    """Deduplicated article references (one per link) in ranking order."""
+    references = []
+    seen_urls = set()
+    for d in docs:
+        url = d.metadata.get("link", "#")
+        if url in seen_urls:
+            continue
+        seen_urls.add(url)
+        
+        ref = {
+            "title": d.metadata.get("title", "Unknown Title"),
+            "url": url,
+            "publish_date": d.metadata.get("publish_date", "Unknown Date"),
+            "theme": d.metadata.get("theme", "General")
+        }
+        references.append(ref)
+    return references
+
+class ThinkFilter:
+    """
+    Incremental version of strip_think for streamed output.
+
+    Text inside <think>...</think> is dropped even when a tag is split across
+    chunks; a possible partial tag at the end of a chunk is held back until the
+    next chunk resolves it.
+    """
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_think = False
+        self._started = False
+
+    def _partial_tag_len(self, text, tag):
+        for n in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:n]):
+                return n
+        return 0
+
+    def feed(self, chunk):
+        """Returns the visible part of `chunk` that is safe to emit now."""
+        self._buffer += chunk
+        out = []
+        while self._buffer:
+            tag = self.CLOSE if self._in_think else self.OPEN
+            idx = self._buffer.find(tag)
+            if idx >= 0:
+                if not self._in_think:
+                    out.append(self._buffer[:idx])
+                self._buffer = self._buffer[idx + len(tag):]
+                self._in_think = not self._in_think
+                continue
+            hold = self._partial_tag_len(self._buffer, tag)
+            if not self._in_think:
+                out.append(self._buffer[:len(self._buffer) - hold])
+            self._buffer = self._buffer[len(self._buffer) - hold:]
+            break
+        return self._emit("".join(out))
+
+    def flush(self):
+        """Emits whatever is still held back once the stream has ended."""
+        rest = "" if self._in_think else self._buffer
+        self._buffer = ""
+        return self._emit(rest)
+
+    def _emit(self, text):
+        # Match strip_think: no leading whitespace before the answer starts.
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+def format_sse(event, data):
+    """Serialises one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
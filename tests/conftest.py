@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Note: We must insert root into path to import modules correctly
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
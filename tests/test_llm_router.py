@@ -0,0 +1,71 @@
+import time
+import pytest
+from src import config
+from src.fakes import StubLLMServer
+from src.llm_router import LLMDeadlineExceeded, LLMRouter, build_llm
+
+PROMPT = "Pertanyaan User: apa syarat sah perjanjian?\n\nOutput: Query baku saja."
+
+@pytest.fixture
+def servers(monkeypatch):
+    """Stub Groq (primary) and Gemini servers, with the router configured against them."""
+    primary = StubLLMServer(latency=0.02, seed=1).start()
+    secondary = StubLLMServer(latency=0.02, seed=2).start()
+    for name, value in {
+        "LLM_PROVIDER": "groq", "GROQ_API_KEY": "stub", "GOOGLE_API_KEY": "stub", "GROQ_MODEL": "stub-groq",
+        "GEMINI_MODEL": "stub-gemini", "GROQ_BASE_URL": primary.url, "GEMINI_BASE_URL": secondary.url,
+        "LLM_ROUTER": True, "LLM_FAILOVER": True, "LLM_DEADLINE": 5.0, "LLM_HEDGE_PERCENTILE": 0.0,
+        "LLM_HEDGE_MIN_SAMPLES": 5, "LLM_BREAKER_FAILURES": 100
+    }.items():
+        monkeypatch.setattr(config, name, value)
+    yield primary, secondary
+    primary.stop()
+    secondary.stop()
+
+def answered_by(message):
+    return message.response_metadata.get("llm_provider")
+
+def test_router_is_opt_in(servers, monkeypatch):
+    monkeypatch.setattr(config, "LLM_ROUTER", False)
+    assert not isinstance(build_llm(), LLMRouter)
+
+def test_fails_over_to_the_next_provider(servers):
+    primary, secondary = servers
+    primary.error_rate = 1.0
+    llm = build_llm().route("reformulate")
+    assert answered_by(llm.invoke(PROMPT)) == "gemini"
+    # One attempt per provider: the SDKs do not retry the 429 themselves.
+    assert primary.requests == 1
+    assert secondary.requests == 1
+
+def test_hedges_a_slow_primary(servers, monkeypatch):
+    primary, secondary = servers
+    monkeypatch.setattr(config, "LLM_HEDGE_PERCENTILE", 95.0)
+    llm = build_llm().route("reformulate")
+    for _ in range(config.LLM_HEDGE_MIN_SAMPLES):
+        assert answered_by(llm.invoke(PROMPT)) == "groq"
+    assert secondary.requests == 0
+
+    primary.latency = 3.0
+    start = time.perf_counter()
+    message = llm.invoke(PROMPT)
+    assert answered_by(message) == "gemini"
+    assert time.perf_counter() - start < 1.5
+    assert secondary.requests == 1
+
+def test_deadline_bounds_the_whole_call(servers, monkeypatch):
+    primary, secondary = servers
+    primary.latency = secondary.latency = 3.0
+    monkeypatch.setattr(config, "LLM_DEADLINE", 0.5)
+    llm = build_llm().route("generate")
+    start = time.perf_counter()
+    with pytest.raises(LLMDeadlineExceeded):
+        llm.invoke(PROMPT)
+    assert time.perf_counter() - start < 1.5
+
+def test_streams_fail_over_before_the_first_chunk(servers):
+    primary, secondary = servers
+    primary.error_rate = 1.0
+    llm = build_llm().route("generate")
+    assert "".join(chunk.content for chunk in llm.stream(PROMPT))
+    assert secondary.requests == 1
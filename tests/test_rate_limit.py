@@ -0,0 +1,86 @@
+import pytest
+from src.embedding_cache import EmbeddingCache
+from src.embedding_scheduler import ScheduledEmbeddings
+from src.rate_limit import RateLimitError, is_provider_failure, is_rate_limit_error, retry_after_seconds
+
+class WrapperError(Exception):
+    """Stands in for SDK wrappers that re-raise the API error `from` it."""
+
+class StatusError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+def wrapped(cause, explicit=True):
+    try:
+        if explicit:
+            raise WrapperError("Error embedding content") from cause
+        try:
+            raise cause
+        except Exception:
+            raise WrapperError("Error embedding content")
+    except WrapperError as e:
+        return e
+
+@pytest.mark.parametrize("cause", [
+    StatusError("The model is overloaded.", 503),
+    Exception("503 UNAVAILABLE. The model is overloaded."),
+    Exception("500 INTERNAL. An internal error has occurred."),
+    Exception("504 DEADLINE_EXCEEDED. Deadline expired before operation could complete."),
+    Exception("Request timed out."),
+    TimeoutError(),
+])
+@pytest.mark.parametrize("explicit", [True, False])
+def test_wrapped_server_errors_are_provider_failures(cause, explicit):
+    assert not is_provider_failure(WrapperError("Error embedding content"))
+    assert is_provider_failure(wrapped(cause, explicit))
+
+def test_wrapped_rate_limit_keeps_retry_after():
+    error = wrapped(RateLimitError(retry_after=7))
+    assert is_rate_limit_error(error)
+    assert is_provider_failure(error)
+    assert retry_after_seconds(error) == 7
+
+@pytest.mark.parametrize("cause", [
+    StatusError("API key not valid.", 400),
+    Exception("400 INVALID_ARGUMENT. Request contains an invalid argument."),
+    ValueError("Input of 512 tokens is too long"),
+])
+def test_request_errors_are_not_provider_failures(cause):
+    assert not is_provider_failure(wrapped(cause))
+
+def test_google_server_error_wrapped_by_langchain():
+    errors = pytest.importorskip("google.genai.errors")
+    common = pytest.importorskip("langchain_google_genai._common")
+    server_error = errors.ServerError(503, {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}})
+    try:
+        raise common.GoogleGenerativeAIError(f"Error embedding content: {server_error}") from server_error
+    except common.GoogleGenerativeAIError as e:
+        assert is_provider_failure(e)
+
+class FlakyEmbeddings:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [[0.0] for _ in texts]
+
+def scheduler(embeddings, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"), "flaky")
+    return ScheduledEmbeddings(embeddings, cache, max_retries=3, requests_per_minute=0, tokens_per_minute=0,
+                               verbose=False, sleep=lambda delay: None)
+
+def test_scheduler_retries_wrapped_server_errors(tmp_path):
+    embeddings = FlakyEmbeddings([wrapped(StatusError("overloaded", 503)), wrapped(TimeoutError())])
+    assert scheduler(embeddings, tmp_path)._embed_batch(["a", "b"]) == [[0.0], [0.0]]
+    assert embeddings.calls == 3
+
+def test_scheduler_raises_request_errors_at_once(tmp_path):
+    embeddings = FlakyEmbeddings([wrapped(StatusError("API key not valid.", 400))])
+    with pytest.raises(WrapperError):
+        scheduler(embeddings, tmp_path)._embed_batch(["a"])
+    assert embeddings.calls == 1
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+transformers = pytest.importorskip("transformers")
+sentence_transformers = pytest.importorskip("sentence_transformers")
+
+from src.reranker import OnnxReranker, export_onnx
+
+PAIRS = [
+    ("syarat sah perjanjian", "perjanjian sah bila ada kesepakatan dan kecakapan para pihak"),
+    ("syarat sah perjanjian", "izin usaha diajukan melalui sistem perizinan berusaha"),
+    ("hak waris anak angkat", "anak angkat dapat menerima wasiat wajibah"),
+    ("pidana pencurian", "pencurian diancam pidana penjara"),
+]
+WORDS = sorted({w for pair in PAIRS for text in pair for w in text.split()})
+ACTIVATIONS = {
+    "default": None,
+    "identity": {"activation_fn": "torch.nn.modules.linear.Identity"},
+    "sigmoid": {"activation_fn": "torch.nn.modules.activation.Sigmoid"},
+    "legacy_identity": "torch.nn.modules.linear.Identity",
+}
+
+def tiny_cross_encoder(path, activation):
+    """A randomly initialised 2-layer BERT cross-encoder with a word-level vocab."""
+    path.mkdir()
+    vocab = path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS), encoding="utf-8")
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(vocab))
+    model_config = transformers.BertConfig(
+        vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, max_position_embeddings=64, num_labels=1
+    )
+    if isinstance(activation, dict):
+        model_config.sentence_transformers = activation
+    elif activation is not None:
+        model_config.sbert_ce_default_activation_function = activation
+    torch.manual_seed(0)
+    model = transformers.BertForSequenceClassification(model_config)
+    model.save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return str(path)
+
+@pytest.mark.parametrize("activation", ACTIVATIONS.values(), ids=ACTIVATIONS.keys())
+def test_onnx_scores_match_cross_encoder(tmp_path, activation):
+    model_dir = tiny_cross_encoder(tmp_path / "model", activation)
+    onnx_dir = str(tmp_path / "onnx")
+    export_onnx(model_dir, onnx_dir, quantize=False)
+
+    expected = sentence_transformers.CrossEncoder(model_dir, max_length=64).predict(PAIRS, show_progress_bar=False)
+    scores = OnnxReranker(model_dir, onnx_dir, quantize=False, max_length=64, batch_size=3).predict(PAIRS)
+    np.testing.assert_allclose(scores, expected, atol=1e-4)
+    if activation in (None, ACTIVATIONS["sigmoid"]):
+        assert ((scores > 0) & (scores < 1)).all()